@@ -0,0 +1,56 @@
+"""
+Benchmark speed and memory of the averaging kernels at each Precision.
+
+Run from the repository root with
+
+    PYTHONPATH=src python benchmarks/bench_averaging.py [--shape 256 512 512] [--dtype uint16]
+
+Peak memory is the largest numpy allocation tracked by tracemalloc while the
+kernel runs (input excluded), output bytes are the size of the result.
+"""
+import argparse
+
+import numpy as np
+
+from bench_suite import measure
+
+from napari_cool_tools_vol_proc._core.averaging import EdgeMode, Precision, block_mean, sliding_mean
+
+SHAPES = ((128, 512, 512), (512, 1024, 512))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--shape", type=int, nargs=3, action="append", help="volume shape, may be repeated")
+    parser.add_argument("--dtype", default="uint16")
+    parser.add_argument("--scans-per-avg", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    rng = np.random.default_rng(0)
+    info = np.iinfo(args.dtype) if np.issubdtype(args.dtype, np.integer) else None
+    print(f"{'kernel':<14}{'shape':<18}{'precision':<10}{'seconds':>9}{'Mvox/s':>9}{'peak MB':>9}{'out MB':>9}")
+    for shape in args.shape or SHAPES:
+        shape = tuple(shape)
+        if info is None:
+            data = rng.random(shape, dtype=np.float32).astype(args.dtype)
+        else:
+            data = rng.integers(info.min, info.max, shape, dtype=args.dtype, endpoint=True)
+
+        for precision in Precision:
+            if precision == Precision.INTEGER and info is None:
+                continue
+            kernels = {
+                "block_mean": (block_mean, dict(block=args.scans_per_avg)),
+                "sliding_mean": (sliding_mean, dict(window=args.scans_per_avg, edge_mode=EdgeMode.SHRINK)),
+            }
+            for name, (func, kwargs) in kernels.items():
+                elapsed, peak, result = measure(func, data, precision=precision, **kwargs)
+                print(
+                    f"{name:<14}{str(shape):<18}{precision.value:<10}{elapsed:>9.3f}"
+                    f"{data.size / elapsed / 1e6:>9.1f}{peak / 2**20:>9.1f}{result.nbytes / 2**20:>9.1f}"
+                )
+                del result
+
+
+if __name__ == "__main__":
+    main()
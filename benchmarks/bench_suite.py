@@ -0,0 +1,200 @@
+"""
+Benchmark the compute behind every plugin command on synthetic OCT volumes.
+
+Run from the repository root with
+
+    PYTHONPATH=src python benchmarks/bench_suite.py run --sizes small medium --output results.json
+    PYTHONPATH=src python benchmarks/bench_suite.py compare baseline.json results.json
+
+Commands are benchmarked through the kernels they call, so no display or napari
+install is needed. Sizes range from a small B-scan stack held in memory to
+multi-GB volumes memory mapped from --data-dir, where they are generated once
+and reused. Each case reports the best wall time of --repeat runs, throughput
+in input voxels per second, the peak memory allocated by numpy while it runs
+(tracemalloc, pages of memory mapped inputs excluded) and the size of its
+output. Results are stored as JSON with the package version and git commit so
+runs of different versions can be compared.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+
+from synthetic import cached_volumes
+
+from napari_cool_tools_vol_proc import __version__
+from napari_cool_tools_vol_proc._core.angiography import flow_volume
+from napari_cool_tools_vol_proc._core.averaging import block_mean, sliding_mean
+from napari_cool_tools_vol_proc._core.chunking import iter_chunks
+from napari_cool_tools_vol_proc._core.labels import isolate_labels, label_statistics
+from napari_cool_tools_vol_proc._core.masking import project_mask
+from napari_cool_tools_vol_proc._core.projection import SlabMaxIndex, projections
+from napari_cool_tools_vol_proc._core.shaping import reshape
+from napari_cool_tools_vol_proc._core.stacking import VirtualStack
+from napari_cool_tools_vol_proc._core.surfaces import detect_surface
+
+# name: (shape, memory mapped)
+SIZES = {
+    "small": ((32, 256, 256), False),
+    "medium": ((128, 512, 512), False),
+    "large": ((256, 1024, 512), True),
+    "xlarge": ((512, 1024, 1024), True),
+    "huge": ((1536, 1024, 1024), True),
+}
+
+# command: function of (volume, labels, workers) running the command's computation
+CASES = {
+    "average_bscans": lambda vol, lbl, workers: block_mean(vol, 5, workers=workers),
+    "average_per_bscan": lambda vol, lbl, workers: sliding_mean(vol, 5, workers=workers),
+    "mip": lambda vol, lbl, workers: projections(vol, planes=("yx", "zy", "xz"), workers=workers),
+    "slab_mip": lambda vol, lbl, workers: SlabMaxIndex(vol, axis=1).levels,
+    "octa_flow": lambda vol, lbl, workers: flow_volume(vol, mscans=2, workers=workers),
+    "reshape_vol": lambda vol, lbl, workers: reshape(vol, "(-1,2,:,:)"),
+    "split_vol": lambda vol, lbl, workers: [np.array(chunk.data) for chunk in iter_chunks(vol, 4, axis=1)],
+    "stack_selected": lambda vol, lbl, workers: VirtualStack([chunk.data for chunk in iter_chunks(vol, 4, axis=0)]).materialize(),
+    "isolate_labeled_volume": lambda vol, lbl, workers: [volume for _, volume, _ in isolate_labels(vol, lbl, [1], crop=False, workers=workers)],
+    "isolate_labeled_volumes": lambda vol, lbl, workers: [volume for _, volume, _ in isolate_labels(vol, lbl, [1, 2, 3], workers=workers)],
+    "calc_label_volumes": lambda vol, lbl, workers: label_statistics(lbl, workers=workers),
+    "detect_surface": lambda vol, lbl, workers: detect_surface(vol, depth_axis=1, max_jump=2, workers=workers),
+    "project_mask": lambda vol, lbl, workers: project_mask(np.eye(lbl.shape[0], lbl.shape[2], dtype=bool), lbl, mask_axes=(0, 2), workers=workers),
+}
+
+
+def result_bytes(result) -> int:
+    """Bytes held by the arrays of a (nested) result."""
+    if isinstance(result, np.ndarray):
+        return result.nbytes
+    if isinstance(result, dict):
+        return sum(result_bytes(value) for value in result.values())
+    if isinstance(result, (list, tuple)):
+        return sum(result_bytes(value) for value in result)
+    return 0
+
+
+def measure(func, *args, **kwargs):
+    """Run func once returning (seconds, peak traced bytes, result)."""
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak, result
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=Path(__file__).parent, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def run(args) -> dict:
+    data_dir = Path(args.data_dir) if args.data_dir else Path(tempfile.gettempdir()) / "napari_cool_tools_bench"
+    cases = args.cases or list(CASES)
+    report = {
+        "meta": {
+            "version": __version__,
+            "commit": _git_commit(),
+            "numpy": np.__version__,
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "workers": args.workers,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": [],
+    }
+    print(f"{'case':<26}{'size':<8}{'seconds':>9}{'Mvox/s':>9}{'peak MB':>9}{'out MB':>9}")
+    for size in args.sizes:
+        shape, memmap = SIZES[size]
+        vol, lbl = cached_volumes(shape, args.dtype, data_dir if memmap or args.memmap else None)
+        for case in cases:
+            times, peak, out_bytes = [], 0, 0
+            for repeat in range(args.repeat):
+                elapsed, traced, result = measure(CASES[case], vol, lbl, args.workers)
+                times.append(elapsed)
+                if repeat == 0:
+                    peak, out_bytes = traced, result_bytes(result)
+                del result
+            entry = {
+                "case": case,
+                "size": size,
+                "shape": list(shape),
+                "dtype": args.dtype,
+                "memmap": bool(memmap or args.memmap),
+                "seconds": min(times),
+                "voxels_per_s": vol.size / min(times),
+                "peak_mb": peak / 2**20,
+                "out_mb": out_bytes / 2**20,
+            }
+            report["results"].append(entry)
+            print(f"{case:<26}{size:<8}{entry['seconds']:>9.3f}{entry['voxels_per_s'] / 1e6:>9.1f}"
+                  f"{entry['peak_mb']:>9.1f}{entry['out_mb']:>9.1f}")
+        del vol, lbl
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2))
+    return report
+
+
+def compare(args) -> int:
+    """Print time and memory ratios new/old per case, returning 1 if any case regressed past the threshold."""
+    old, new = (json.loads(Path(path).read_text()) for path in (args.old, args.new))
+    baseline = {(entry["case"], entry["size"]): entry for entry in old["results"]}
+    print(f"{old['meta']['commit']} -> {new['meta']['commit']}")
+    print(f"{'case':<26}{'size':<8}{'old s':>9}{'new s':>9}{'time x':>8}{'peak x':>8}")
+    regressed = False
+    for entry in new["results"]:
+        before = baseline.get((entry["case"], entry["size"]))
+        if before is None:
+            continue
+        time_ratio = entry["seconds"] / max(before["seconds"], 1e-9)
+        peak_ratio = entry["peak_mb"] / max(before["peak_mb"], 1e-6)
+        flag = ""
+        if time_ratio > 1 + args.threshold or peak_ratio > 1 + args.threshold:
+            flag = "  <- regression"
+            regressed = True
+        print(f"{entry['case']:<26}{entry['size']:<8}{before['seconds']:>9.3f}{entry['seconds']:>9.3f}"
+              f"{time_ratio:>8.2f}{peak_ratio:>8.2f}{flag}")
+    return 1 if regressed else 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="run the benchmarks")
+    run_parser.add_argument("--sizes", nargs="+", default=["small", "medium"], choices=list(SIZES))
+    run_parser.add_argument("--cases", nargs="+", choices=list(CASES), help="cases to run, all by default")
+    run_parser.add_argument("--dtype", default="uint16")
+    run_parser.add_argument("--workers", type=int, default=0, help="worker threads, 0 for one per CPU core")
+    run_parser.add_argument("--repeat", type=int, default=3)
+    run_parser.add_argument("--memmap", action="store_true", help="memory map every size, not only the large ones")
+    run_parser.add_argument("--data-dir", help="directory caching the generated memmapped volumes")
+    run_parser.add_argument("--output", help="JSON file the results are written to")
+
+    compare_parser = commands.add_parser("compare", help="compare two result files")
+    compare_parser.add_argument("old")
+    compare_parser.add_argument("new")
+    compare_parser.add_argument("--threshold", type=float, default=0.1, help="relative slow down or memory growth reported as a regression")
+
+    args = parser.parse_args(argv)
+    if args.command == "run":
+        run(args)
+        return 0
+    return compare(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,93 @@
+"""
+Synthetic OCT-like volumes and matching label volumes for benchmarks.
+
+Volumes have the (B-scans, depth, width) layout of the plugin: a few curved
+retinal layers with depth dependent brightness, multiplied by exponential
+speckle over a noise floor. Label volumes assign one label per layer. Volumes
+are generated B-scan block by block, so multi-GB volumes can be written
+straight into .npy memmaps without holding them in memory.
+"""
+from pathlib import Path
+from typing import Optional, Tuple
+
+import numpy as np
+
+# (relative depth offset from the retinal surface, thickness, brightness) of each layer
+LAYERS = ((0.00, 0.03, 1.0), (0.03, 0.06, 0.45), (0.09, 0.05, 0.7), (0.14, 0.08, 0.35), (0.22, 0.04, 0.9))
+
+BLOCK_BYTES = 64 * 2**20
+
+
+def _surface(start:int, stop:int, n_bscans:int, depth:int, width:int) -> np.ndarray:
+    # depth of the retinal surface for B-scans [start, stop), a bowl shaped like a fundus curvature
+    b = (np.arange(start, stop, dtype=np.float32)[:, None] / max(n_bscans - 1, 1)) - 0.5
+    x = (np.arange(width, dtype=np.float32)[None, :] / max(width - 1, 1)) - 0.5
+    return depth * (0.25 + 0.2 * (b * b + x * x))
+
+
+def _allocate(shape:tuple, dtype, path:Optional[Path]):
+    if path is None:
+        return np.empty(shape, dtype=dtype)
+    return np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=shape)
+
+
+def _block_len(shape:tuple) -> int:
+    return max(1, BLOCK_BYTES // (4 * int(np.prod(shape[1:]))))
+
+
+def oct_volume(shape:Tuple[int, int, int], dtype="uint16", seed:int=0, path:Optional[Path]=None):
+    """Generate an OCT-like volume, in memory or as a .npy memmap at path."""
+    n_bscans, depth, width = shape
+    dtype = np.dtype(dtype)
+    out = _allocate(shape, dtype, path)
+    rng = np.random.default_rng(seed)
+    scale = float(np.iinfo(dtype).max) * 0.6 if dtype.kind in "iu" else 1.0
+    z = np.arange(depth, dtype=np.float32)[None, :, None]
+    for start in range(0, n_bscans, _block_len(shape)):
+        stop = min(n_bscans, start + _block_len(shape))
+        surface = _surface(start, stop, n_bscans, depth, width)[:, None, :]
+        signal = np.full((stop - start, depth, width), 0.05, dtype=np.float32)
+        for offset, thickness, brightness in LAYERS:
+            top = surface + offset * depth
+            inside = (z >= top) & (z < top + thickness * depth)
+            signal += np.float32(brightness) * inside
+        signal *= rng.standard_exponential(signal.shape, dtype=np.float32)
+        np.clip(signal * np.float32(scale / 3), 0, scale if dtype.kind in "iu" else None, out=signal)
+        out[start:stop] = signal.astype(dtype)
+    if isinstance(out, np.memmap):
+        out.flush()
+    return out
+
+
+def label_volume(shape:Tuple[int, int, int], dtype="uint8", path:Optional[Path]=None):
+    """Generate labels 1..len(LAYERS) for the layers of oct_volume of the same shape, 0 elsewhere."""
+    n_bscans, depth, width = shape
+    out = _allocate(shape, dtype, path)
+    z = np.arange(depth, dtype=np.float32)[None, :, None]
+    for start in range(0, n_bscans, _block_len(shape)):
+        stop = min(n_bscans, start + _block_len(shape))
+        surface = _surface(start, stop, n_bscans, depth, width)[:, None, :]
+        labels = np.zeros((stop - start, depth, width), dtype=dtype)
+        for label, (offset, thickness, _) in enumerate(LAYERS, start=1):
+            top = surface + offset * depth
+            labels[(z >= top) & (z < top + thickness * depth)] = label
+        out[start:stop] = labels
+    if isinstance(out, np.memmap):
+        out.flush()
+    return out
+
+
+def cached_volumes(shape:Tuple[int, int, int], dtype="uint16", directory:Optional[Path]=None, seed:int=0):
+    """(OCT volume, label volume) of shape, as memmaps reused across runs when directory is given."""
+    if directory is None:
+        return oct_volume(shape, dtype, seed), label_volume(shape)
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    stem = "x".join(str(n) for n in shape)
+    volume_path = directory / f"oct_{stem}_{np.dtype(dtype).name}_{seed}.npy"
+    labels_path = directory / f"labels_{stem}.npy"
+    if not volume_path.exists():
+        oct_volume(shape, dtype, seed, volume_path)
+    if not labels_path.exists():
+        label_volume(shape, path=labels_path)
+    return np.load(volume_path, mmap_mode="r"), np.load(labels_path, mmap_mode="r")
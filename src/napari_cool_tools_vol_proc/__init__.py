@@ -1,4 +1,15 @@
 __version__ = "0.0.1"
 
 __all__ = (
+    "load_pipeline",
+    "run_batch",
+    "run_volume",
     )
+
+
+def __getattr__(name):
+    # the batch runner pulls in the pipeline loader and the whole _core, it is only imported when used
+    if name in __all__:
+        from . import _batch
+        return getattr(_batch, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,55 @@
+"""
+This module contains code for computing OCT angiography from repeated m-scans
+"""
+from napari_cool_tools_vol_proc._core.angiography import FlowMethod, flow_volume
+from napari_cool_tools_vol_proc._core.instrument import stage
+from napari_cool_tools_vol_proc._napari import add_layer, create_layer, show_info, thread_worker
+
+FLOW_SUFFIX = {
+    FlowMethod.DECORRELATION: "decorr",
+    FlowMethod.SPECKLE_VARIANCE: "sv",
+}
+
+def octa_flow(vol:"napari.layers.Image", mscans:int=3, method:FlowMethod=FlowMethod.DECORRELATION, workers:int=0):
+    """Function computing an angiography flow volume from the repeated m-scans of an OCTA volume.
+    Args:
+        vol (Image): 3D OCTA volume whose consecutive groups of mscans B-scans image the same position,
+            or 4D volume reshaped with reshape_vol '(-1,n,:,:)' with the m-scans along axis 1
+        mscans (int): number of repeated m-scans per position, ignored for 4D volumes
+        method (FlowMethod): decorrelation (on linear amplitude data) or speckle variance
+        workers (int): number of worker threads, 0 for one per CPU core
+
+    Returns:
+        Layer float32 flow volume with one B-scan per position
+    """
+    octa_flow_thread(vol=vol,mscans=mscans,method=method,workers=workers)
+
+    return
+
+@thread_worker(connect={"returned": add_layer})
+def octa_flow_thread(vol:"napari.layers.Image", mscans:int=3, method:FlowMethod=FlowMethod.DECORRELATION, workers:int=0) -> "napari.layers.Layer":
+    """Thread running octa_flow_func."""
+    show_info(f'OCTA flow thread has started')
+    layer = octa_flow_func(vol=vol,mscans=mscans,method=method,workers=workers)
+    show_info(f'OCTA flow thread has completed')
+
+    return layer
+
+def octa_flow_func(vol:"napari.layers.Image", mscans:int=3, method:FlowMethod=FlowMethod.DECORRELATION, workers:int=0) -> "napari.layers.Layer":
+    """Flow volume layer of the m-scans of vol, see octa_flow.
+
+    Returns:
+        Layer float32 flow volume with one B-scan per position
+    """
+    method = FlowMethod(method)
+    data = vol.data
+    repeats = data.shape[1] if data.ndim == 4 else mscans
+    with stage("octa_flow", "flow_volume", bytes_read=data.nbytes, method=method.value):
+        flow = flow_volume(data, mscans=mscans, method=method, workers=workers)
+
+    name = f"{vol.name}_{FLOW_SUFFIX[method]}_{repeats}"
+    add_kwargs = {"name":name}
+    layer_type = "image"
+    layer = create_layer(flow,add_kwargs,layer_type)
+
+    return layer
@@ -1,162 +1,125 @@
 """
 This module contains code for averaging 2D slices
 """
-import numpy as np
-from tqdm import tqdm
-from skimage.measure import block_reduce
-from napari.utils.notifications import show_info
-from napari.layers import Image, Layer
+from napari_cool_tools_vol_proc._core.averaging import EdgeMode, Precision, block_mean_steps, sliding_mean_steps
+from napari_cool_tools_vol_proc._core.cache import detached, result_cache
+from napari_cool_tools_vol_proc._core.instrument import stage
+from napari_cool_tools_vol_proc._core.registration import cached_frame_shifts, cached_window_shifts
+from napari_cool_tools_vol_proc._napari import add_layer, create_layer, show_info, thread_worker, watch_layer
 
-def average_bscans(vol:Image, scans_per_avg:int=5) -> Layer:
+def average_bscans(vol:"napari.layers.Image", scans_per_avg:int=5, precision:Precision=Precision.FLOAT64, workers:int=0, register:bool=False) -> "napari.layers.Layer":
     """Function averaging every scans_per_avg images/B-scans togehter.
+    The volume is streamed in chunks aligned to scans_per_avg so memmapped volumes larger than RAM can be averaged.
     Args:
         vol (Image): vol representing volumetric or image stack data
         scans_per_avg (int): number of consecutive images/B-scans to average together
+        precision (Precision): accumulator/output dtype, float32/float16 or integer (rounded back to the input dtype) shrink the output
+        workers (int): number of worker threads, 0 for one per CPU core
+        register (bool): Flag indicating that images/B-scans should be motion corrected onto the middle image/B-scan of each group before averaging,
+            shifts are estimated by FFT phase correlation against that image/B-scan and cached per volume and scans_per_avg
+
+    Returns:
+        Layer volume where values have been averaged every scans_per_avg images/B-scans along the depth dimension
+    """
+    watch_layer(vol)
+    average_bscans_thread(vol=vol,scans_per_avg=scans_per_avg,precision=precision,workers=workers,register=register)
+
+    return
+
+@thread_worker(connect={"returned": add_layer}, progress={"desc": "Averaging B-scans"})
+def average_bscans_thread(vol:"napari.layers.Image", scans_per_avg:int=5, precision:Precision=Precision.FLOAT64, workers:int=0, register:bool=False) -> "napari.layers.Layer":
+    """Thread running average_bscans_func."""
+    show_info(f'Average B-scans thread has started')
+    layer = yield from average_bscans_func(vol=vol,scans_per_avg=scans_per_avg,precision=precision,workers=workers,register=register)
+    show_info(f'Average B-scans thread has completed')
+
+    return layer
+
+def average_bscans_func(vol:"napari.layers.Image", scans_per_avg:int=5, precision:Precision=Precision.FLOAT64, workers:int=0, register:bool=False) -> "napari.layers.Layer":
+    """Layer of vol averaged every scans_per_avg images/B-scans, see average_bscans.
+
+    Yields:
+        (done, total) progress after every averaged chunk
 
     Returns:
         Layer volume where values have been averaged every scans_per_avg images/B-scans along the depth dimension
     """
     data = vol.data
-    name = f"{vol.name}_avg_{scans_per_avg}"
+    name = f"{vol.name}_avg_{scans_per_avg}{'_reg' if register else ''}"
     add_kwargs = {"name":name}
     layer_type = "image"
-    averaged_array = block_reduce(data, block_size=(scans_per_avg,1,1), func= np.mean)
-    layer = Layer.create(averaged_array,add_kwargs,layer_type)
+    params = {"scans_per_avg":scans_per_avg, "precision":Precision(precision), "register":register}
+    averaged_array = result_cache().get("average_bscans", (data,), params)
+    if averaged_array is None:
+        with stage("average_bscans", "frame_shifts", bytes_read=data.nbytes if register else 0):
+            shifts = cached_frame_shifts(data, axis=0, group=scans_per_avg) if register else None
+        with stage("average_bscans", "block_mean", bytes_read=data.nbytes, scans_per_avg=scans_per_avg):
+            averaged_array = yield from block_mean_steps(data, scans_per_avg, axis=0, precision=precision, workers=workers, shifts=shifts)
+        result_cache().put("average_bscans", (data,), params, averaged_array, shared=True)
+    else:
+        averaged_array = detached(averaged_array)
+    layer = watch_layer(create_layer(averaged_array,add_kwargs,layer_type))
 
     return layer
 
-def average_per_bscan(vol: Image, scans_per_avg: int = 5, axis = 0, trim: bool = True) -> Layer:
+def average_per_bscan(vol:"napari.layers.Image", scans_per_avg: int = 5, axis = 0, edge_mode: EdgeMode = EdgeMode.TRIM, precision: Precision = Precision.FLOAT64, workers: int = 0, register: bool = False) -> "napari.layers.Layer":
     """Function averaging every scans_per_avg images/B-scans centered around each image/b-scan.
     Args:
         vol (Image): vol representing volumetric or image stack data
         scans_per_avg (int): number of consecutive images/B-scans to average together
-        trim: (bool): Flag indicating that ends should be trimmed if image/B-scan index is less than (scans_per_avg - 1 / 2)
+        axis (int): axis along which images/B-scans are averaged
+        edge_mode (EdgeMode): handling of images/B-scans whose index is less than (scans_per_avg - 1) / 2 from either end,
+            trim drops them, copy keeps them unaveraged, reflect/nearest pad the window and shrink averages the available scans
+        precision (Precision): output dtype, float32/float16 or integer (rounded back to the input dtype) shrink the output
+        workers (int): number of worker threads, 0 for one per CPU core
+        register (bool): Flag indicating that images/B-scans should be motion corrected onto the center image/B-scan of each window before averaging,
+            shifts are estimated by FFT phase correlation against that image/B-scan and cached per volume and scans_per_avg
 
     Returns:
         Layer volume where values at each index each slice is an average of the surrounding bscans from vol
     """
+    if scans_per_avg % 2 == 0:
+        show_info(f"scans_per_avg should be an odd number please use an odd number for this value")
+        return
+
+    watch_layer(vol)
+    average_per_bscan_thread(vol=vol,scans_per_avg=scans_per_avg,axis=axis,edge_mode=edge_mode,precision=precision,workers=workers,register=register)
 
+    return
+
+@thread_worker(connect={"returned": add_layer}, progress={"desc": "Averaging per B-scan"})
+def average_per_bscan_thread(vol:"napari.layers.Image", scans_per_avg: int = 5, axis = 0, edge_mode: EdgeMode = EdgeMode.TRIM, precision: Precision = Precision.FLOAT64, workers: int = 0, register: bool = False) -> "napari.layers.Layer":
+    """Thread running average_per_bscan_func."""
+    show_info(f'Average per B-scan thread has started')
+    layer = yield from average_per_bscan_func(vol=vol,scans_per_avg=scans_per_avg,axis=axis,edge_mode=edge_mode,precision=precision,workers=workers,register=register)
+    show_info(f'Average per B-scan thread has completed')
+
+    return layer
+
+def average_per_bscan_func(vol:"napari.layers.Image", scans_per_avg: int = 5, axis = 0, edge_mode: EdgeMode = EdgeMode.TRIM, precision: Precision = Precision.FLOAT64, workers: int = 0, register: bool = False) -> "napari.layers.Layer":
+    """Layer of vol averaged over scans_per_avg images/B-scans centered around each image/B-scan, see average_per_bscan.
+
+    Yields:
+        (done, total) progress after every averaged tile or image/B-scan
+
+    Returns:
+        Layer volume where values at each index each slice is an average of the surrounding bscans from vol
+    """
     data = vol.data
-    name = f"{vol.name}_{scans_per_avg}_per"
+    name = f"{vol.name}_{scans_per_avg}_per{'_reg' if register else ''}"
     add_kwargs = {"name":name}
     layer_type = "image"
-    
-    if scans_per_avg % 2 == 1:
-        offset = int((scans_per_avg - 1) / 2)
-
-        #print(f"shape: {data.shape}, axis: {axis}, length of axis {data.shape[axis]}")
-
-        length = data.shape[axis]
-
-        averaged_slices = []
-
-        for i in tqdm(range(length),desc="Avg per B-scan"):
-            if i >= offset and i < length - offset:
-                #print(f"Averaging slices...\nGenerating new slice by averaging slices {i-offset} through {i+offset} of {length-1}")
-                
-                if axis == 0:
-                    start0 = i-offset
-                    end0 = i+offset+1
-                    start1 = 0
-                    end1 = data.shape[1]
-                    start2 = 0
-                    end2 = data.shape[2]
-                elif axis == 1:
-                    start0 = 0
-                    end0 = data.shape[0]
-                    start1 = i-offset
-                    end1 = i+offset+1
-                    start2 = 0
-                    end2 = data.shape[2]
-                elif axis == 2:
-                    start0 = 0
-                    end0 = data.shape[0]
-                    start1 = 0
-                    end1 = data.shape[1]
-                    start2 = i-offset
-                    end2 = i+offset+1
-                else:
-                    print(f"You done effed up!!")
-
-                averaged_slice = data[start0:end0,start1:end1,start2:end2].mean(axis)                
-                
-                #averaged_slice = data[i-offset:i+offset+1,:,:].mean(axis)
-                averaged_slices.append(averaged_slice)
-            else:
-                if trim == False:
-                    if i < offset:
-
-                        if axis == 0:
-                            start0 = i
-                            end0 = i+1
-                            start1 = 0
-                            end1 = data.shape[1]
-                            start2 = 0
-                            end2 = data.shape[2]
-                        elif axis == 1:
-                            start0 = 0
-                            end0 = data.shape[0]
-                            start1 = i
-                            end1 = i+1
-                            start2 = 0
-                            end2 = data.shape[2]
-                        elif axis == 2:
-                            start0 = 0
-                            end0 = data.shape[0]
-                            start1 = 0
-                            end1 = data.shape[1]
-                            start2 = i
-                            end2 = i+1
-                        else:
-                            print(f"You done effed up!!")
-
-                        averaged_slice = data[start0:end0,start1:end1,start2:end2].squeeze(axis)
-
-                        averaged_slices.append(averaged_slice)    
-
-                        pass
-
-                    elif i >= length - offset:
-
-                        if axis == 0:
-                            start0 = i
-                            end0 = i+1
-                            start1 = 0
-                            end1 = data.shape[1]
-                            start2 = 0
-                            end2 = data.shape[2]
-                        elif axis == 1:
-                            start0 = 0
-                            end0 = data.shape[0]
-                            start1 = i
-                            end1 = i+1
-                            start2 = 0
-                            end2 = data.shape[2]
-                        elif axis == 2:
-                            start0 = 0
-                            end0 = data.shape[0]
-                            start1 = 0
-                            end1 = data.shape[1]
-                            start2 = i
-                            end2 = i+1
-                        else:
-                            print(f"You done effed up!!")
-
-                        averaged_slice = data[start0:end0,start1:end1,start2:end2].squeeze(axis)
-
-                        averaged_slices.append(averaged_slice)  
-
-                        pass
-                else:
-                    #print(f"You shouldn't be here {average_per_bscan}!!")
-                    pass
-
-        averaged_array = np.stack(averaged_slices, axis=axis)
-
-        layer = Layer.create(averaged_array,add_kwargs,layer_type)
-
-        return layer
+
+    params = {"scans_per_avg":scans_per_avg, "axis":axis, "edge_mode":EdgeMode(edge_mode), "precision":Precision(precision), "register":register}
+    averaged_array = result_cache().get("average_per_bscan", (data,), params)
+    if averaged_array is None:
+        with stage("average_per_bscan", "frame_shifts", bytes_read=data.nbytes if register else 0):
+            shifts = cached_window_shifts(data, scans_per_avg, axis=axis) if register else None
+        with stage("average_per_bscan", "sliding_mean", bytes_read=data.nbytes, scans_per_avg=scans_per_avg):
+            averaged_array = yield from sliding_mean_steps(data, scans_per_avg, axis=axis, edge_mode=edge_mode, precision=precision, workers=workers, shifts=shifts)
+        result_cache().put("average_per_bscan", (data,), params, averaged_array, shared=True)
     else:
-        print(f"scans_per_avg should be an odd number please use an odd number for this value")
-        show_info(f"scans_per_avg should be an odd number please use an odd number for this value")
-        return data
\ No newline at end of file
+        averaged_array = detached(averaged_array)
+    layer = watch_layer(create_layer(averaged_array,add_kwargs,layer_type))
+
+    return layer
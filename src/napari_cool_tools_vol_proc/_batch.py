@@ -0,0 +1,321 @@
+"""
+This module contains a headless batch runner applying processing pipelines to directories of volumes.
+
+A pipeline is a list of steps, given as JSON or python objects, each naming an
+operation of OPERATIONS and its parameters, e.g.
+
+    [
+        {"op": "average_bscans", "scans_per_avg": 5, "precision": "float32"},
+        {"op": "mip", "planes": ["yx", "xz"]}
+    ]
+
+Steps are applied in order to every volume (.npy files memory mapped, or
+.chunks directories, see _core.storage) and the result of the last step is
+written next to the inputs' names in the output directory, as .npy files or,
+with --output-format chunks, compressed .chunks directories. Large outputs are
+allocated on disk and filled tile by tile, then moved into place, so volumes
+larger than RAM run through whole pipelines. A step producing several results (one per plane or label) applies
+the following steps to each of them. Steps with "save": true also write their
+intermediate results. Every step is instrumented, set for example
+NAPARI_COOL_TOOLS_INSTRUMENT=jsonl:stages.jsonl to record its cost. Nothing
+here imports napari, so pipelines run on machines without a display:
+
+    napari-cool-tools-vol-proc-batch pipeline.json volumes/ results/ --processes 8 --memory-limit-gb 16
+"""
+import argparse
+import fnmatch
+import inspect
+import json
+import logging
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from napari_cool_tools_vol_proc._core.angiography import FlowMethod, flow_volume
+from napari_cool_tools_vol_proc._core.averaging import EdgeMode, Precision, block_mean, sliding_mean
+from napari_cool_tools_vol_proc._core.instrument import stage
+from napari_cool_tools_vol_proc._core.labels import isolate_labels, label_statistics
+from napari_cool_tools_vol_proc._core.projection import ProjectionType, projections
+from napari_cool_tools_vol_proc._core.registration import frame_shifts, window_shifts
+from napari_cool_tools_vol_proc._core.shaping import reshape
+from napari_cool_tools_vol_proc._core.storage import CHUNKS_SUFFIX, OutputStore, is_store, open_store, output_store, save_store
+from napari_cool_tools_vol_proc._core.surfaces import detect_surface
+
+logger = logging.getLogger(__name__)
+
+OPERATIONS: Dict[str, Callable] = {}
+
+
+def operation(name:str, needs_labels:bool=False):
+    """Register a batch operation of (data, workers, **params) returning {suffix: result}."""
+    def register(func):
+        func.needs_labels = needs_labels
+        OPERATIONS[name] = func
+        return func
+    return register
+
+
+@operation("average_bscans")
+def _average_bscans(data, workers:int=1, scans_per_avg:int=5, precision:str="float64", register:bool=False):
+    shifts = frame_shifts(data, axis=0, group=scans_per_avg) if register else None
+    averaged = block_mean(data, scans_per_avg, axis=0, precision=Precision(precision), workers=workers, shifts=shifts)
+    return {f"avg_{scans_per_avg}{'_reg' if register else ''}": averaged}
+
+
+@operation("average_per_bscan")
+def _average_per_bscan(data, workers:int=1, scans_per_avg:int=5, axis:int=0, edge_mode:str="trim", precision:str="float64", register:bool=False):
+    if scans_per_avg % 2 == 0:
+        raise ValueError(f"scans_per_avg should be an odd number, got {scans_per_avg}")
+    shifts = window_shifts(data, scans_per_avg, axis=axis) if register else None
+    averaged = sliding_mean(data, scans_per_avg, axis=axis, edge_mode=EdgeMode(edge_mode), precision=Precision(precision), workers=workers, shifts=shifts)
+    return {f"{scans_per_avg}_per{'_reg' if register else ''}": averaged}
+
+
+@operation("mip")
+def _mip(data, workers:int=1, planes:Sequence[str]=("yx",), projection_type:str="max"):
+    stat = ProjectionType(projection_type)
+    results = projections(data, planes=planes, stats=(stat,), workers=workers)
+    return {f"{stat.value}ip_{plane}": results[(plane, stat)] for plane in planes}
+
+
+@operation("reshape")
+def _reshape(data, workers:int=1, new_shape:str="(-1,3,:,:)", allow_copy:bool=False):
+    return {"RS": reshape(data, new_shape, allow_copy=allow_copy)}
+
+
+@operation("octa_flow")
+def _octa_flow(data, workers:int=1, mscans:int=3, method:str="decorrelation"):
+    method = FlowMethod(method)
+    suffix = "decorr" if method == FlowMethod.DECORRELATION else "sv"
+    return {f"{suffix}_{mscans}": flow_volume(data, mscans=mscans, method=method, workers=workers)}
+
+
+@operation("detect_surface")
+def _detect_surface(data, workers:int=1, depth_axis:int=1, smooth:int=9, top_k:int=1, max_jump:int=0):
+    return {f"surface{'_' + str(top_k) if top_k > 1 else ''}": detect_surface(data, depth_axis=depth_axis, smooth=smooth, top_k=top_k, max_jump=max_jump, workers=workers)}
+
+
+@operation("isolate_labels", needs_labels=True)
+def _isolate_labels(data, workers:int=1, labels_data=None, labels:Sequence[int]=(1,), crop:bool=True):
+    return {f"label_{label}": volume for label, volume, _ in isolate_labels(data, labels_data, labels, crop=crop, workers=workers)}
+
+
+@operation("label_volumes")
+def _label_volumes(data, workers:int=1, scale:Optional[Sequence[float]]=None, per_bscan:bool=False, include_background:bool=False):
+    stats = label_statistics(data, scale=scale, per_bscan=per_bscan, include_background=include_background, workers=workers)
+    return {"label_volumes": stats}
+
+
+def load_pipeline(pipeline:Union[str, os.PathLike, Sequence[dict]]) -> List[dict]:
+    """Load and validate a pipeline from a JSON file, a JSON string or a list of step dicts.
+
+    Errors:
+        ValueError for unknown operations or parameters
+    """
+    if isinstance(pipeline, (str, os.PathLike)):
+        text = str(pipeline)
+        pipeline = json.loads(text) if text.lstrip().startswith("[") else json.loads(Path(text).read_text())
+    steps = []
+    for step in pipeline:
+        step = dict(step)
+        op = step.get("op")
+        if op not in OPERATIONS:
+            raise ValueError(f"unknown operation {op!r}, expected one of {sorted(OPERATIONS)}")
+        params = {key: value for key, value in step.items() if key not in ("op", "save")}
+        accepted = set(inspect.signature(OPERATIONS[op]).parameters) - {"data", "workers", "labels_data"}
+        unknown = set(params) - accepted
+        if unknown:
+            raise ValueError(f"unknown parameters {sorted(unknown)} for operation {op!r}, expected {sorted(accepted)}")
+        steps.append(step)
+    return steps
+
+
+OUTPUT_FORMATS = ("npy", "chunks")
+
+
+def _save(result, path:Path, store:OutputStore, workers:int=1) -> Path:
+    if isinstance(result, dict):
+        path = path.with_suffix(".json")
+        path.write_text(json.dumps(result, indent=2, default=lambda value: np.asarray(value).tolist()))
+    else:
+        path = path.with_suffix(CHUNKS_SUFFIX if store.chunked else ".npy")
+        if not store.persist(result, path):
+            save_store(result, path, compression=store.compression, workers=workers)
+    return path
+
+
+def _stem(path:Path) -> str:
+    return path.name[:-len(CHUNKS_SUFFIX)] if path.name.endswith(CHUNKS_SUFFIX) else path.stem
+
+
+def run_volume(path:Union[str, os.PathLike], steps:Sequence[dict], output_dir:Union[str, os.PathLike], labels_path:Optional[Union[str, os.PathLike]]=None, workers:int=1, output_format:str="npy") -> List[str]:
+    """Apply pipeline steps to one volume and write the results.
+
+    Outputs of the steps are allocated in a scratch directory of output_dir,
+    results are moved from it into place and the rest is deleted at the end.
+
+    Args:
+        path (PathLike): .npy volume or .chunks directory, opened read only
+        steps (Sequence[dict]): pipeline steps as returned by load_pipeline
+        output_dir (PathLike): directory the results are written to as <volume name>_<suffixes>.npy (.chunks or .json)
+        labels_path (PathLike): .npy label volume or .chunks directory for operations that need one
+        workers (int): number of threads used by each operation, 0 for one per CPU core
+        output_format (str): "npy" for .npy files, "chunks" for compressed .chunks directories
+
+    Returns:
+        Paths of the written results
+    """
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"unknown output format {output_format!r}, expected one of {OUTPUT_FORMATS}")
+    path = Path(path)
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    labels_data = open_store(labels_path) if labels_path is not None else None
+
+    with output_store(output_dir / f".{_stem(path)}.scratch", chunked=output_format == "chunks") as store:
+        try:
+            return _run_steps(_stem(path), open_store(path), steps, output_dir, labels_data, workers, store)
+        finally:
+            store.clear()
+
+
+def _run_steps(name:str, data, steps:Sequence[dict], output_dir:Path, labels_data, workers:int, store:OutputStore) -> List[str]:
+    branches = [(name, data)]
+    written = []
+    for position, step in enumerate(steps):
+        func = OPERATIONS[step["op"]]
+        params = {key: value for key, value in step.items() if key not in ("op", "save")}
+        if func.needs_labels:
+            if labels_data is None:
+                raise ValueError(f"operation {step['op']!r} needs a label volume for {name}")
+            params["labels_data"] = labels_data
+        last = position == len(steps) - 1
+        next_branches = []
+        for name, data in branches:
+            if isinstance(data, dict):
+                raise ValueError(f"operation {step['op']!r} cannot be applied to the statistics of {name}")
+            with stage("batch", step["op"], bytes_read=data.nbytes, volume=name):
+                results = func(data, workers=workers, **params)
+            for suffix, result in results.items():
+                next_branches.append((f"{name}_{suffix}", result))
+                if last or step.get("save", False):
+                    written.append(str(_save(result, output_dir / f"{name}_{suffix}", store, workers)))
+        branches = next_branches
+    return written
+
+
+def _limit_memory(limit_bytes:Optional[int]):
+    # caps the private memory of a pool process, memory mapped inputs are not counted where RLIMIT_DATA exists
+    if not limit_bytes:
+        return
+    try:
+        import resource
+    except ImportError:
+        logger.warning("per process memory limits are not supported on this platform")
+        return
+    limit = getattr(resource, "RLIMIT_DATA", resource.RLIMIT_AS)
+    _, hard = resource.getrlimit(limit)
+    if hard != resource.RLIM_INFINITY:
+        limit_bytes = min(limit_bytes, hard)
+    resource.setrlimit(limit, (limit_bytes, hard))
+
+
+def find_volumes(input_dir:Union[str, os.PathLike], pattern:str="*.npy", label_suffix:str="_labels", shard:Tuple[int, int]=(0, 1)) -> List[Tuple[Path, Optional[Path]]]:
+    """List the volumes of input_dir matching pattern with their label volumes (<name><label_suffix>.npy or .chunks).
+
+    Args:
+        input_dir (PathLike): directory containing the volumes
+        pattern (str): glob pattern of the volume file names
+        label_suffix (str): suffix of label volume names, label volumes are not processed as volumes
+        shard (Tuple[int, int]): (index, count) keeping every count-th volume starting at index,
+            so count nodes can split a directory between them
+
+    Returns:
+        Sorted list of (volume path, label volume path or None)
+    """
+    index, count = shard
+    if not 0 <= index < count:
+        raise ValueError(f"invalid shard {index}/{count}")
+    input_dir = Path(input_dir)
+    paths = sorted(path for path in input_dir.iterdir() if fnmatch.fnmatch(path.name, pattern) and is_store(path))
+    volumes = [path for path in paths if not (label_suffix and _stem(path).endswith(label_suffix))]
+    pairs = []
+    for path in volumes[index::count]:
+        candidates = [path.with_name(f"{_stem(path)}{label_suffix}{suffix}") for suffix in (".npy", CHUNKS_SUFFIX)] if label_suffix else []
+        pairs.append((path, next((candidate for candidate in candidates if is_store(candidate)), None)))
+    return pairs
+
+
+def run_batch(pipeline, input_dir, output_dir, pattern:str="*.npy", processes:int=0, memory_limit:Optional[int]=None, workers:int=1, shard:Tuple[int, int]=(0, 1), label_suffix:str="_labels", output_format:str="npy") -> Dict[str, Union[List[str], str]]:
+    """Apply a pipeline to every volume of a directory using a process pool.
+
+    Args:
+        pipeline: pipeline JSON file, JSON string or list of steps, see load_pipeline
+        input_dir (PathLike): directory containing the .npy volumes (or .chunks directories)
+        output_dir (PathLike): directory the results are written to
+        pattern (str): glob pattern of the volume file names, e.g. "*.chunks" or "*" for chunked inputs
+        processes (int): number of worker processes, 0 for one per CPU core divided by workers
+        memory_limit (int): maximum private memory of each worker process in bytes, None for no limit
+        workers (int): number of threads used by each process
+        shard (Tuple[int, int]): (index, count) share of the volumes processed by this node
+        label_suffix (str): suffix of the label volumes matching each volume
+        output_format (str): "npy" for .npy files, "chunks" for compressed .chunks directories
+
+    Returns:
+        Dict mapping each volume path to the written result paths, or to the error message if it failed
+    """
+    steps = load_pipeline(pipeline)
+    volumes = find_volumes(input_dir, pattern, label_suffix, shard)
+    if processes <= 0:
+        processes = max(1, (os.cpu_count() or 1) // max(1, workers))
+    processes = max(1, min(processes, len(volumes)))
+
+    outcomes = {}
+    with ProcessPoolExecutor(max_workers=processes, initializer=_limit_memory, initargs=(memory_limit,)) as executor:
+        futures = {executor.submit(run_volume, path, steps, output_dir, labels_path, workers, output_format): path for path, labels_path in volumes}
+        for future in as_completed(futures):
+            path = str(futures[future])
+            try:
+                outcomes[path] = future.result()
+                logger.info("%s: wrote %d results", path, len(outcomes[path]))
+            except Exception as error:  # noqa: BLE001 - one failing volume must not stop the batch
+                outcomes[path] = f"{type(error).__name__}: {error}"
+                logger.error("%s: %s", path, outcomes[path])
+    return outcomes
+
+
+def _parse_shard(text:str) -> Tuple[int, int]:
+    index, _, count = text.partition("/")
+    return int(index), int(count or 1)
+
+
+def main(argv:Optional[Sequence[str]]=None) -> int:
+    """Command line entry point, returns a non zero exit code when a volume failed."""
+    parser = argparse.ArgumentParser(description="Apply a volume processing pipeline to a directory of .npy volumes.")
+    parser.add_argument("pipeline", help="pipeline JSON file")
+    parser.add_argument("input_dir", help="directory containing the .npy volumes")
+    parser.add_argument("output_dir", help="directory the results are written to")
+    parser.add_argument("--pattern", default="*.npy", help="glob pattern of the volume file names")
+    parser.add_argument("--label-suffix", default="_labels", help="suffix of the label volume matching each volume")
+    parser.add_argument("--processes", type=int, default=0, help="worker processes, 0 for one per core divided by --threads")
+    parser.add_argument("--threads", type=int, default=1, help="threads used by each worker process")
+    parser.add_argument("--memory-limit-gb", type=float, default=None, help="maximum private memory of each worker process")
+    parser.add_argument("--shard", type=_parse_shard, default=(0, 1), help="i/n to process every n-th volume starting at i")
+    parser.add_argument("--output-format", choices=OUTPUT_FORMATS, default="npy", help="write results as .npy files or compressed .chunks directories")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    memory_limit = int(args.memory_limit_gb * 2**30) if args.memory_limit_gb else None
+    outcomes = run_batch(args.pipeline, args.input_dir, args.output_dir, args.pattern, args.processes,
+                         memory_limit, args.threads, args.shard, args.label_suffix, args.output_format)
+    failed = [path for path, outcome in outcomes.items() if isinstance(outcome, str)]
+    logger.info("%d volumes processed, %d failed", len(outcomes), len(failed))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,20 @@
+"""
+This module contains code for configuring the cache of results derived from layers
+"""
+from napari_cool_tools_vol_proc._core.cache import configure_cache
+from napari_cool_tools_vol_proc._napari import show_info
+
+def configure_result_cache(budget_mb:int=1024, spill_dir:str="", clear:bool=False):
+    """Keep the results of mip, average_bscans, average_per_bscan and isolate_labeled_volume for reuse
+    when they are run again on the same layer data with the same parameters.
+
+    Args:
+        budget_mb (int): RAM in MB kept for cached results, least recently used results beyond it are evicted, 0 disables caching
+        spill_dir (str): directory evicted results are written to and reloaded from, empty to drop them
+        clear (bool): Flag indicating that every cached result is dropped
+    """
+    cache = configure_cache(budget_mb * 2**20, spill_dir.strip() or None)
+    if clear:
+        cache.clear()
+
+    show_info(f"Result cache holds {len(cache)} results, {cache.nbytes / 2**20:.0f} of {budget_mb} MB in RAM ({cache.hits} hits, {cache.misses} misses)")
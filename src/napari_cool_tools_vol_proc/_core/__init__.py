@@ -0,0 +1,6 @@
+"""
+Pure numpy compute kernels backing the napari commands of this plugin.
+
+Modules in this package must not import napari, magicgui or any other GUI
+dependency so they can be used headless and imported quickly.
+"""
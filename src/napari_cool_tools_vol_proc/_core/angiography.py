@@ -0,0 +1,133 @@
+"""
+This module contains numpy kernels computing OCT angiography flow from repeated m-scans.
+"""
+from enum import Enum
+from typing import Optional
+
+import numpy as np
+
+from napari_cool_tools_vol_proc._core.shaping import reshape
+from napari_cool_tools_vol_proc._core.storage import allocate
+from napari_cool_tools_vol_proc._core.tiling import DEFAULT_CHUNK_BYTES, map_tiles, tile_ranges
+
+
+class FlowMethod(Enum):
+    """Contrast computed between the repeated m-scans of each B-scan position."""
+    DECORRELATION = "decorrelation"
+    SPECKLE_VARIANCE = "speckle variance"
+
+
+def group_mscans(data, mscans:Optional[int]=None):
+    """View of an OCTA volume with the repeated m-scans of each position along axis 1.
+
+    Args:
+        data (array-like): 4D (positions, m-scans, rows, columns) volume, or 3D volume
+            whose consecutive groups of mscans B-scans are repeats of the same position
+        mscans (int): number of repeated m-scans per position, required for 3D volumes
+
+    Returns:
+        4D zero-copy view of data
+
+    Errors:
+        ValueError when the volume is not 3D or 4D, mscans is missing or does not divide
+        the number of B-scans, or the volume cannot be regrouped without copying
+    """
+    grouped_shape = mscan_shape(data, mscans)
+    if data.ndim == 4:
+        return data
+    return reshape(data, f"(-1,{grouped_shape[1]},:,:)")
+
+
+def mscan_shape(data, mscans:Optional[int]=None) -> tuple:
+    """4D (positions, m-scans, rows, columns) shape of an OCTA volume, see group_mscans for the arguments and errors."""
+    shape = tuple(data.shape)
+    if len(shape) == 4:
+        return shape
+    if len(shape) != 3:
+        raise ValueError(f"expected a 3D or 4D OCTA volume, got shape {shape}")
+    if mscans is None or mscans < 2:
+        raise ValueError(f"at least 2 m-scans per position are needed, got {mscans}")
+    if shape[0] % mscans:
+        raise ValueError(f"{shape[0]} B-scans cannot be grouped into positions of {mscans} m-scans")
+    return (shape[0] // mscans, int(mscans)) + shape[1:]
+
+
+def _decorrelation(tile:np.ndarray, out:np.ndarray) -> np.ndarray:
+    # mean amplitude decorrelation of consecutive m-scan pairs, positions without signal count as static
+    out.fill(0)
+    ratio = np.empty(out.shape, dtype=np.float32)
+    for n in range(tile.shape[1] - 1):
+        a, b = tile[:, n], tile[:, n + 1]
+        energy = 0.5 * (a * a + b * b)
+        ratio.fill(1)
+        np.divide(a * b, energy, out=ratio, where=energy > 0)
+        out += ratio
+    out *= np.float32(1 / (tile.shape[1] - 1))
+    np.subtract(np.float32(1), out, out=out)
+    return out
+
+
+def _speckle_variance(tile:np.ndarray, out:np.ndarray) -> np.ndarray:
+    # population variance of the m-scans of each position
+    mean = tile.mean(axis=1, dtype=np.float32)
+    out.fill(0)
+    for n in range(tile.shape[1]):
+        deviation = tile[:, n] - mean
+        out += deviation * deviation
+    out *= np.float32(1 / tile.shape[1])
+    return out
+
+
+def flow_volume(data, mscans:Optional[int]=None, method:FlowMethod=FlowMethod.DECORRELATION, out=None, chunk_bytes:int=DEFAULT_CHUNK_BYTES, workers:int=0):
+    """Compute a 3D angiography flow volume from repeated m-scans in one fused pass.
+
+    The m-scan groups are read in tiles of consecutive B-scans (of positions for
+    4D volumes), so .chunks stores and non contiguous volumes stream too, then
+    converted to float32 and reduced to one flow B-scan per position, so peak
+    memory is a few tiles of groups no matter the volume size and tiles are
+    processed on a thread pool.
+
+    Decorrelation is 1 - mean(A_n A_n+1 / ((A_n² + A_n+1²) / 2)) over consecutive
+    m-scan pairs and lies in [0, 1] for non negative amplitudes, so it should be
+    computed on linear amplitude rather than log scaled data. Speckle variance is
+    the variance of the m-scans of each position.
+
+    Args:
+        data (array-like): OCTA volume, see group_mscans
+        mscans (int): number of repeated m-scans per position for 3D volumes
+        method (FlowMethod): flow contrast to compute
+        out (array-like): optional output of shape (positions, rows, columns), e.g. a writable memmap
+        chunk_bytes (int): approximate number of float32 bytes processed per tile
+        workers (int): number of worker threads, 0 for one per CPU core
+
+    Returns:
+        float32 flow volume of shape (positions, rows, columns) (out)
+    """
+    method = FlowMethod(method)
+    grouped_shape = mscan_shape(data, mscans)
+    positions, repeats = grouped_shape[:2]
+    out_shape = (positions,) + grouped_shape[2:]
+    if out is None:
+        out = allocate(out_shape, np.float32, "flow")
+    elif tuple(out.shape) != out_shape:
+        raise ValueError(f"out has shape {out.shape}, expected {out_shape}")
+
+    kernel = _decorrelation if method == FlowMethod.DECORRELATION else _speckle_variance
+    group_bytes = 4 * repeats * int(np.prod(out_shape[1:]))
+    tile_len = max(1, chunk_bytes // max(group_bytes, 1))
+
+    def run(start, stop):
+        # groups of 3D volumes are read as consecutive B-scans, so inputs that cannot be viewed (.chunks) stream too
+        if len(data.shape) == 3:
+            tile = np.asarray(data[start * repeats:stop * repeats], dtype=np.float32).reshape((stop - start,) + grouped_shape[1:])
+        else:
+            tile = np.asarray(data[start:stop], dtype=np.float32)
+        if isinstance(out, np.ndarray) and out.dtype == np.float32:
+            kernel(tile, out[start:stop])
+        else:
+            out[start:stop] = kernel(tile, np.empty((stop - start,) + out_shape[1:], dtype=np.float32))
+
+    for _ in map_tiles(run, tile_ranges(positions, tile_len), workers):
+        pass
+
+    return out
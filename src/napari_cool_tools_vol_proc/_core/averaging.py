@@ -0,0 +1,371 @@
+"""
+This module contains numpy kernels for averaging 2D slices of volumetric data.
+"""
+from enum import Enum
+from typing import Optional, Tuple
+
+import numpy as np
+
+from napari_cool_tools_vol_proc._core.registration import shift_frame
+from napari_cool_tools_vol_proc._core.storage import allocate
+from napari_cool_tools_vol_proc._core.tiling import DEFAULT_CHUNK_BYTES, Steps, axis_index, map_tiles, resolve_workers, run_steps, split_axis, split_ranges, tile_ranges
+
+
+class EdgeMode(Enum):
+    """Handling of slices near the ends of the axis in a sliding average.
+
+    TRIM drops slices without a full window, COPY passes them through
+    unaveraged, REFLECT mirrors the window about the edge slice (c b | a b c),
+    NEAREST repeats the edge slice and SHRINK averages only the slices that
+    exist.
+    """
+    TRIM = "trim"
+    COPY = "copy"
+    REFLECT = "reflect"
+    NEAREST = "nearest"
+    SHRINK = "shrink"
+
+
+class Precision(Enum):
+    """Accumulator and output precision of the averaging kernels.
+
+    FLOAT64 accumulates in float64 and returns what numpy's mean would (float64
+    for integer data), FLOAT32 accumulates and returns float32, FLOAT16
+    accumulates in float32 and returns float16 and INTEGER sums exactly in a
+    64 bit integer and rounds the mean back to the (integer) input dtype.
+    """
+    FLOAT64 = "float64"
+    FLOAT32 = "float32"
+    FLOAT16 = "float16"
+    INTEGER = "integer"
+
+
+def mean_dtype(dtype) -> np.dtype:
+    """dtype numpy's mean produces for an input of dtype (float64 for integer data)."""
+    dtype = np.dtype(dtype)
+    return dtype if np.issubdtype(dtype, np.inexact) else np.dtype(np.float64)
+
+
+def precision_dtypes(dtype, precision:Precision=Precision.FLOAT64) -> tuple:
+    """Accumulator and output dtypes used to average data of dtype at precision.
+
+    Returns:
+        Tuple (accumulator dtype, output dtype)
+    """
+    dtype = np.dtype(dtype)
+    precision = Precision(precision)
+    if precision == Precision.INTEGER:
+        if not np.issubdtype(dtype, np.integer):
+            raise ValueError(f"integer precision needs integer data, got {dtype}")
+        return exact_sum_dtype(dtype), dtype
+    if precision == Precision.FLOAT32:
+        return np.dtype(np.float32), np.dtype(np.float32)
+    if precision == Precision.FLOAT16:
+        return np.dtype(np.float32), np.dtype(np.float16)
+    return np.dtype(np.float64), mean_dtype(dtype)
+
+
+def exact_sum_dtype(dtype) -> np.dtype:
+    """Widest dtype of the same kind as dtype used for long running sums."""
+    dtype = np.dtype(dtype)
+    if dtype == np.uint64:
+        return dtype
+    if np.issubdtype(dtype, np.integer) or dtype == np.bool_:
+        return np.dtype(np.int64)
+    return np.dtype(np.complex128) if np.issubdtype(dtype, np.complexfloating) else np.dtype(np.float64)
+
+
+def rounded_mean(total:np.ndarray, count:int) -> np.ndarray:
+    """Mean of integer sums rounded half up using only integer arithmetic."""
+    return (2 * total + count) // (2 * count)
+
+
+def sliding_mean_shape(shape:tuple, window:int, axis:int=0, edge_mode:EdgeMode=EdgeMode.TRIM) -> tuple:
+    """Shape of the output of sliding_mean for a given input shape."""
+    half = window // 2
+    out_shape = list(shape)
+    if EdgeMode(edge_mode) == EdgeMode.TRIM:
+        out_shape[axis] = shape[axis] - 2 * half
+    return tuple(out_shape)
+
+
+def sliding_mean(data, window:int, axis:int=0, edge_mode:EdgeMode=EdgeMode.TRIM, out:Optional[np.ndarray]=None, precision:Precision=Precision.FLOAT64, workers:int=0, shifts:Optional[np.ndarray]=None) -> np.ndarray:
+    """Average every slice along axis with the window - 1 slices surrounding it.
+
+    A running sum is carried along axis so each output slice costs one add and
+    one subtract of a single slice regardless of window size, and results are
+    written directly into one preallocated output. The running sum is a single
+    slice, so it is always kept exact (int64 for integer data) or in float64 to
+    avoid drift; precision selects the output dtype and the INTEGER rounding.
+    With several workers the volume is split along the largest other axis into
+    tiles averaged independently on a thread pool. When shifts are given every
+    window is instead summed directly after translating its slices onto its
+    middle slice, which costs window adds per output slice, and output slices
+    are split between the workers.
+
+    Args:
+        data (array-like): volume supporting basic slicing (ndarray, memmap, ...)
+        window (int): odd number of consecutive slices averaged for each output slice
+        axis (int): axis along which slices are averaged
+        edge_mode (EdgeMode): handling of slices closer than window // 2 to either end
+        out (ndarray): optional preallocated output of shape sliding_mean_shape(...)
+        precision (Precision): output dtype and rounding, see Precision
+        workers (int): number of worker threads, 0 for one per CPU core
+        shifts (ndarray): optional (n_slices, window, ndim - 1) slice displacements from registration.window_shifts
+
+    Returns:
+        Array where each slice along axis is the average of the surrounding slices of data
+    """
+    return run_steps(sliding_mean_steps(data, window, axis, edge_mode, out, precision, workers, shifts))
+
+
+def sliding_mean_steps(data, window:int, axis:int=0, edge_mode:EdgeMode=EdgeMode.TRIM, out:Optional[np.ndarray]=None, precision:Precision=Precision.FLOAT64, workers:int=0, shifts:Optional[np.ndarray]=None) -> Steps:
+    """Step generator of sliding_mean yielding (done, total) after every tile, or every output slice when run serially, and returning the output."""
+    edge_mode = EdgeMode(edge_mode)
+    precision = Precision(precision)
+    out_dtype = precision_dtypes(data.dtype, precision)[1]
+    ndim = len(data.shape)
+    axis = axis % ndim
+    length = data.shape[axis]
+    half = window // 2
+
+    if window < 1 or window % 2 == 0:
+        raise ValueError(f"window should be a positive odd number, got {window}")
+    if edge_mode == EdgeMode.REFLECT and half >= length:
+        raise ValueError(f"window {window} too large to reflect along axis of length {length}")
+
+    out_shape = sliding_mean_shape(data.shape, window, axis, edge_mode)
+    if out_shape[axis] <= 0:
+        raise ValueError(f"window {window} is longer than axis {axis} of length {length}")
+    if out is None:
+        out = allocate(out_shape, out_dtype, "sliding_mean", write_axis=axis)
+    elif tuple(out.shape) != out_shape:
+        raise ValueError(f"out has shape {out.shape}, expected {out_shape}")
+
+    workers = resolve_workers(workers)
+    if shifts is not None:
+        shifts = np.asarray(shifts)
+        if shifts.shape != (length, window, ndim - 1):
+            raise ValueError(f"shifts has shape {shifts.shape}, expected {(length, window, ndim - 1)}")
+        yield from _registered_sliding_mean(data, out, window, axis, edge_mode, precision, shifts, workers)
+        return out
+
+    split = split_axis(data.shape, axis)
+    if workers > 1 and split is not None and isinstance(out, np.ndarray):
+        def run(start, stop):
+            tile = axis_index(ndim, split, slice(start, stop))
+            for _ in _sliding_mean_tile(data[tile], out[tile], window, axis, edge_mode, precision):
+                pass
+
+        ranges = split_ranges(data.shape[split], 4 * workers)
+        for done, _ in enumerate(map_tiles(run, ranges, workers), 1):
+            yield done, len(ranges)
+    else:
+        yield from _counted(_sliding_mean_tile(data, out, window, axis, edge_mode, precision))
+
+    return out
+
+
+def _counted(slices) -> Steps:
+    # progress of a serial _sliding_mean_tile, the total is its first yield
+    total = next(slices)
+    for done, _ in enumerate(slices, 1):
+        yield done, total
+
+
+def _source(j:int, length:int, edge_mode:EdgeMode) -> Optional[int]:
+    # map a virtual window position onto a real slice index (or None)
+    if 0 <= j < length:
+        return j
+    if edge_mode == EdgeMode.REFLECT:
+        return -j if j < 0 else 2 * (length - 1) - j
+    if edge_mode == EdgeMode.NEAREST:
+        return 0 if j < 0 else length - 1
+    return None
+
+
+def _averaged_range(length:int, half:int, edge_mode:EdgeMode) -> Tuple[int, int, int]:
+    # (first, last) slices averaged over a full window and the index of first in the output
+    if edge_mode in (EdgeMode.TRIM, EdgeMode.COPY):
+        first, last = half, length - half
+    else:
+        first, last = 0, length
+    return first, last, first if edge_mode == EdgeMode.TRIM else 0
+
+
+def _store_mean(out, index:tuple, acc:np.ndarray, count:int, precision:Precision):
+    # mean of a window sum into one output slice, rounded for Precision.INTEGER
+    if precision == Precision.INTEGER:
+        out[index] = rounded_mean(acc, count)
+    else:
+        out[index] = acc * (1.0 / count)
+
+
+def _copy_edges(data, out, first:int, last:int, axis:int):
+    # EdgeMode.COPY, slices without a full window are passed through
+    ndim = len(data.shape)
+    length = data.shape[axis]
+    for i in list(range(0, min(first, length))) + list(range(max(last, first), length)):
+        out[axis_index(ndim, axis, i)] = np.asarray(data[axis_index(ndim, axis, i)])
+
+
+def _registered_sliding_mean(data, out, window:int, axis:int, edge_mode:EdgeMode, precision:Precision, shifts:np.ndarray, workers:int) -> Steps:
+    # every window summed after translating its slices onto its middle slice, output slices split between workers
+    acc_dtype = exact_sum_dtype(data.dtype)
+    ndim = len(data.shape)
+    length = data.shape[axis]
+    half = window // 2
+    first, last, offset = _averaged_range(length, half, edge_mode)
+    if edge_mode == EdgeMode.COPY:
+        _copy_edges(data, out, first, last, axis)
+
+    def run(start, stop):
+        for i in range(start, stop):
+            acc = np.zeros(out.shape[:axis] + out.shape[axis + 1:], dtype=acc_dtype)
+            count = 0
+            for j in range(i - half, i + half + 1):
+                k = _source(j, length, edge_mode)
+                if k is None:
+                    continue
+                np.add(acc, shift_frame(np.asarray(data[axis_index(ndim, axis, k)]), -shifts[i, half + k - i]), out=acc)
+                count += 1
+            _store_mean(out, axis_index(ndim, axis, i - offset), acc, count, precision)
+
+    ranges = [(first + a, first + b) for a, b in split_ranges(max(last - first, 0), 4 * workers)]
+    for done, _ in enumerate(map_tiles(run, ranges, workers), 1):
+        yield done, len(ranges)
+
+
+def _sliding_mean_tile(data, out:np.ndarray, window:int, axis:int, edge_mode:EdgeMode, precision:Precision):
+    # running sum along axis of one tile, arguments are validated by sliding_mean,
+    # yields the number of output slices then once after each of them
+    acc_dtype = exact_sum_dtype(data.dtype)
+    ndim = len(data.shape)
+    length = data.shape[axis]
+    half = window // 2
+    inexact = np.issubdtype(np.dtype(data.dtype), np.inexact)
+
+    def update(acc, j, sign):
+        k = _source(j, length, edge_mode)
+        if k is None:
+            return 0
+        frame_k = np.asarray(data[axis_index(ndim, axis, k)])
+        if sign > 0:
+            np.add(acc, frame_k, out=acc)
+        elif inexact and not np.isfinite(frame_k).all():
+            # inf - inf is nan and nan never subtracts out, the caller sums the window again instead
+            return None
+        else:
+            np.subtract(acc, frame_k, out=acc)
+        return sign
+
+    def fill(acc, i):
+        # sum of the window centered on output slice i
+        acc.fill(0)
+        return sum(update(acc, j, 1) for j in range(i - half, i + half + 1))
+
+    first, last, offset = _averaged_range(length, half, edge_mode)
+    if edge_mode == EdgeMode.COPY:
+        _copy_edges(data, out, first, last, axis)
+
+    slice_shape = out.shape[:axis] + out.shape[axis + 1:]
+    yield max(last - first, 0)
+    acc = np.zeros(slice_shape, dtype=acc_dtype)
+    count = fill(acc, first)
+
+    for i in range(first, last):
+        if i != first:
+            count += update(acc, i + half, 1)
+            removed = update(acc, i - half - 1, -1)
+            count = fill(acc, i) if removed is None else count + removed
+        _store_mean(out, axis_index(ndim, axis, i - offset), acc, count, precision)
+        yield i
+
+
+def block_mean_shape(shape:tuple, block:int, axis:int=0) -> tuple:
+    """Shape of the output of block_mean for a given input shape."""
+    out_shape = list(shape)
+    out_shape[axis] = -(-shape[axis] // block)
+    return tuple(out_shape)
+
+
+def block_mean(data, block:int, axis:int=0, out:Optional[np.ndarray]=None, chunk_bytes:int=DEFAULT_CHUNK_BYTES, precision:Precision=Precision.FLOAT64, workers:int=0, shifts:Optional[np.ndarray]=None) -> np.ndarray:
+    """Average every block consecutive slices along axis together.
+
+    The input is streamed in chunks holding a whole number of blocks and each
+    reduced chunk is written straight into out, so peak memory stays at a few
+    chunks per worker even when data is a memmap larger than RAM. Chunks are
+    reduced independently on a thread pool. A trailing partial block is
+    averaged over the slices it contains. When shifts are given every slice is
+    translated onto the middle slice of its block before reducing.
+
+    Args:
+        data (array-like): volume supporting basic slicing (ndarray, memmap, ...)
+        block (int): number of consecutive slices averaged together
+        axis (int): axis along which slices are averaged
+        out (ndarray): optional preallocated output of shape block_mean_shape(...), may be a memmap
+        chunk_bytes (int): approximate number of input bytes read per chunk
+        precision (Precision): accumulator and output dtype, see Precision
+        workers (int): number of worker threads, 0 for one per CPU core
+        shifts (ndarray): optional (n_slices, ndim - 1) slice displacements from registration.frame_shifts(data, axis, group=block)
+
+    Returns:
+        Array where each slice along axis is the average of block slices of data
+    """
+    return run_steps(block_mean_steps(data, block, axis, out, chunk_bytes, precision, workers, shifts))
+
+
+def block_mean_steps(data, block:int, axis:int=0, out:Optional[np.ndarray]=None, chunk_bytes:int=DEFAULT_CHUNK_BYTES, precision:Precision=Precision.FLOAT64, workers:int=0, shifts:Optional[np.ndarray]=None) -> Steps:
+    """Step generator of block_mean yielding (done, total) after every chunk and returning the output."""
+    precision = Precision(precision)
+    acc_dtype, out_dtype = precision_dtypes(data.dtype, precision)
+    ndim = len(data.shape)
+    axis = axis % ndim
+    length = data.shape[axis]
+
+    if block < 1:
+        raise ValueError(f"block should be a positive integer, got {block}")
+
+    out_shape = block_mean_shape(data.shape, block, axis)
+    if out is None:
+        out = allocate(out_shape, out_dtype, "block_mean", write_axis=axis)
+    elif tuple(out.shape) != out_shape:
+        raise ValueError(f"out has shape {out.shape}, expected {out_shape}")
+
+    def reduce(blocks, axis, count):
+        if precision == Precision.INTEGER:
+            return rounded_mean(blocks.sum(axis, dtype=acc_dtype), count)
+        return blocks.mean(axis, dtype=acc_dtype)
+
+    slice_bytes = np.dtype(data.dtype).itemsize * int(np.prod(out_shape)) // max(out_shape[axis], 1)
+    blocks_per_chunk = max(1, chunk_bytes // max(slice_bytes * block, 1))
+
+    def run(b0, b1):
+        start, stop = b0 * block, min(length, b1 * block)
+        chunk = np.asarray(data[axis_index(ndim, axis, slice(start, stop))])
+        if shifts is not None:
+            chunk = _align_slices(chunk, axis, shifts[start:stop])
+
+        full = (stop - start) // block
+        if full:
+            blocks = chunk[axis_index(ndim, axis, slice(0, full * block))]
+            blocks = blocks.reshape(chunk.shape[:axis] + (full, block) + chunk.shape[axis + 1:])
+            out[axis_index(ndim, axis, slice(b0, b0 + full))] = reduce(blocks, axis + 1, block)
+        if full * block < stop - start:
+            partial = chunk[axis_index(ndim, axis, slice(full * block, None))]
+            out[axis_index(ndim, axis, b0 + full)] = reduce(partial, axis, stop - start - full * block)
+
+    ranges = tile_ranges(out_shape[axis], blocks_per_chunk)
+    for done, _ in enumerate(map_tiles(run, ranges, workers), 1):
+        yield done, len(ranges)
+
+    return out
+
+
+def _align_slices(chunk:np.ndarray, axis:int, shifts:np.ndarray) -> np.ndarray:
+    # translate each slice of chunk back by its displacement from the reference slice of its block
+    aligned = np.empty_like(chunk)
+    for i in range(chunk.shape[axis]):
+        index = axis_index(chunk.ndim, axis, i)
+        shift_frame(chunk[index], -shifts[i], out=aligned[index])
+    return aligned
@@ -0,0 +1,410 @@
+"""
+This module contains a memory-budgeted LRU cache for results derived from volumes (projections, averages, masks).
+
+Entries are keyed by the operation, its parameters and the identity of the
+source arrays, and store a fingerprint of the sources (shape, dtype and a hash
+of their content, sampled for large arrays) that is checked on every lookup,
+so results of data modified in place are recomputed. Entries are dropped when
+a source array is garbage collected. Once the cached results exceed the RAM
+budget the least recently used entries are evicted, or spilled to disk when
+a spill directory is set and loaded back on their next hit.
+
+Cached arrays are made read-only, as they are handed out on every hit: use
+writable on a result before giving it to something that may modify it, such as
+a layer. A result put with shared=True is instead left writable and handed to
+its layer without a copy: the cache keeps a reference whose own fingerprint is
+checked on every hit (and which invalidate_result drops once the layer is
+edited), and callers take a detached copy on hits only. Memory maps and ChunkedArrays (see _core.storage) are not charged to
+the RAM budget and only their paths are spilled.
+
+The shared cache is configured with configure_cache or from the
+NAPARI_COOL_TOOLS_CACHE_MB (RAM budget, 0 disables caching) and
+NAPARI_COOL_TOOLS_CACHE_DIR (spill directory) environment variables.
+"""
+import atexit
+import hashlib
+import logging
+import mmap
+import os
+import pickle
+import tempfile
+import threading
+import weakref
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable, Optional, Sequence
+
+import numpy as np
+
+from napari_cool_tools_vol_proc._core.storage import ChunkedArray, store_path
+
+logger = logging.getLogger(__name__)
+
+BUDGET_ENV_VAR = "NAPARI_COOL_TOOLS_CACHE_MB"
+SPILL_ENV_VAR = "NAPARI_COOL_TOOLS_CACHE_DIR"
+
+DEFAULT_BUDGET_BYTES = 1024 * 2**20
+
+# arrays up to this size are hashed entirely, larger ones through a sample of this size from FINGERPRINT_SAMPLES slices
+FULL_HASH_BYTES = 16 * 2**20
+FINGERPRINT_SAMPLES = 64
+
+
+def fingerprint(data) -> tuple:
+    """Fingerprint of an array, its shape, dtype and a hash of its content.
+
+    Arrays larger than FULL_HASH_BYTES are hashed through a strided sample of
+    about FULL_HASH_BYTES taken from evenly spaced slices along the first axis,
+    so only edits touching a sampled element are detected.
+
+    Args:
+        data (ndarray): array or array-like such as a memmap or virtual stack
+
+    Returns:
+        Hashable fingerprint
+    """
+    shape = tuple(data.shape)
+    digest = hashlib.blake2b(digest_size=16)
+    if data.nbytes <= FULL_HASH_BYTES or len(shape) == 0:
+        samples = [np.asarray(data).reshape(-1)]
+    else:
+        indices = np.unique(np.linspace(0, shape[0] - 1, FINGERPRINT_SAMPLES).astype(np.int64))
+        step = max(1, data.nbytes // (shape[0] * (FULL_HASH_BYTES // len(indices))))
+        samples = (np.asarray(data[int(i)]).reshape(-1)[::step] for i in indices)
+    for sample in samples:
+        digest.update(np.ascontiguousarray(sample).view(np.uint8).data)
+    return shape, str(data.dtype), digest.hexdigest()
+
+
+def _on_disk(value) -> bool:
+    # ChunkedArray or memory map of a whole file, reopened from its path after a spill
+    return isinstance(value, ChunkedArray) or (isinstance(value, np.memmap) and isinstance(value.base, mmap.mmap))
+
+
+def _leaves(result):
+    if isinstance(result, dict):
+        result = result.values()
+    elif not isinstance(result, (tuple, list)):
+        yield result
+        return
+    for value in result:
+        yield from _leaves(value)
+
+
+def result_nbytes(result) -> int:
+    """Bytes of RAM held by the arrays of a result, an array or a (nested) tuple, list or dict of arrays.
+
+    Memory maps and ChunkedArrays count for nothing, their data stays on disk.
+    """
+    return sum(0 if _on_disk(value) else int(getattr(value, "nbytes", 0)) for value in _leaves(result))
+
+
+def freeze(result):
+    """Make the arrays of a result read-only, returns result."""
+    for value in _leaves(result):
+        if isinstance(value, np.ndarray):
+            value.setflags(write=False)
+        elif isinstance(value, ChunkedArray):
+            value.mode = "r"
+    return result
+
+
+def detached(result):
+    """Result whose in-memory arrays are replaced by writable copies, e.g. on a hit of a result shared with a layer.
+
+    Arrays on disk are returned as they are rather than loaded into RAM.
+    """
+    if isinstance(result, dict):
+        return {key: detached(value) for key, value in result.items()}
+    if isinstance(result, (tuple, list)):
+        return type(result)(detached(value) for value in result)
+    if isinstance(result, np.ndarray) and not _on_disk(result):
+        return np.array(result)
+    return result
+
+
+def _result_fingerprints(result) -> tuple:
+    return tuple(fingerprint(value) for value in _leaves(result) if hasattr(value, "shape"))
+
+
+def writable(result):
+    """Result whose in-memory arrays frozen by the cache are replaced by writable copies.
+
+    Arrays on disk are returned as they are, read-only, rather than loaded into RAM.
+    """
+    if isinstance(result, dict):
+        return {key: writable(value) for key, value in result.items()}
+    if isinstance(result, (tuple, list)):
+        return type(result)(writable(value) for value in result)
+    if isinstance(result, np.ndarray) and not result.flags.writeable and not _on_disk(result):
+        return np.array(result)
+    return result
+
+
+class _SpillPickler(pickle.Pickler):
+    # pickles arrays on disk as their path
+
+    def persistent_id(self, obj):
+        if isinstance(obj, ChunkedArray):
+            return ("chunks", str(obj.path))
+        if isinstance(obj, np.memmap) and _on_disk(obj):
+            order = "F" if obj.flags.f_contiguous and not obj.flags.c_contiguous else "C"
+            return ("memmap", obj.filename, obj.dtype.str, obj.shape, obj.offset, order)
+        return None
+
+
+class _SpillUnpickler(pickle.Unpickler):
+
+    def persistent_load(self, pid):
+        if pid[0] == "chunks":
+            return ChunkedArray(pid[1], mode="r")
+        _, filename, dtype, shape, offset, order = pid
+        return np.memmap(filename, dtype=dtype, mode="r", shape=shape, offset=offset, order=order)
+
+
+class _Entry:
+    # one cached result, value is None while it is spilled to path, stored lists the files its arrays on disk live in,
+    # shared holds the fingerprints of a result shared with a layer (None when the cache owns it read-only)
+
+    __slots__ = ("refs", "fingerprints", "value", "nbytes", "path", "stored", "shared")
+
+    def __init__(self, refs, fingerprints, value, nbytes, shared=None):
+        self.refs = refs
+        self.fingerprints = fingerprints
+        self.value = value
+        self.nbytes = nbytes
+        self.shared = shared
+        self.path = None
+        self.stored = frozenset(store_path(leaf).resolve() for leaf in _leaves(value) if _on_disk(leaf))
+
+
+class ResultCache:
+    """LRU cache of derived results bounded by a RAM budget, see the module docstring.
+
+    Args:
+        budget_bytes (int): bytes of results kept in RAM, 0 disables caching
+        spill_dir (str): directory evicted results are written to instead of being dropped, None to drop them
+    """
+
+    def __init__(self, budget_bytes:int=DEFAULT_BUDGET_BYTES, spill_dir:Optional[str]=None):
+        self.budget_bytes = int(budget_bytes)
+        self.spill_dir = spill_dir
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.RLock()
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes of results currently held in RAM."""
+        return self._nbytes
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def _key(command:str, sources:Sequence, params:dict) -> tuple:
+        return (command, tuple(id(source) for source in sources), tuple(sorted((name, repr(value)) for name, value in params.items())))
+
+    def get(self, command:str, sources:Sequence, params:dict):
+        """Cached result of command on sources with params, None on a miss.
+
+        Args:
+            command (str): operation name, e.g. "mip"
+            sources (Sequence): source arrays the result was derived from
+            params (dict): operation parameters, compared through their repr
+
+        Returns:
+            Cached result, its arrays read-only unless it was put shared (see detached), or None
+        """
+        if self.budget_bytes <= 0:
+            return None
+        key = self._key(command, sources, params)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or any(ref() is not source for ref, source in zip(entry.refs, sources)):
+                self.misses += 1
+                return None
+            fingerprints = entry.fingerprints
+            shared, value = entry.shared, entry.value
+        if fingerprints != tuple(fingerprint(source) for source in sources) or (shared is not None and shared != _result_fingerprints(value)):
+            with self._lock:
+                self._discard(key)
+                self.misses += 1
+            return None
+
+        with self._lock:
+            if self._entries.get(key) is not entry:
+                self.misses += 1
+                return None
+            if entry.value is None:
+                value = self._load(entry)
+                if value is None:
+                    self._discard(key)
+                    self.misses += 1
+                    return None
+                entry.value = freeze(value)
+                self._nbytes += entry.nbytes
+            self._entries.move_to_end(key)
+            self.hits += 1
+            self._evict()
+            return entry.value
+
+    def put(self, command:str, sources:Sequence, params:dict, result, shared:bool=False):
+        """Cache result of command on sources with params, results larger than the budget are not cached.
+
+        Args:
+            command (str): operation name, e.g. "mip"
+            sources (Sequence): source arrays the result was derived from, entries are dropped with any of them
+            params (dict): operation parameters, compared through their repr
+            result: array or (nested) tuple, list or dict of arrays, made read-only once cached
+            shared (bool): Flag indicating that result is handed to a layer as it is, it stays writable and the
+                entry is dropped as soon as its content changes, hits should be detached
+
+        Returns:
+            result
+        """
+        nbytes = result_nbytes(result)
+        if result is None or nbytes > self.budget_bytes:
+            return result
+        shared = _result_fingerprints(result) if shared else None
+        if shared is None:
+            freeze(result)
+        key = self._key(command, sources, params)
+        fingerprints = tuple(fingerprint(source) for source in sources)
+        try:
+            refs = tuple(weakref.ref(source, lambda _, key=key: self.discard(key)) for source in sources)
+        except TypeError:
+            return result
+
+        with self._lock:
+            self._discard(key)
+            self._entries[key] = _Entry(refs, fingerprints, result, nbytes, shared)
+            self._nbytes += nbytes
+            self._evict()
+        return result
+
+    def cached(self, command:str, sources:Sequence, params:dict, compute:Callable[[], object]):
+        """Cached result of command on sources with params, computed with compute() and cached on a miss.
+
+        The result may be read-only, see writable.
+        """
+        result = self.get(command, sources, params)
+        if result is None:
+            result = self.put(command, sources, params, compute())
+        return result
+
+    def invalidate(self, source):
+        """Drop every entry derived from source, e.g. after it was modified in place."""
+        with self._lock:
+            for key in [key for key, entry in self._entries.items() if any(ref() is source for ref in entry.refs)]:
+                self._discard(key)
+
+    def invalidate_result(self, result):
+        """Drop every entry holding the array result, e.g. after the layer it was shared with was edited."""
+        with self._lock:
+            for key in [key for key, entry in self._entries.items() if any(value is result for value in _leaves(entry.value))]:
+                self._discard(key)
+
+    def discard_stored(self, path):
+        """Drop every entry whose result lives in the file or directory at path, e.g. before it is deleted."""
+        path = Path(path).resolve()
+        with self._lock:
+            for key in [key for key, entry in self._entries.items() if path in entry.stored]:
+                self._discard(key)
+
+    def discard(self, key:tuple):
+        """Drop the entry of key if present."""
+        with self._lock:
+            self._discard(key)
+
+    def clear(self):
+        """Drop every entry, including spilled ones."""
+        with self._lock:
+            for key in list(self._entries):
+                self._discard(key)
+
+    def _discard(self, key:tuple):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        if entry.value is not None:
+            self._nbytes -= entry.nbytes
+        if entry.path is not None:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+
+    def _evict(self):
+        # spill or drop least recently used entries until the RAM budget is met
+        for key in list(self._entries):
+            if self._nbytes <= self.budget_bytes:
+                return
+            entry = self._entries[key]
+            if entry.value is None or entry.nbytes == 0:
+                continue
+            if entry.shared is not None and entry.shared != _result_fingerprints(entry.value):
+                # edited by the layer it is shared with
+                self._discard(key)
+            elif self.spill_dir is not None and self._spill(entry):
+                # the spilled copy is no longer shared, it is frozen when loaded back
+                entry.value = None
+                entry.shared = None
+                self._nbytes -= entry.nbytes
+            else:
+                self._discard(key)
+
+    def _spill(self, entry:_Entry) -> bool:
+        if entry.path is not None:
+            return True
+        try:
+            os.makedirs(self.spill_dir, exist_ok=True)
+            handle, path = tempfile.mkstemp(suffix=".pkl", prefix="result_", dir=self.spill_dir)
+            with os.fdopen(handle, "wb") as file:
+                _SpillPickler(file, protocol=pickle.HIGHEST_PROTOCOL).dump(entry.value)
+        except OSError:
+            logger.exception("could not spill cached result to %s", self.spill_dir)
+            return False
+        entry.path = path
+        return True
+
+    def _load(self, entry:_Entry):
+        try:
+            with open(entry.path, "rb") as file:
+                return _SpillUnpickler(file).load()
+        except (OSError, pickle.UnpicklingError, EOFError):
+            logger.exception("could not load spilled result %s", entry.path)
+            return None
+
+
+_CACHE: Optional[ResultCache] = None
+
+
+def result_cache() -> ResultCache:
+    """Cache shared by the commands, configured from the environment on first use."""
+    global _CACHE
+    if _CACHE is None:
+        budget_mb = os.environ.get(BUDGET_ENV_VAR, "").strip()
+        try:
+            budget_bytes = int(float(budget_mb) * 2**20) if budget_mb else DEFAULT_BUDGET_BYTES
+        except ValueError:
+            logger.warning("invalid result cache budget %r in %s", budget_mb, BUDGET_ENV_VAR)
+            budget_bytes = DEFAULT_BUDGET_BYTES
+        _CACHE = ResultCache(budget_bytes, os.environ.get(SPILL_ENV_VAR, "").strip() or None)
+        # spilled results do not outlive the process
+        atexit.register(_CACHE.clear)
+    return _CACHE
+
+
+def configure_cache(budget_bytes:int=DEFAULT_BUDGET_BYTES, spill_dir:Optional[str]=None) -> ResultCache:
+    """Change the budget and spill directory of the shared cache, evicting entries over the new budget."""
+    cache = result_cache()
+    with cache._lock:
+        cache.budget_bytes = int(budget_bytes)
+        cache.spill_dir = spill_dir
+        if cache.budget_bytes <= 0:
+            cache.clear()
+        cache._evict()
+    return cache
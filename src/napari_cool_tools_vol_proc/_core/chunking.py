@@ -0,0 +1,149 @@
+"""
+This module contains helpers streaming volumes as overlapping sub-volume chunks and stitching results back.
+"""
+from enum import Enum
+from typing import Callable, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from napari_cool_tools_vol_proc._core.tiling import axis_index, map_tiles, split_ranges
+
+
+class Remainder(Enum):
+    """Handling of the trailing slices when the axis length is not a multiple of the chunk length."""
+    DROP = "drop"
+    LAST = "merge into last"
+    EXTRA = "extra chunk"
+    SPREAD = "spread evenly"
+
+
+class Chunk(NamedTuple):
+    """Sub-volume of a chunked volume.
+
+    Attributes:
+        index (int): position of the chunk in iteration order
+        core (slice): range along the chunked axis owned by the chunk, in volume coordinates
+        padded (slice): core extended by the halo and clipped to the volume, the range data was read from
+        data (array-like): view of the volume over padded (basic slicing, no copy for ndarrays and memmaps)
+    """
+    index: int
+    core: slice
+    padded: slice
+    data: object
+
+    @property
+    def inner(self) -> slice:
+        """Range of core within data along the chunked axis, used to crop the halo off results."""
+        return slice(self.core.start - self.padded.start, self.core.stop - self.padded.start)
+
+
+def chunk_bounds(length:int, chunks:Optional[int]=None, chunk_len:Optional[int]=None, remainder:Remainder=Remainder.EXTRA) -> List[Tuple[int, int]]:
+    """Split range(length) into consecutive (start, stop) chunks.
+
+    Args:
+        length (int): length of the chunked axis
+        chunks (int): number of chunks, the chunk length being length // chunks
+        chunk_len (int): chunk length, used when chunks is omitted
+        remainder (Remainder): handling of the length % chunk length trailing items, dropped,
+            merged into the last chunk, returned as an extra shorter chunk, or spread over
+            the chunks so their lengths differ by at most 1
+
+    Returns:
+        List of (start, stop) ranges
+    """
+    remainder = Remainder(remainder)
+    if chunks is not None:
+        if chunks < 1 or chunks > length:
+            raise ValueError(f"cannot split an axis of length {length} into {chunks} chunks")
+        if remainder == Remainder.SPREAD:
+            return split_ranges(length, chunks)
+        chunk_len = length // chunks
+    elif chunk_len is None or chunk_len < 1:
+        raise ValueError("either chunks or a positive chunk_len is required")
+    elif remainder == Remainder.SPREAD:
+        return split_ranges(length, -(-length // chunk_len))
+
+    full = length // chunk_len
+    bounds = [(i * chunk_len, (i + 1) * chunk_len) for i in range(full)]
+    if full * chunk_len < length:
+        if remainder == Remainder.EXTRA or not bounds:
+            bounds.append((full * chunk_len, length))
+        elif remainder == Remainder.LAST:
+            bounds[-1] = (bounds[-1][0], length)
+    return bounds
+
+
+def iter_chunks(data, chunks:Optional[int]=None, axis:int=0, chunk_len:Optional[int]=None, halo:int=0, remainder:Remainder=Remainder.EXTRA) -> Iterator[Chunk]:
+    """Lazily iterate over sub-volume views of data along axis with an overlapping halo.
+
+    Only slicing happens here, so an ndarray or memmap is never read until a
+    chunk's data is used, and chunks can be handed to workers one at a time.
+
+    Args:
+        data (array-like): volume supporting basic slicing (ndarray, memmap, ...)
+        chunks (int): number of chunks, see chunk_bounds
+        axis (int): axis along which the volume is chunked
+        chunk_len (int): chunk length, used when chunks is omitted
+        halo (int): number of neighbouring slices added on both sides of each chunk (clipped at the volume edges)
+        remainder (Remainder): handling of trailing slices, see chunk_bounds
+
+    Yields:
+        Chunk for every range of chunk_bounds
+    """
+    ndim = len(data.shape)
+    axis = axis % ndim
+    length = data.shape[axis]
+    halo = max(0, int(halo))
+    for index, (start, stop) in enumerate(chunk_bounds(length, chunks, chunk_len, remainder)):
+        padded = slice(max(0, start - halo), min(length, stop + halo))
+        yield Chunk(index, slice(start, stop), padded, data[axis_index(ndim, axis, padded)])
+
+
+def stitch(results:Iterable[Tuple[Chunk, np.ndarray]], out, axis:int=0):
+    """Write processed chunks back into a preallocated output.
+
+    Args:
+        results (Iterable[Tuple[Chunk, ndarray]]): (chunk, result) pairs, a result spans either the
+            padded range of its chunk (the halo is cropped off) or only its core range along axis
+        out (array-like): output supporting basic slice assignment (ndarray, writable memmap, ...)
+        axis (int): axis along which the volume was chunked
+
+    Returns:
+        out
+    """
+    ndim = len(out.shape)
+    axis = axis % ndim
+    for chunk, result in results:
+        core_len = chunk.core.stop - chunk.core.start
+        if result.shape[axis] != core_len:
+            if result.shape[axis] != chunk.padded.stop - chunk.padded.start:
+                raise ValueError(f"result of chunk {chunk.index} has length {result.shape[axis]} along axis {axis}, "
+                                 f"expected {core_len} or {chunk.padded.stop - chunk.padded.start}")
+            result = result[axis_index(ndim, axis, chunk.inner)]
+        out[axis_index(ndim, axis, chunk.core)] = result
+    return out
+
+
+def process_chunks(func:Callable[[np.ndarray], np.ndarray], data, out, axis:int=0, chunk_len:int=64, halo:int=0, workers:int=0):
+    """Apply func to overlapping chunks of data on a thread pool and stitch the results into out.
+
+    Args:
+        func (Callable): function of a chunk's padded data returning a result of the same length along axis
+        data (array-like): volume supporting basic slicing
+        out (array-like): preallocated output whose shape along axis matches data
+        axis (int): axis along which the volume is chunked
+        chunk_len (int): number of slices owned by each chunk
+        halo (int): number of neighbouring slices func sees on both sides of each chunk
+        workers (int): number of worker threads, 0 for one per CPU core
+
+    Returns:
+        out
+    """
+    chunks = list(iter_chunks(data, axis=axis, chunk_len=chunk_len, halo=halo))
+
+    def run(start, stop):
+        return [(chunk, func(np.asarray(chunk.data))) for chunk in chunks[start:stop]]
+
+    for results in map_tiles(run, [(i, i + 1) for i in range(len(chunks))], workers):
+        stitch(results, out, axis)
+    return out
@@ -0,0 +1,92 @@
+"""
+This module contains numpy kernels for drawing shapes into 2D label images.
+"""
+from typing import Optional, Tuple
+
+import numpy as np
+
+# pixels at exactly the radius are inside despite rounding, shared with the region volumes of _core.regions
+RADIUS_TOLERANCE = 1e-9
+
+
+def inside_radius2(radius:float) -> float:
+    """Largest squared distance to the (floating point) centre of a pixel inside a circle of radius."""
+    return radius * radius * (1 + RADIUS_TOLERANCE)
+
+
+def circle_box(shape:tuple, center:Tuple[float, float], radius:float) -> Tuple[slice, slice]:
+    """Slices of the bounding box of a circle clipped to an image of shape."""
+    radius = max(float(radius), 0.0)
+    box = []
+    for c, n in zip(center, shape[:2]):
+        start = int(np.floor(c - radius))
+        stop = int(np.ceil(c + radius)) + 1
+        box.append(slice(min(max(start, 0), n), min(max(stop, 0), n)))
+    return tuple(box)
+
+
+def circle_mask(shape:tuple, center:Tuple[float, float], radius:float) -> Tuple[Tuple[slice, slice], np.ndarray]:
+    """Mask of the pixels within radius of center restricted to the bounding box of the circle.
+
+    Pixels are inside when their squared distance to the unrounded center is at
+    most inside_radius2(radius), the convention RegionIndex.disk measures with.
+
+    Args:
+        shape (tuple): shape of the 2D image
+        center (Tuple[float, float]): (row, column) of the circle center
+        radius (float): circle radius in pixels
+
+    Returns:
+        (bounding box slices, boolean mask of the box pixels inside the circle)
+    """
+    box = circle_box(shape, center, radius)
+    rows = np.arange(box[0].start, box[0].stop)[:, np.newaxis] - center[0]
+    cols = np.arange(box[1].start, box[1].stop)[np.newaxis, :] - center[1]
+    return box, rows * rows + cols * cols <= inside_radius2(radius)
+
+
+class CircleBrush:
+    """Incrementally redraws a filled circle of varying radius around a fixed center.
+
+    The squared distance of every pixel to the center is computed once, so a new
+    radius is a threshold of that field, and only the pixels between the old and
+    new radius (inside the bounding box of the larger circle) are reported as
+    changed for the caller to write into a label image clear of the circle.
+
+    Args:
+        shape (tuple): shape of the 2D label image
+        center (Tuple[float, float]): (row, column) of the circle center
+        label_val (int): label value of the circle, outside pixels are set to 0
+    """
+
+    def __init__(self, shape:tuple, center:Tuple[float, float], label_val:int=1):
+        self.shape = tuple(shape[:2])
+        self.center = center
+        self.label_val = label_val
+        self.radius = None
+        rows = np.arange(self.shape[0], dtype=np.float64)[:, np.newaxis] - center[0]
+        cols = np.arange(self.shape[1], dtype=np.float64)[np.newaxis, :] - center[1]
+        self.distance2 = rows * rows + cols * cols
+
+    def set_radius(self, radius:float) -> Optional[Tuple[Tuple[np.ndarray, np.ndarray], int]]:
+        """Grow or shrink the circle to radius.
+
+        Returns:
+            (pixel coordinates that changed, value written to them) or None if nothing changed
+        """
+        old = -1.0 if self.radius is None else self.radius
+        if radius == old:
+            return None
+        self.radius = radius
+        low, high = sorted((old, radius))
+        value = self.label_val if radius > old else 0
+
+        box = circle_box(self.shape, self.center, high)
+        distance2 = self.distance2[box]
+        changed = distance2 <= inside_radius2(high)
+        if low >= 0:
+            changed &= distance2 > inside_radius2(low)
+        rows, cols = np.nonzero(changed)
+        if rows.size == 0:
+            return None
+        return (rows + box[0].start, cols + box[1].start), value
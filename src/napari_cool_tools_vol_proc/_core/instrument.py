@@ -0,0 +1,219 @@
+"""
+This module contains per-stage timing and memory instrumentation publishing structured events to pluggable sinks.
+
+Commands wrap their stages in
+
+    with stage("mip", "projections", bytes_read=data.nbytes) as record:
+        ...
+        record.add(planes=len(planes))
+
+and every sink (a callable of the event dict) receives one event per stage
+with its wall time, CPU time, bytes read, bytes allocated (when allocation
+tracing is on) and process peak RSS. Allocation tracing and peak RSS are per
+process, so the peaks of stages running concurrently in several threads
+include each other's allocations, and allocation peaks are only reported on
+Python 3.9+ (tracemalloc.reset_peak). Without sinks, stage returns a shared
+no-op context so instrumented code costs a function call and a truth test.
+Sinks are added with add_sink or from the NAPARI_COOL_TOOLS_INSTRUMENT
+environment variable, a comma separated list such as "log,jsonl:/tmp/stages.jsonl".
+"""
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+ENV_VAR = "NAPARI_COOL_TOOLS_INSTRUMENT"
+
+Sink = Callable[[dict], None]
+
+_SINKS: Optional[List[Sink]] = None
+_SINK_FACTORIES: Dict[str, Callable[[str], Sink]] = {}
+
+
+def peak_rss() -> Optional[int]:
+    """Peak resident set size of the process in bytes, None where unavailable."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def format_event(event:dict) -> str:
+    """One line summary of a stage event."""
+    text = f"{event['command']}/{event['stage']}: {event['wall_s']:.3f}s wall, {event['cpu_s']:.3f}s cpu"
+    if event.get("bytes_read"):
+        text += f", {event['bytes_read'] / 2**20:.1f} MB read"
+    if event.get("allocated_peak_bytes") is not None:
+        text += f", {event['allocated_peak_bytes'] / 2**20:.1f} MB peak allocated"
+    if event.get("peak_rss_bytes") is not None:
+        text += f", {event['peak_rss_bytes'] / 2**20:.0f} MB peak RSS"
+    if event["status"] != "ok":
+        text += f" ({event['status']})"
+    return text
+
+
+class LoggingSink:
+    """Sink writing each event as a one line summary to a logger."""
+
+    def __init__(self, name:str=__name__, level:int=logging.INFO):
+        self.logger = logging.getLogger(name)
+        self.level = level
+
+    def __call__(self, event:dict):
+        self.logger.log(self.level, "%s", format_event(event))
+
+
+class JsonLinesSink:
+    """Sink appending each event as a JSON line to a file.
+
+    Every line is written with a single write to a file opened with O_APPEND,
+    so lines of several threads or processes sharing the file do not interleave
+    (on local file systems, appends over NFS are not atomic).
+    """
+
+    def __init__(self, path:str):
+        self.path = path
+
+    def __call__(self, event:dict):
+        line = (json.dumps(event, default=str) + "\n").encode()
+        descriptor = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(descriptor, line)
+        finally:
+            os.close(descriptor)
+
+
+def register_sink_factory(name:str, factory:Callable[[str], Sink]):
+    """Make a sink available to NAPARI_COOL_TOOLS_INSTRUMENT as name or name:argument."""
+    _SINK_FACTORIES[name] = factory
+
+
+register_sink_factory("log", lambda argument: LoggingSink(argument or __name__))
+register_sink_factory("jsonl", lambda argument: JsonLinesSink(argument or "napari_cool_tools_stages.jsonl"))
+
+
+def _configured() -> List[Sink]:
+    global _SINKS
+    if _SINKS is None:
+        _SINKS = []
+        for spec in filter(None, (part.strip() for part in os.environ.get(ENV_VAR, "").split(","))):
+            name, _, argument = spec.partition(":")
+            if name == "trace":
+                tracemalloc.start()
+            elif name in _SINK_FACTORIES:
+                _SINKS.append(_SINK_FACTORIES[name](argument))
+            else:
+                logger.warning("unknown instrumentation sink %r in %s", name, ENV_VAR)
+    return _SINKS
+
+
+def add_sink(sink:Sink, trace_allocations:bool=False) -> Sink:
+    """Publish stage events to sink, trace_allocations also records numpy allocations (slows allocation heavy code)."""
+    _configured().append(sink)
+    if trace_allocations and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    return sink
+
+
+def remove_sink(sink:Sink):
+    """Stop publishing stage events to sink, allocation tracing stops with the last sink."""
+    sinks = _configured()
+    if sink in sinks:
+        sinks.remove(sink)
+    if not sinks and tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+def enabled() -> bool:
+    """Whether any sink receives stage events."""
+    return bool(_SINKS if _SINKS is not None else _configured())
+
+
+class _NullStage:
+    # shared context returned while instrumentation is disabled
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def add(self, **fields):
+        pass
+
+
+_NULL_STAGE = _NullStage()
+
+
+class Stage:
+    """Context measuring one stage of a command, see stage."""
+
+    def __init__(self, command:str, name:str, bytes_read:int=0, **fields):
+        self.event = {"command": command, "stage": name, "bytes_read": int(bytes_read), **fields}
+
+    def add(self, **fields):
+        """Attach fields to the event, numeric bytes_read values accumulate."""
+        if "bytes_read" in fields:
+            self.event["bytes_read"] += int(fields.pop("bytes_read"))
+        self.event.update(fields)
+
+    def __enter__(self):
+        self.tracing = tracemalloc.is_tracing()
+        if self.tracing:
+            self.allocated_start = tracemalloc.get_traced_memory()[0]
+            # the peak is process wide and cannot be reset before Python 3.9
+            self.peak_reset = hasattr(tracemalloc, "reset_peak")
+            if self.peak_reset:
+                tracemalloc.reset_peak()
+        self.cpu_start = time.process_time()
+        self.wall_start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        wall = time.perf_counter() - self.wall_start
+        cpu = time.process_time() - self.cpu_start
+        event = self.event
+        event.update(
+            wall_s=wall,
+            cpu_s=cpu,
+            thread=threading.current_thread().name,
+            timestamp=time.time(),
+            peak_rss_bytes=peak_rss(),
+            status="ok" if exc_type is None else exc_type.__name__,
+        )
+        if self.tracing and tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            event.update(allocated_bytes=current - self.allocated_start)
+            if self.peak_reset:
+                event.update(allocated_peak_bytes=peak - self.allocated_start)
+        for sink in list(_SINKS or ()):
+            try:
+                sink(event)
+            except Exception:  # noqa: BLE001 - a failing sink must not break the command
+                logger.exception("instrumentation sink %r failed", sink)
+        return False
+
+
+def stage(command:str, name:str, bytes_read:int=0, **fields):
+    """Context manager publishing the cost of a stage of command to every sink.
+
+    Args:
+        command (str): command the stage belongs to, e.g. "mip"
+        name (str): stage name, e.g. "projections"
+        bytes_read (int): bytes of input read by the stage, more can be added with record.add(bytes_read=...)
+        **fields: extra JSON serializable fields of the event
+
+    Returns:
+        Context yielding a record whose add(**fields) attaches fields to the event
+    """
+    if not (_SINKS if _SINKS is not None else _configured()):
+        return _NULL_STAGE
+    return Stage(command, name, bytes_read, **fields)
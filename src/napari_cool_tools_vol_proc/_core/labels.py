@@ -0,0 +1,250 @@
+"""
+This module contains numpy kernels for measuring label volumes.
+"""
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+
+import numpy as np
+
+from napari_cool_tools_vol_proc._core.storage import allocate
+from napari_cool_tools_vol_proc._core.tiling import DEFAULT_CHUNK_BYTES, Steps, axis_index, map_tiles, run_steps, tile_ranges
+
+
+BINCOUNT_LIMIT = 2**20
+
+
+def _value_counts(values:np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    # (values present, voxel counts) using bincount when the labels are small non negative integers
+    flat = values.ravel()
+    if flat.dtype == np.bool_:
+        flat = flat.view(np.uint8)
+    if flat.size and flat.dtype.kind in "iu" and flat.min() >= 0 and flat.max() < BINCOUNT_LIMIT:
+        counts = np.bincount(flat)
+        present = np.flatnonzero(counts)
+        return present, counts[present]
+    return np.unique(flat, return_counts=True)
+
+
+def label_statistics(data, scale:Optional[Iterable[float]]=None, per_bscan:bool=False, axis:int=0, include_background:bool=False, chunk_bytes:int=DEFAULT_CHUNK_BYTES, workers:int=0) -> Dict[int, dict]:
+    """Count the voxels and physical volume of every label in one pass over a label volume.
+
+    The volume is read in tiles along axis, so memmapped label volumes are
+    processed in bounded memory, and every label is counted by the same
+    bincount instead of one boolean mask per label.
+
+    Args:
+        data (array-like): integer label volume supporting basic slicing (ndarray, memmap, ...)
+        scale (Iterable[float]): voxel size along each axis (mm for volumes in mm³), 1 if omitted
+        per_bscan (bool): Flag indicating that voxel counts are also reported for every slice along axis
+        axis (int): axis along which the volume is tiled and per B-scan counts are reported
+        include_background (bool): Flag indicating that label 0 is reported as well
+        chunk_bytes (int): approximate number of input bytes read per tile
+        workers (int): number of worker threads, 0 for one per CPU core
+
+    Returns:
+        Dict mapping each label to {"voxels": int, "volume_mm3": float} plus
+        "per_bscan": ndarray of voxel counts per slice when per_bscan is set
+    """
+    return run_steps(label_statistics_steps(data, scale, per_bscan, axis, include_background, chunk_bytes, workers))
+
+
+def label_statistics_steps(data, scale:Optional[Iterable[float]]=None, per_bscan:bool=False, axis:int=0, include_background:bool=False, chunk_bytes:int=DEFAULT_CHUNK_BYTES, workers:int=0) -> Steps:
+    """Step generator of label_statistics yielding (done, total) after every tile and returning the statistics."""
+    ndim = len(data.shape)
+    axis = axis % ndim
+    length = data.shape[axis]
+    voxel_volume = float(np.prod(list(scale))) if scale is not None else 1.0
+    slice_bytes = np.dtype(data.dtype).itemsize * int(np.prod(data.shape)) // max(length, 1)
+    tile_len = max(1, chunk_bytes // max(slice_bytes, 1))
+
+    def run(start, stop):
+        tile = np.asarray(data[axis_index(ndim, axis, slice(start, stop))])
+        if not per_bscan:
+            return [_value_counts(tile)]
+        return [_value_counts(tile[axis_index(ndim, axis, i)]) for i in range(stop - start)]
+
+    totals = {}
+    slices = []
+    ranges = tile_ranges(length, tile_len)
+    for done, parts in enumerate(map_tiles(run, ranges, workers), 1):
+        for values, counts in parts:
+            for value, count in zip(values.tolist(), counts.tolist()):
+                totals[value] = totals.get(value, 0) + count
+        if per_bscan:
+            slices.extend(parts)
+        yield done, len(ranges)
+
+    labels = sorted(label for label in totals if include_background or label != 0)
+    stats = {label: {"voxels": totals[label], "volume_mm3": totals[label] * voxel_volume} for label in labels}
+    if per_bscan:
+        position = {label: i for i, label in enumerate(labels)}
+        table = np.zeros((length, len(labels)), dtype=np.int64)
+        for i, (values, counts) in enumerate(slices):
+            for value, count in zip(values.tolist(), counts.tolist()):
+                if value in position:
+                    table[i, position[value]] = count
+        for label in labels:
+            stats[label]["per_bscan"] = table[:, position[label]]
+    return stats
+
+
+def format_label_statistics(stats:Dict[int, dict]) -> str:
+    """Render label_statistics output as a plain text table."""
+    lines = [f"{'label':>8}{'voxels':>16}{'volume (mm³)':>16}"]
+    for label, entry in stats.items():
+        lines.append(f"{label:>8}{entry['voxels']:>16}{entry['volume_mm3']:>16.6g}")
+    return "\n".join(lines)
+
+
+def label_codes(tile:np.ndarray, labels:np.ndarray) -> np.ndarray:
+    """Map each voxel to 1 + the position of its value in sorted labels, 0 if not requested."""
+    codes_dtype = np.uint8 if len(labels) < 255 else np.int64
+    if len(labels) == 0:
+        return np.zeros(np.shape(tile), dtype=codes_dtype)
+    if tile.dtype.kind in "biu" and tile.dtype.itemsize <= 2:
+        info = np.iinfo(tile.dtype) if tile.dtype.kind != "b" else np.iinfo(np.uint8)
+        lut = np.zeros(int(info.max) - int(info.min) + 1, dtype=codes_dtype)
+        valid = (labels >= info.min) & (labels <= info.max)
+        lut[labels[valid].astype(np.int64) - int(info.min)] = np.arange(1, len(labels) + 1)[valid]
+        return lut[tile.astype(np.int64) - int(info.min)] if info.min else lut[tile]
+    position = np.searchsorted(labels, tile)
+    found = labels[np.minimum(position, len(labels) - 1)] == tile
+    return np.where(found, position + 1, 0).astype(codes_dtype)
+
+
+def label_bounding_boxes(data, labels:Iterable[int], chunk_bytes:int=DEFAULT_CHUNK_BYTES, workers:int=0) -> Dict[int, Optional[Tuple[slice, ...]]]:
+    """Find the bounding box of every requested label in one pass over a label volume.
+
+    Each tile is mapped to compact label codes once and, slice by slice, a
+    bincount of code * extent + coordinate gives the positions occupied by every
+    label along every axis, so the cost does not grow with the number of labels.
+
+    Args:
+        data (array-like): label volume supporting basic slicing (ndarray, memmap, ...)
+        labels (Iterable[int]): label values to locate
+        chunk_bytes (int): approximate number of input bytes read per tile
+        workers (int): number of worker threads, 0 for one per CPU core
+
+    Returns:
+        Dict mapping each label to a tuple of slices bounding it, or None if the label is absent
+    """
+    requested = list(dict.fromkeys(int(label) for label in labels))
+    if not requested:
+        return {}
+    sorted_labels = np.array(sorted(requested))
+    n_codes = len(sorted_labels) + 1
+    shape = data.shape
+    ndim = len(shape)
+    slice_bytes = np.dtype(data.dtype).itemsize * int(np.prod(shape[1:]))
+    tile_len = max(1, chunk_bytes // max(slice_bytes, 1))
+    coords = [np.arange(n).reshape((-1,) + (1,) * (ndim - 2 - axis)) for axis, n in enumerate(shape[1:])]
+
+    def run(start, stop):
+        codes = label_codes(np.asarray(data[start:stop]), sorted_labels)
+        present = [np.zeros((n_codes, stop - start), dtype=bool)]
+        present += [np.zeros((n_codes, n), dtype=bool) for n in shape[1:]]
+        for z in range(stop - start):
+            code = codes[z].astype(np.int64)
+            present[0][:, z] = np.bincount(code.ravel(), minlength=n_codes) > 0
+            for axis, n in enumerate(shape[1:]):
+                present[axis + 1] |= np.bincount((code * n + coords[axis]).ravel(), minlength=n_codes * n).reshape(n_codes, n) > 0
+        return start, present
+
+    occupied = [np.zeros((n_codes, n), dtype=bool) for n in shape]
+    for start, present in map_tiles(run, tile_ranges(shape[0], tile_len), workers):
+        occupied[0][:, start:start + present[0].shape[1]] = present[0]
+        for axis in range(1, ndim):
+            occupied[axis] |= present[axis]
+
+    boxes = {}
+    for code, label in enumerate(sorted_labels, start=1):
+        if not occupied[0][code].any():
+            boxes[int(label)] = None
+            continue
+        box = []
+        for axis in range(ndim):
+            hits = np.flatnonzero(occupied[axis][code])
+            box.append(slice(int(hits[0]), int(hits[-1]) + 1))
+        boxes[int(label)] = tuple(box)
+    return {label: boxes[label] for label in requested}
+
+
+def isolate_labels(img, lbl, labels:Iterable[int], crop:bool=True, in_place:bool=False, chunk_bytes:int=DEFAULT_CHUNK_BYTES, workers:int=0) -> Iterator[Tuple[int, np.ndarray, Tuple[int, ...]]]:
+    """Isolate the voxels of img belonging to each requested label of lbl.
+
+    Args:
+        img (array-like): image volume
+        lbl (array-like): label volume of the same shape as img
+        labels (Iterable[int]): label values to isolate
+        crop (bool): Flag indicating that each output is cropped to the bounding box of its label
+        in_place (bool): Flag indicating that img is masked in place to the union of the requested labels
+            (no copy of the volume is made) and outputs are views of img instead of masked copies
+        chunk_bytes (int): approximate number of input bytes read per tile
+        workers (int): number of worker threads, 0 for one per CPU core
+
+    Yields:
+        (label, isolated volume, offset of the volume within img) for every label present in lbl,
+        every requested label when crop is off
+    """
+    labels = list(dict.fromkeys(int(label) for label in labels))
+    if tuple(img.shape) != tuple(lbl.shape):
+        raise ValueError(f"image shape {img.shape} does not match label shape {lbl.shape}")
+    if not labels:
+        return
+    full = tuple(slice(0, n) for n in img.shape)
+    boxes = label_bounding_boxes(lbl, labels, chunk_bytes, workers) if crop else {label: full for label in labels}
+
+    if in_place:
+        sorted_labels = np.array(sorted(labels))
+        slice_bytes = np.dtype(lbl.dtype).itemsize * int(np.prod(lbl.shape[1:]))
+
+        def run(start, stop):
+            keep = label_codes(np.asarray(lbl[start:stop]), sorted_labels) > 0
+            img[start:stop][~keep] = 0
+
+        for _ in map_tiles(run, tile_ranges(lbl.shape[0], max(1, chunk_bytes // max(slice_bytes, 1))), workers):
+            pass
+
+    for label in labels:
+        box = boxes[label]
+        if box is None:
+            continue
+        offset = tuple(s.start for s in box)
+        if in_place:
+            yield label, img[box], offset
+        else:
+            yield label, mask_label(img[box], lbl[box], label, chunk_bytes=chunk_bytes, workers=workers), offset
+
+
+def mask_label(img, lbl, label:int, out=None, chunk_bytes:int=DEFAULT_CHUNK_BYTES, workers:int=0):
+    """Copy of img keeping only the voxels where lbl equals label, written tile by tile along axis 0.
+
+    Args:
+        img (array-like): image volume supporting basic slicing (ndarray, memmap, ...)
+        lbl (array-like): label volume of the same shape as img
+        label (int): label value to keep
+        out (array-like): optional output of the img shape and dtype, may be img itself
+        chunk_bytes (int): approximate number of input bytes read per tile
+        workers (int): number of worker threads, 0 for one per CPU core
+
+    Returns:
+        Masked volume (out)
+    """
+    shape = tuple(img.shape)
+    if tuple(lbl.shape) != shape:
+        raise ValueError(f"image shape {img.shape} does not match label shape {lbl.shape}")
+    if out is None:
+        out = allocate(shape, img.dtype, "isolated")
+    elif tuple(out.shape) != shape:
+        raise ValueError(f"out has shape {out.shape}, expected {shape}")
+    if len(shape) == 0:
+        out[...] = np.where(np.asarray(lbl) == label, np.asarray(img), 0)
+        return out
+    slice_bytes = (np.dtype(img.dtype).itemsize + np.dtype(lbl.dtype).itemsize) * int(np.prod(shape[1:]))
+
+    def run(start, stop):
+        out[start:stop] = np.where(np.asarray(lbl[start:stop]) == label, np.asarray(img[start:stop]), 0)
+
+    for _ in map_tiles(run, tile_ranges(shape[0], max(1, chunk_bytes // max(slice_bytes, 1))), workers):
+        pass
+
+    return out
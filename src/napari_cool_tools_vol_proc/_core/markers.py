@@ -0,0 +1,59 @@
+"""
+This module contains a store of named enface markers such as the fovea and optic disc.
+"""
+from math import hypot
+from typing import Dict, Iterator, Optional, Tuple
+
+import numpy as np
+
+
+class MarkerStore:
+    """Named (row, column) positions on an enface image, looked up by name in constant time.
+
+    Markers keep their insertion order, so coordinates() and names() can back
+    a points layer showing them.
+    """
+
+    def __init__(self, markers:Optional[Dict[str, Tuple[float, float]]]=None):
+        self._positions = {}
+        for name, position in (markers or {}).items():
+            self.set(name, position)
+
+    def set(self, name:str, position:Tuple[float, float]):
+        """Place marker name at the (row, column) position, replacing a previous one."""
+        self._positions.pop(name, None)
+        self._positions[name] = (float(position[0]), float(position[1]))
+
+    def get(self, name:str) -> Optional[Tuple[float, float]]:
+        """(row, column) of marker name, None if it is not placed."""
+        return self._positions.get(name)
+
+    def remove(self, name:str):
+        """Remove marker name if it is placed."""
+        self._positions.pop(name, None)
+
+    def __contains__(self, name:str) -> bool:
+        return name in self._positions
+
+    def __len__(self):
+        return len(self._positions)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._positions)
+
+    def names(self) -> list:
+        """Names of the placed markers in placement order."""
+        return list(self._positions)
+
+    def coordinates(self) -> np.ndarray:
+        """(markers, 2) array of the marker positions in placement order."""
+        return np.array(list(self._positions.values()), dtype=np.float64).reshape(-1, 2)
+
+    def distance(self, first:str, second:str, spacing:Tuple[float, float]=(1.0, 1.0)) -> float:
+        """Distance between two placed markers, in pixels or in units of spacing.
+
+        Errors:
+            KeyError when either marker is not placed
+        """
+        (r0, c0), (r1, c1) = self._positions[first], self._positions[second]
+        return hypot((r1 - r0) * spacing[0], (c1 - c0) * spacing[1])
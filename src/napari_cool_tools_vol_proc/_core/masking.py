@@ -0,0 +1,134 @@
+"""
+This module contains numpy kernels for applying 2D masks to volumetric data.
+"""
+from typing import Optional, Sequence, Tuple
+
+import numpy as np
+
+from napari_cool_tools_vol_proc._core.storage import allocate
+from napari_cool_tools_vol_proc._core.tiling import DEFAULT_CHUNK_BYTES, map_tiles, tile_ranges
+
+
+def resolve_mask_axes(mask_shape:tuple, volume_shape:tuple, mask_axes:Optional[Sequence[int]]=None) -> Tuple[int, int]:
+    """Axes of a 3D volume matched by the two axes of a 2D mask.
+
+    Args:
+        mask_shape (tuple): shape of the 2D mask
+        volume_shape (tuple): shape of the 3D volume
+        mask_axes (Sequence[int]): explicit volume axes of mask axes 0 and 1, matched by shape when omitted
+
+    Returns:
+        (volume axis of mask axis 0, volume axis of mask axis 1)
+
+    Errors:
+        ValueError when explicit axes do not match the shapes, or when matching by
+        shape finds no or several candidates (e.g. two volume axes of equal size)
+    """
+    ndim = len(volume_shape)
+    if len(mask_shape) != 2 or ndim != 3:
+        raise ValueError(f"expected a 2D mask and 3D volume, got shapes {mask_shape} and {volume_shape}")
+    if mask_axes is not None:
+        axes = tuple(int(axis) % ndim for axis in mask_axes)
+        if len(axes) != 2 or axes[0] == axes[1] or any(volume_shape[a] != n for a, n in zip(axes, mask_shape)):
+            raise ValueError(f"mask axes {tuple(mask_axes)} do not map mask shape {mask_shape} onto volume shape {volume_shape}")
+        return axes
+
+    candidates = [
+        (i, j) for i in range(ndim) for j in range(ndim)
+        if i != j and volume_shape[i] == mask_shape[0] and volume_shape[j] == mask_shape[1]
+    ]
+    if len(candidates) != 1:
+        problem = "no" if not candidates else "ambiguous"
+        raise ValueError(f"{problem} match of mask shape {mask_shape} onto volume shape {volume_shape} "
+                         f"(candidates {candidates}), specify the mask axes explicitly")
+    return candidates[0]
+
+
+def broadcast_mask(mask:np.ndarray, mask_axes:Tuple[int, int], ndim:int=3) -> np.ndarray:
+    """View of a 2D mask with its axes reordered onto mask_axes and a length 1 projection axis."""
+    if mask_axes[0] > mask_axes[1]:
+        mask = mask.T
+    depth = ({0, 1, 2} - set(mask_axes)).pop()
+    return np.expand_dims(mask, depth)
+
+
+def project_mask(mask:np.ndarray, volume, mask_axes:Optional[Sequence[int]]=None, out=None, chunk_bytes:int=DEFAULT_CHUNK_BYTES, workers:int=0):
+    """Keep the voxels of volume whose projection lies inside a 2D mask, zeroing all others.
+
+    The mask is broadcast along the remaining axis instead of being repeated,
+    and the volume is processed in tiles along axis 0, so the cost is about one
+    pass over the volume and the output keeps the volume dtype. Pass out=volume
+    to apply the mask in place (e.g. on a writable memmap).
+
+    Args:
+        mask (ndarray): 2D mask, nonzero pixels are kept
+        volume (array-like): 3D volume supporting basic slicing (ndarray, memmap, ...)
+        mask_axes (Sequence[int]): volume axes of mask axes 0 and 1, matched by shape when omitted
+        out (array-like): optional output of the volume shape, may be volume itself
+        chunk_bytes (int): approximate number of input bytes read per tile
+        workers (int): number of worker threads, 0 for one per CPU core
+
+    Returns:
+        Masked volume (out)
+    """
+    axes = resolve_mask_axes(mask.shape, tuple(volume.shape), mask_axes)
+    keep = broadcast_mask(np.asarray(mask) != 0, axes)
+    if out is None:
+        out = allocate(volume.shape, volume.dtype, "masked")
+    elif tuple(out.shape) != tuple(volume.shape):
+        raise ValueError(f"out has shape {out.shape}, expected {volume.shape}")
+
+    slice_bytes = np.dtype(volume.dtype).itemsize * int(np.prod(volume.shape[1:]))
+    tile_len = max(1, chunk_bytes // max(slice_bytes, 1))
+
+    def run(start, stop):
+        tile_keep = keep[start:stop] if keep.shape[0] > 1 else keep
+        tile = np.asarray(volume[start:stop])
+        if isinstance(out, np.ndarray):
+            np.multiply(tile, tile_keep, out=out[start:stop], casting="unsafe")
+        else:
+            out[start:stop] = tile * tile_keep
+
+    for _ in map_tiles(run, tile_ranges(volume.shape[0], tile_len), workers):
+        pass
+
+    return out
+
+
+def expand_mask(mask:np.ndarray, shape:tuple, mask_axes:Optional[Sequence[int]]=None, out=None, dtype=np.int8, chunk_bytes:int=DEFAULT_CHUNK_BYTES, workers:int=0):
+    """Repeat a 2D mask along the remaining axis of a volume of shape, writing it tile by tile.
+
+    Only needed to export a full 3D mask, measurements and masking broadcast the
+    2D mask instead. Pass a memmap as out to write masks larger than RAM.
+
+    Args:
+        mask (ndarray): 2D mask
+        shape (tuple): shape of the 3D output
+        mask_axes (Sequence[int]): output axes of mask axes 0 and 1, matched by shape when omitted
+        out (array-like): optional output of shape
+        dtype (dtype): output dtype when out is omitted
+        chunk_bytes (int): approximate number of output bytes written per tile
+        workers (int): number of worker threads, 0 for one per CPU core
+
+    Returns:
+        3D mask (out)
+    """
+    shape = tuple(shape)
+    axes = resolve_mask_axes(mask.shape, shape, mask_axes)
+    values = broadcast_mask(np.asarray(mask), axes)
+    if out is None:
+        out = allocate(shape, dtype, "mask")
+    elif tuple(out.shape) != shape:
+        raise ValueError(f"out has shape {out.shape}, expected {shape}")
+
+    slice_bytes = np.dtype(out.dtype).itemsize * int(np.prod(shape[1:]))
+    tile_len = max(1, chunk_bytes // max(slice_bytes, 1))
+
+    def run(start, stop):
+        tile_values = values[start:stop] if values.shape[0] > 1 else values
+        out[start:stop] = np.broadcast_to(tile_values, (stop - start,) + shape[1:])
+
+    for _ in map_tiles(run, tile_ranges(shape[0], tile_len), workers):
+        pass
+
+    return out
@@ -0,0 +1,262 @@
+"""
+This module contains numpy kernels for projections of volumetric data.
+"""
+from enum import Enum
+from typing import Dict, Iterable, Optional, Tuple
+
+import numpy as np
+
+from napari_cool_tools_vol_proc._core.tiling import DEFAULT_CHUNK_BYTES, axis_index, map_tiles, tile_ranges
+
+# axis of a (z, y, x) volume reduced for each orthogonal projection plane, and
+# whether the reduced result is transposed to match the plane orientation
+PLANES = {
+    "yx": (1, True),
+    "zy": (0, False),
+    "xz": (2, True),
+}
+
+
+class ProjectionType(Enum):
+    """Statistic computed along the projection axis.
+
+    ARGMAX returns the index along the projection axis of the maximum value
+    (depth-of-max map for enface projections). SUM is exact in a 64 bit integer
+    for integer and boolean data and float64 otherwise, MEAN and STD are float64.
+    """
+    MAX = "max"
+    MIN = "min"
+    MEAN = "mean"
+    SUM = "sum"
+    STD = "std"
+    ARGMAX = "argmax"
+
+
+def _sum_dtype(dtype) -> np.dtype:
+    # exact accumulator of SUM, see ProjectionType
+    dtype = np.dtype(dtype)
+    if dtype == np.uint64:
+        return dtype
+    return np.dtype(np.int64) if dtype.kind in "biu" else np.dtype(np.float64)
+
+
+class _RunningStats:
+    """Accumulates statistics along axis 0 of a volume one tile at a time.
+
+    partial() reduces a tile independently (safe to run on worker threads) and
+    merge() folds partials in tile order, so the result does not depend on how
+    many tiles are reduced concurrently.
+    """
+
+    def __init__(self, stats:set):
+        self.stats = stats
+        self.count = 0
+        self.max = self.min = self.argmax = None
+        self.sum = self.m2 = None
+
+    def partial(self, tile:np.ndarray, start:int) -> dict:
+        part = {"count": tile.shape[0]}
+        if self.stats & {ProjectionType.MAX, ProjectionType.ARGMAX}:
+            part["max"] = tile.max(0)
+        if ProjectionType.ARGMAX in self.stats:
+            part["argmax"] = tile.argmax(0) + start
+        if ProjectionType.MIN in self.stats:
+            part["min"] = tile.min(0)
+        if self.stats & {ProjectionType.MEAN, ProjectionType.SUM, ProjectionType.STD}:
+            part["sum"] = tile.sum(0, dtype=_sum_dtype(tile.dtype))
+        if ProjectionType.STD in self.stats:
+            part["m2"] = tile.var(0, dtype=np.float64) * tile.shape[0]
+        return part
+
+    def merge(self, part:dict):
+        n = part["count"]
+        if "max" in part:
+            if self.max is None:
+                self.max, self.argmax = part["max"], part.get("argmax")
+            else:
+                if "argmax" in part:
+                    greater = part["max"] > self.max
+                    self.argmax[greater] = part["argmax"][greater]
+                np.maximum(self.max, part["max"], out=self.max)
+        if "min" in part:
+            self.min = part["min"] if self.min is None else np.minimum(self.min, part["min"], out=self.min)
+        if "sum" in part:
+            if self.sum is None:
+                self.sum, self.m2 = part["sum"], part.get("m2")
+            else:
+                if self.m2 is not None:
+                    # Chan et al. pairwise update of the sum of squared deviations
+                    delta = part["sum"] / n - self.sum / self.count
+                    self.m2 += part["m2"] + delta * delta * (self.count * n / (self.count + n))
+                np.add(self.sum, part["sum"], out=self.sum)
+        self.count += n
+
+    def result(self, stat:"ProjectionType") -> np.ndarray:
+        if stat == ProjectionType.MAX:
+            return self.max
+        if stat == ProjectionType.MIN:
+            return self.min
+        if stat == ProjectionType.ARGMAX:
+            return self.argmax
+        if stat == ProjectionType.MEAN:
+            return self.sum / self.count
+        if stat == ProjectionType.SUM:
+            return self.sum
+        return np.sqrt(self.m2 / self.count)
+
+
+def _reduce(tile:np.ndarray, axis:int, stat:ProjectionType) -> np.ndarray:
+    if stat == ProjectionType.MAX:
+        return tile.max(axis)
+    if stat == ProjectionType.MIN:
+        return tile.min(axis)
+    if stat == ProjectionType.MEAN:
+        return tile.mean(axis, dtype=np.float64)
+    if stat == ProjectionType.SUM:
+        return tile.sum(axis, dtype=_sum_dtype(tile.dtype))
+    if stat == ProjectionType.STD:
+        return tile.std(axis, dtype=np.float64)
+    return tile.argmax(axis)
+
+
+def _result_dtype(dtype, stat:ProjectionType) -> np.dtype:
+    if stat in (ProjectionType.MAX, ProjectionType.MIN):
+        return np.dtype(dtype)
+    if stat == ProjectionType.ARGMAX:
+        return np.dtype(np.intp)
+    if stat == ProjectionType.SUM:
+        return _sum_dtype(dtype)
+    return np.dtype(np.float64)
+
+
+def projections(data, planes:Iterable[str]=("yx",), stats:Iterable[ProjectionType]=(ProjectionType.MAX,), tile_bytes:int=DEFAULT_CHUNK_BYTES, workers:int=0) -> Dict[Tuple[str, ProjectionType], np.ndarray]:
+    """Compute projections of a 3D volume on any orthogonal planes in one pass.
+
+    The volume is read once in contiguous tiles along axis 0. Each tile is
+    reduced along axes 1 and 2 into rows of the yx and xz projections and folded
+    into running statistics for the zy projection, so asking for several planes
+    or statistics does not re-read the volume. Tiles are reduced on a thread
+    pool and the zy statistics are merged in tile order.
+
+    Args:
+        data (array-like): 3D volume supporting basic slicing (ndarray, memmap, ...)
+        planes (Iterable[str]): any of "yx" (reduce axis 1), "zy" (reduce axis 0), "xz" (reduce axis 2)
+        stats (Iterable[ProjectionType]): statistics to compute for every plane
+        tile_bytes (int): approximate number of input bytes read per tile
+        workers (int): number of worker threads, 0 for one per CPU core
+
+    Returns:
+        Dict mapping (plane, stat) to the projection, in the order requested
+    """
+    planes = list(dict.fromkeys(planes))
+    stats = [ProjectionType(stat) for stat in dict.fromkeys(stats)]
+    unknown = set(planes) - set(PLANES)
+    if unknown:
+        raise ValueError(f"unknown projection planes {unknown}, expected any of {list(PLANES)}")
+    if len(data.shape) != 3:
+        raise ValueError(f"projections need 3D data, got shape {data.shape}")
+
+    length = data.shape[0]
+    slice_bytes = np.dtype(data.dtype).itemsize * data.shape[1] * data.shape[2]
+    tile_len = max(1, tile_bytes // max(slice_bytes, 1))
+
+    running = _RunningStats(set(stats)) if "zy" in planes else None
+    outputs = {}
+    for plane in planes:
+        axis = PLANES[plane][0]
+        if axis == 0:
+            continue
+        shape = (length, data.shape[3 - axis])
+        for stat in stats:
+            outputs[(plane, stat)] = np.empty(shape, dtype=_result_dtype(data.dtype, stat))
+
+    def run(start, stop):
+        tile = np.asarray(data[start:stop])
+        for (plane, stat), out in outputs.items():
+            out[start:stop] = _reduce(tile, PLANES[plane][0], stat)
+        return running.partial(tile, start) if running is not None else None
+
+    for part in map_tiles(run, tile_ranges(length, tile_len), workers):
+        if part is not None:
+            running.merge(part)
+
+    results = {}
+    for plane in planes:
+        axis, transpose = PLANES[plane]
+        for stat in stats:
+            result = running.result(stat) if axis == 0 else outputs[(plane, stat)]
+            results[(plane, stat)] = result.T if transpose else result
+
+    return results
+
+
+class SlabMaxIndex:
+    """Sparse table answering max projections of any slab [z0, z1) along an axis.
+
+    Level k holds the max over every run of 2**k consecutive slices, so a slab
+    shorter than twice the largest kept run is the max of two overlapping table
+    entries and costs O(enface pixels) independent of the slab thickness. Level
+    0 is the source volume itself; each further level costs about one volume of
+    memory, so the number of levels kept is bounded by max_levels and
+    memory_budget. Longer slabs are answered with ceil(length / 2**top) lookups.
+
+    Args:
+        data (array-like): volume supporting basic slicing (ndarray, memmap, ...)
+        axis (int): depth axis the slabs are taken along
+        max_levels (int): optional cap on the number of levels including level 0
+        memory_budget (int): optional cap in bytes on the memory used by levels above 0
+        tile_bytes (int): approximate number of input bytes read per tile while building
+    """
+
+    def __init__(self, data, axis:int=1, max_levels:Optional[int]=None, memory_budget:Optional[int]=None, tile_bytes:int=DEFAULT_CHUNK_BYTES):
+        self.data = data
+        self.ndim = len(data.shape)
+        self.axis = axis % self.ndim
+        self.length = data.shape[self.axis]
+        self.enface_shape = data.shape[:self.axis] + data.shape[self.axis + 1:]
+        self.dtype = np.dtype(data.dtype)
+        self.levels = [None]
+
+        slice_bytes = self.dtype.itemsize * int(np.prod(self.enface_shape))
+        tile_len = max(1, tile_bytes // max(slice_bytes, 1))
+        used = 0
+        k = 1
+        while (1 << k) <= self.length and (max_levels is None or k < max_levels):
+            size = 1 << k
+            level_bytes = (self.length - size + 1) * slice_bytes
+            if memory_budget is not None and used + level_bytes > memory_budget:
+                break
+            level = np.empty((self.length - size + 1,) + self.enface_shape, dtype=self.dtype)
+            half = size >> 1
+            for start in range(0, len(level), tile_len):
+                stop = min(len(level), start + tile_len)
+                prev = self._slices(k - 1, start, stop + half)
+                np.maximum(prev[:stop - start], prev[half:half + stop - start], out=level[start:stop])
+            self.levels.append(level)
+            used += level_bytes
+            k += 1
+        self.nbytes = used
+
+    def _slices(self, k:int, start:int, stop:int) -> np.ndarray:
+        # consecutive entries of level k with depth as the first axis
+        if k > 0:
+            return self.levels[k][start:stop]
+        return np.moveaxis(np.asarray(self.data[axis_index(self.ndim, self.axis, slice(start, stop))]), self.axis, 0)
+
+    def _entry(self, k:int, start:int) -> np.ndarray:
+        if k > 0:
+            return self.levels[k][start]
+        return np.asarray(self.data[axis_index(self.ndim, self.axis, start)])
+
+    def query(self, z0:int, z1:int) -> np.ndarray:
+        """Max projection of slices z0 (inclusive) to z1 (exclusive) along axis."""
+        z0, z1 = max(0, int(z0)), min(self.length, int(z1))
+        if z1 <= z0:
+            raise ValueError(f"empty slab [{z0}, {z1})")
+        k = min(len(self.levels) - 1, (z1 - z0).bit_length() - 1)
+        size = 1 << k
+        starts = list(range(z0, z1 - size, size)) + [z1 - size]
+        out = np.array(self._entry(k, starts[0]))
+        for start in starts[1:]:
+            np.maximum(out, self._entry(k, start), out=out)
+        return out
@@ -0,0 +1,277 @@
+"""
+This module contains a region volume engine measuring labels inside enface circles, annuli and sectors.
+
+A label volume is collapsed once into per-label thickness maps, the number of
+voxels of each label along depth for every A-scan, and each map into a 2D
+summed-area table. The voxels of a label inside any rectangle then take four
+table lookups, and inside a disk, annulus or 45 degree sector two lookups per
+row of the region (rows of a disk or sector are column intervals), so zones can
+be measured at any centre and radius without touching the volume again.
+"""
+from typing import Dict, Iterable, Optional, Sequence, Tuple
+
+import numpy as np
+
+from napari_cool_tools_vol_proc._core.drawing import inside_radius2
+from napari_cool_tools_vol_proc._core.labels import _value_counts, label_codes
+from napari_cool_tools_vol_proc._core.tiling import DEFAULT_CHUNK_BYTES, map_tiles, tile_ranges
+
+SECTORS = ("right", "top", "left", "bottom")
+
+# diameters of the ETDRS grid circles in mm
+ETDRS_DIAMETERS = (1.0, 3.0, 6.0)
+
+
+def thickness_maps(data, enface_axes:Tuple[int, int]=(0, 2), labels:Optional[Iterable[int]]=None, include_background:bool=False, chunk_bytes:int=DEFAULT_CHUNK_BYTES, workers:int=0) -> Tuple[np.ndarray, np.ndarray]:
+    """Count the voxels of every label along depth for every A-scan in one pass over a label volume.
+
+    Args:
+        data (array-like): 3D integer label volume supporting basic slicing (ndarray, memmap, ...)
+        enface_axes (Tuple[int, int]): volume axes of the rows and columns of the maps, the remaining axis is depth
+        labels (Iterable[int]): label values to map, every label present when omitted
+        include_background (bool): Flag indicating that label 0 is mapped as well when labels is omitted
+        chunk_bytes (int): approximate number of input bytes read per tile
+        workers (int): number of worker threads, 0 for one per CPU core
+
+    Returns:
+        (sorted label values, int32 maps of shape (labels, rows, columns))
+    """
+    shape = tuple(data.shape)
+    if len(shape) != 3:
+        raise ValueError(f"expected a 3D label volume, got shape {shape}")
+    rows_axis, cols_axis = (int(axis) % 3 for axis in enface_axes)
+    if rows_axis == cols_axis:
+        raise ValueError(f"enface axes {tuple(enface_axes)} must differ")
+    depth = ({0, 1, 2} - {rows_axis, cols_axis}).pop()
+    requested = None if labels is None else sorted(set(int(label) for label in labels))
+    # int64 bincount indices dominate the memory of a tile
+    slice_bytes = 8 * int(np.prod(shape[1:]))
+    tile_len = max(1, chunk_bytes // max(slice_bytes, 1))
+
+    def run(start, stop):
+        tile = np.asarray(data[start:stop])
+        values = requested if requested is not None else _value_counts(tile)[0].tolist()
+        if not values:
+            return start, {}
+        # one bincount of code * pixels + pixel counts every label along depth at once
+        codes = label_codes(tile, np.array(values)).astype(np.int64)
+        tile_kept = tuple(n for axis, n in enumerate(tile.shape) if axis != depth)
+        pixels = int(np.prod(tile_kept))
+        pixel = np.expand_dims(np.arange(pixels, dtype=np.int64).reshape(tile_kept), depth)
+        counts = np.bincount((codes * pixels + pixel).ravel(), minlength=(len(values) + 1) * pixels)
+        counts = counts.reshape((len(values) + 1,) + tile_kept)[1:].astype(np.int32)
+        return start, dict(zip(values, counts))
+
+    # maps are accumulated in volume axis order without depth, then transposed to (rows, columns)
+    kept_shape = tuple(n for axis, n in enumerate(shape) if axis != depth)
+    maps = {value: np.zeros(kept_shape, dtype=np.int32) for value in requested or ()}
+    for start, counts in map_tiles(run, tile_ranges(shape[0], tile_len), workers):
+        for value, count in counts.items():
+            if value not in maps:
+                maps[value] = np.zeros(kept_shape, dtype=np.int32)
+            if depth == 0:
+                maps[value] += count
+            else:
+                maps[value][start:start + count.shape[0]] = count
+
+    values = sorted(value for value in maps if requested is not None or include_background or value != 0)
+    stacked = np.zeros((len(values),) + kept_shape, dtype=np.int32)
+    for i, value in enumerate(values):
+        stacked[i] = maps[value]
+    if rows_axis > cols_axis:
+        stacked = stacked.transpose(0, 2, 1)
+    return np.array(values, dtype=np.int64), np.ascontiguousarray(stacked)
+
+
+def summed_area_table(maps:np.ndarray) -> np.ndarray:
+    """Summed-area tables of a stack of 2D maps, padded with a leading row and column of zeros.
+
+    Args:
+        maps (ndarray): maps of shape (..., rows, columns)
+
+    Returns:
+        int64 array sat of shape (..., rows + 1, columns + 1) where sat[..., r, c] is the sum of maps[..., :r, :c]
+    """
+    maps = np.asarray(maps)
+    sat = np.zeros(maps.shape[:-2] + (maps.shape[-2] + 1, maps.shape[-1] + 1), dtype=np.int64)
+    np.cumsum(maps, axis=-2, dtype=np.int64, out=sat[..., 1:, 1:])
+    np.cumsum(sat[..., 1:, 1:], axis=-1, out=sat[..., 1:, 1:])
+    return sat
+
+
+def _snap(value:np.ndarray) -> np.ndarray:
+    # values within rounding error of an integer are taken as that integer, so pixels on a boundary follow its rule
+    rounded = np.round(value)
+    return np.where(np.abs(value - rounded) < 1e-9, rounded, value)
+
+
+def _half_width(radius:float, dy:np.ndarray, row_spacing:float, col_spacing:float) -> np.ndarray:
+    # largest column distance within radius on rows dy from the centre, in pixels, -1 where the row misses the circle
+    remaining = inside_radius2(radius) - (dy * row_spacing) ** 2
+    return np.where(remaining >= 0, np.sqrt(np.maximum(remaining, 0.0)) / col_spacing, -1.0)
+
+
+def _sector_bounds(sector:str, cx:float, dy:np.ndarray, row_spacing:float, col_spacing:float) -> Tuple[np.ndarray, np.ndarray]:
+    # column interval [low, high] of a 45 degree sector on rows dy, angles are half open counter clockwise
+    big = np.iinfo(np.int64).max // 4
+    a = -dy * (row_spacing / col_spacing)  # upward distance in column units
+    plus = _snap(cx + a)
+    minus = _snap(cx - a)
+    if sector == "right":  # -45 <= angle < 45
+        low = np.maximum(np.floor(plus).astype(np.int64) + 1, np.ceil(minus).astype(np.int64))
+        return low, np.full_like(low, big)
+    if sector == "top":  # 45 <= angle < 135
+        low = np.floor(minus).astype(np.int64) + 1
+        high = np.floor(plus).astype(np.int64)
+        return np.where(a > 0, low, 1), np.where(a > 0, high, 0)
+    if sector == "left":  # 135 <= angle < 225
+        high = np.minimum(np.ceil(plus).astype(np.int64) - 1, np.floor(minus).astype(np.int64))
+        return np.full_like(high, -big), high
+    if sector == "bottom":  # 225 <= angle < 315
+        low = np.ceil(plus).astype(np.int64)
+        high = np.ceil(minus).astype(np.int64) - 1
+        return np.where(a < 0, low, 1), np.where(a < 0, high, 0)
+    raise ValueError(f"unknown sector {sector!r}, expected one of {SECTORS}")
+
+
+class RegionIndex:
+    """Summed-area tables of the per-label thickness maps of a label volume, see the module docstring.
+
+    Centres are (row, column) map pixels and radii are in units of spacing
+    (e.g. mm with a layer scale in mm, pixels with the default spacing).
+
+    Args:
+        labels (ndarray): label value of every map
+        maps (ndarray): per-label thickness maps of shape (labels, rows, columns)
+        spacing (Tuple[float, float]): size of a map pixel along rows and columns
+        voxel_volume (float): physical volume of one voxel
+    """
+
+    def __init__(self, labels:np.ndarray, maps:np.ndarray, spacing:Tuple[float, float]=(1.0, 1.0), voxel_volume:float=1.0):
+        self.labels = np.asarray(labels)
+        self.shape = tuple(maps.shape[1:])
+        self.spacing = (float(spacing[0]), float(spacing[1]))
+        self.voxel_volume = float(voxel_volume)
+        self.sat = summed_area_table(maps)
+
+    @classmethod
+    def from_labels(cls, data, enface_axes:Tuple[int, int]=(0, 2), scale:Optional[Sequence[float]]=None, labels:Optional[Iterable[int]]=None, chunk_bytes:int=DEFAULT_CHUNK_BYTES, workers:int=0) -> "RegionIndex":
+        """Index of a 3D label volume, see thickness_maps.
+
+        Args:
+            data (array-like): 3D integer label volume
+            enface_axes (Tuple[int, int]): volume axes of the map rows and columns
+            scale (Sequence[float]): voxel size along each volume axis (mm for volumes in mm³), 1 if omitted
+            labels (Iterable[int]): label values to index, every nonzero label when omitted
+            chunk_bytes (int): approximate number of input bytes read per tile
+            workers (int): number of worker threads, 0 for one per CPU core
+        """
+        values, maps = thickness_maps(data, enface_axes, labels, chunk_bytes=chunk_bytes, workers=workers)
+        scale = np.ones(3) if scale is None else np.asarray(scale, dtype=np.float64)[-3:]
+        rows_axis, cols_axis = (int(axis) % 3 for axis in enface_axes)
+        return cls(values, maps, (scale[rows_axis], scale[cols_axis]), float(np.prod(scale)))
+
+    @property
+    def nbytes(self) -> int:
+        return self.sat.nbytes
+
+    def box(self, rows:slice, cols:slice) -> np.ndarray:
+        """Voxels of every label inside the rectangle rows x cols of the maps."""
+        r0, r1, _ = rows.indices(self.shape[0])
+        c0, c1, _ = cols.indices(self.shape[1])
+        r1, c1 = max(r0, r1), max(c0, c1)
+        sat = self.sat
+        return sat[:, r1, c1] - sat[:, r0, c1] - sat[:, r1, c0] + sat[:, r0, c0]
+
+    def _row_intervals(self, rows:np.ndarray, low:np.ndarray, high:np.ndarray) -> np.ndarray:
+        # voxels of every label in columns [low, high] of each row, empty intervals count 0
+        low = np.clip(low, 0, self.shape[1])
+        high = np.clip(high + 1, 0, self.shape[1])
+        high = np.maximum(high, low)
+        sat = self.sat
+        counts = sat[:, rows + 1, high] - sat[:, rows, high] - sat[:, rows + 1, low] + sat[:, rows, low]
+        return counts.sum(axis=1)
+
+    def disk(self, center:Tuple[float, float], radius:float, inner_radius:float=0.0, sector:Optional[str]=None, spacing:Optional[Tuple[float, float]]=None) -> np.ndarray:
+        """Voxels of every label inside a disk, annulus or 45 degree sector of either.
+
+        Pixels belong to the region when their distance d to the centre satisfies
+        inner_radius < d <= radius, with the tolerance of _core.drawing.circle_mask
+        so the disk measures exactly the pixels a drawn circle covers. A zero
+        inner_radius keeps a centre falling on a pixel, which is left out of every sector.
+
+        Args:
+            center (Tuple[float, float]): (row, column) of the centre, not rounded
+            radius (float): outer radius
+            inner_radius (float): inner radius of an annulus, 0 for a disk
+            sector (str): one of SECTORS restricting the region to the 90 degree wedge around
+                the right, top (row 0 side), left or bottom direction, None for the full disk
+            spacing (Tuple[float, float]): pixel size overriding the index spacing, (1, 1) for radii in pixels
+
+        Returns:
+            int64 voxel counts aligned with labels
+        """
+        row_spacing, col_spacing = self.spacing if spacing is None else spacing
+        cy, cx = (float(c) for c in center)
+        if radius < 0:
+            return np.zeros(len(self.labels), dtype=np.int64)
+        reach = np.sqrt(inside_radius2(radius)) / row_spacing
+        first = max(int(np.ceil(_snap(cy - reach))), 0)
+        last = min(int(np.floor(_snap(cy + reach))), self.shape[0] - 1)
+        rows = np.arange(first, last + 1)
+        if rows.size == 0:
+            return np.zeros(len(self.labels), dtype=np.int64)
+        dy = rows - cy
+        outer = _half_width(radius, dy, row_spacing, col_spacing)
+        # rows missing the circle get the empty interval [1, 0]
+        low = np.where(outer < 0, 1, np.ceil(_snap(cx - outer))).astype(np.int64)
+        high = np.where(outer < 0, 0, np.floor(_snap(cx + outer))).astype(np.int64)
+        if inner_radius > 0:
+            # columns left and right of the inner circle, the whole row where it misses the inner circle
+            inner = _half_width(inner_radius, dy, row_spacing, col_spacing)
+            inner_low = np.ceil(_snap(cx - inner)).astype(np.int64)
+            inner_high = np.floor(_snap(cx + inner)).astype(np.int64)
+            intervals = [
+                (low, np.where(inner < 0, high, np.minimum(inner_low - 1, high))),
+                (np.where(inner < 0, high + 1, np.maximum(inner_high + 1, low)), high),
+            ]
+        else:
+            intervals = [(low, high)]
+        if sector is not None:
+            sector_low, sector_high = _sector_bounds(sector, cx, dy, row_spacing, col_spacing)
+            intervals = [(np.maximum(lo, sector_low), np.minimum(hi, sector_high)) for lo, hi in intervals]
+
+        counts = np.zeros(len(self.labels), dtype=np.int64)
+        for lo, hi in intervals:
+            counts += self._row_intervals(rows, lo, hi)
+        return counts
+
+    def etdrs(self, center:Tuple[float, float], diameters:Sequence[float]=ETDRS_DIAMETERS, spacing:Optional[Tuple[float, float]]=None) -> Dict[str, np.ndarray]:
+        """Voxels of every label in the regions of an ETDRS-style grid centred on the fovea.
+
+        Args:
+            center (Tuple[float, float]): (row, column) of the fovea
+            diameters (Sequence[float]): increasing circle diameters, mm for an index in mm
+            spacing (Tuple[float, float]): pixel size overriding the index spacing
+
+        Returns:
+            Dict mapping "central" and "<ring>_<sector>" (ring 1 is innermost) to voxel counts aligned with labels
+        """
+        radii = [d / 2 for d in diameters]
+        regions = {"central": self.disk(center, radii[0], spacing=spacing)}
+        for ring, (inner, outer) in enumerate(zip(radii[:-1], radii[1:]), start=1):
+            for sector in SECTORS:
+                regions[f"{ring}_{sector}"] = self.disk(center, outer, inner, sector, spacing=spacing)
+        return regions
+
+    def volumes(self, counts:np.ndarray) -> Dict[int, float]:
+        """Physical volume of every label from voxel counts aligned with labels."""
+        return {int(label): float(count) * self.voxel_volume for label, count in zip(self.labels, counts)}
+
+
+def format_region_volumes(index:RegionIndex, regions:Dict[str, np.ndarray]) -> str:
+    """Render voxel counts of named regions as a plain text table of volumes per label."""
+    lines = [f"{'region':>12}" + "".join(f"{f'label {label}':>16}" for label in index.labels)]
+    for name, counts in regions.items():
+        lines.append(f"{name:>12}" + "".join(f"{volume:>16.6g}" for volume in index.volumes(counts).values()))
+    return "\n".join(lines)
@@ -0,0 +1,189 @@
+"""
+This module contains numpy kernels for rigid registration of 2D slices onto reference slices.
+"""
+from typing import Optional
+
+import numpy as np
+
+from napari_cool_tools_vol_proc._core.cache import result_cache
+from napari_cool_tools_vol_proc._core.tiling import DEFAULT_CHUNK_BYTES, axis_index
+
+
+def _window(shape:tuple) -> np.ndarray:
+    # separable Hann window suppressing the wrap-around edges of each frame
+    window = np.ones(shape)
+    for axis, n in enumerate(shape):
+        taper = np.hanning(n) if n > 2 else np.ones(n)
+        window = window * taper.reshape((-1,) + (1,) * (len(shape) - axis - 1))
+    return window
+
+
+def _spectra(frames:np.ndarray, window:np.ndarray) -> np.ndarray:
+    # rfftn of a stack of frames along its first axis after removing their mean and windowing them
+    frame_axes = tuple(range(1, frames.ndim))
+    frames = np.asarray(frames, dtype=np.float64)
+    frames = (frames - frames.mean(axis=frame_axes, keepdims=True)) * window
+    return np.fft.rfftn(frames, axes=frame_axes)
+
+
+def _peak_shifts(moving:np.ndarray, reference:np.ndarray, frame_shape:tuple) -> np.ndarray:
+    # integer displacement of each moving frame relative to its reference frame from their spectra
+    frame_axes = tuple(range(1, len(frame_shape) + 1))
+    cross = moving * np.conj(reference)
+    cross /= np.maximum(np.abs(cross), 1e-12)
+    correlation = np.fft.irfftn(cross, s=frame_shape, axes=frame_axes)
+    peaks = np.argmax(correlation.reshape(len(correlation), -1), axis=1)
+    shifts = np.stack(np.unravel_index(peaks, frame_shape), axis=1)
+    sizes = np.asarray(frame_shape)
+    return np.where(shifts > sizes // 2, shifts - sizes, shifts).astype(np.int64)
+
+
+def _frames(data, axis:int, indices) -> np.ndarray:
+    # slices of data at indices (a slice or a list of ints) stacked along a new first axis
+    ndim = len(data.shape)
+    if isinstance(indices, slice):
+        return np.moveaxis(np.asarray(data[axis_index(ndim, axis, indices)]), axis, 0)
+    return np.stack([np.asarray(data[axis_index(ndim, axis, int(i))]) for i in indices])
+
+
+def _batch_len(frame_shape:tuple, batch_bytes:int) -> int:
+    # frames per batch, a frame costs about 8 bytes per pixel as float64 and again as its half spectrum
+    return max(1, batch_bytes // max(16 * int(np.prod(frame_shape)), 1))
+
+
+def group_references(length:int, group:Optional[int]=None) -> np.ndarray:
+    """Index of the reference slice of every slice, the middle slice of its group of group consecutive slices (of the whole axis when group is None)."""
+    group = max(length, 1) if group is None else group
+    if group < 1:
+        raise ValueError(f"group should be a positive integer, got {group}")
+    first = (np.arange(length) // group) * group
+    return first + (np.minimum(group, length - first) - 1) // 2
+
+
+def frame_shifts(data, axis:int=0, group:Optional[int]=None, batch_bytes:int=DEFAULT_CHUNK_BYTES) -> np.ndarray:
+    """Estimate the integer displacement of every slice along axis relative to the reference slice of its group.
+
+    Slices are split into groups of group consecutive slices (the trailing group
+    may be shorter) and each slice is registered by phase correlation directly
+    against the middle slice of its group, so estimation errors do not
+    accumulate along the volume. Slices are windowed and transformed in batches
+    with one vectorized rfftn over the frame axes.
+
+    Args:
+        data (array-like): volume supporting basic slicing (ndarray, memmap, ...)
+        axis (int): axis along which slices (B-scans) are stacked
+        group (int): number of consecutive slices sharing a reference, None for a single group spanning the axis
+        batch_bytes (int): approximate number of input bytes transformed per batch
+
+    Returns:
+        Integer array of shape (n_slices, ndim - 1), the displacement of each slice
+        along the remaining axes relative to the reference slice of its group
+    """
+    ndim = len(data.shape)
+    axis = axis % ndim
+    length = data.shape[axis]
+    frame_shape = data.shape[:axis] + data.shape[axis + 1:]
+    references = group_references(length, group)
+    shifts = np.zeros((length, ndim - 1), dtype=np.int64)
+    if length < 2 or int(np.prod(frame_shape)) == 0:
+        return shifts
+
+    window = _window(frame_shape)
+    batch = _batch_len(frame_shape, batch_bytes)
+    reference_spectra = {}
+    for start in range(0, length, batch):
+        stop = min(length, start + batch)
+        spectra = _spectra(_frames(data, axis, slice(start, stop)), window)
+        needed = np.unique(references[start:stop])
+        reference_spectra = {int(r): reference_spectra[r] for r in needed if r in reference_spectra}
+        missing = [int(r) for r in needed if r not in reference_spectra]
+        if missing:
+            reference_spectra.update(zip(missing, _spectra(_frames(data, axis, missing), window)))
+        reference = np.stack([reference_spectra[int(r)] for r in references[start:stop]])
+        shifts[start:stop] = _peak_shifts(spectra, reference, frame_shape)
+
+    return shifts
+
+
+def window_shifts(data, window:int, axis:int=0, batch_bytes:int=DEFAULT_CHUNK_BYTES) -> np.ndarray:
+    """Estimate the integer displacement of the slices within window // 2 of every slice relative to that slice.
+
+    Every slice is the reference of its own sliding window, so each pair of
+    slices at most window // 2 apart is registered once by phase correlation
+    (the displacement in the other direction is its negation). Slices are
+    windowed and transformed in batches with one vectorized rfftn.
+
+    Args:
+        data (array-like): volume supporting basic slicing (ndarray, memmap, ...)
+        window (int): odd number of consecutive slices in each sliding window
+        axis (int): axis along which slices (B-scans) are stacked
+        batch_bytes (int): approximate number of input bytes transformed per batch
+
+    Returns:
+        Integer array of shape (n_slices, window, ndim - 1) where [i, window // 2 + d] is the
+        displacement of slice i + d relative to slice i, 0 where i + d is outside the axis
+    """
+    if window < 1 or window % 2 == 0:
+        raise ValueError(f"window should be a positive odd number, got {window}")
+    ndim = len(data.shape)
+    axis = axis % ndim
+    length = data.shape[axis]
+    half = window // 2
+    frame_shape = data.shape[:axis] + data.shape[axis + 1:]
+    shifts = np.zeros((length, window, ndim - 1), dtype=np.int64)
+    if length < 2 or int(np.prod(frame_shape)) == 0:
+        return shifts
+
+    taper = _window(frame_shape)
+    batch = _batch_len(frame_shape, batch_bytes)
+    for start in range(0, length, batch):
+        stop = min(length, start + batch)
+        spectra = _spectra(_frames(data, axis, slice(start, min(length, stop + half))), taper)
+        for d in range(1, min(half, length - 1) + 1):
+            count = min(stop, length - d) - start
+            if count > 0:
+                shifts[start:start + count, half + d] = _peak_shifts(spectra[d:d + count], spectra[:count], frame_shape)
+
+    for d in range(1, min(half, length - 1) + 1):
+        shifts[d:, half - d] = -shifts[:length - d, half + d]
+    return shifts
+
+
+def cached_frame_shifts(data, axis:int=0, group:Optional[int]=None) -> np.ndarray:
+    """frame_shifts of data, reused from the result cache while data is alive and unchanged."""
+    params = {"axis": axis % len(data.shape), "group": group}
+    return result_cache().cached("frame_shifts", (data,), params, lambda: frame_shifts(data, **params))
+
+
+def cached_window_shifts(data, window:int, axis:int=0) -> np.ndarray:
+    """window_shifts of data, reused from the result cache while data is alive and unchanged."""
+    params = {"window": window, "axis": axis % len(data.shape)}
+    return result_cache().cached("window_shifts", (data,), params, lambda: window_shifts(data, **params))
+
+
+def shift_frame(frame:np.ndarray, shift, out:Optional[np.ndarray]=None) -> np.ndarray:
+    """Translate frame by an integer shift filling uncovered pixels with 0.
+
+    Args:
+        frame (ndarray): slice to translate
+        shift (sequence of int): translation along each axis of frame
+        out (ndarray): optional output of the same shape as frame
+
+    Returns:
+        Translated frame, out[i + shift] = frame[i]
+    """
+    if out is None:
+        out = np.zeros_like(frame)
+    else:
+        out.fill(0)
+    src, dst = [], []
+    for s, n in zip(shift, frame.shape):
+        s = int(max(-n, min(n, s)))
+        if s >= 0:
+            src.append(slice(0, n - s))
+            dst.append(slice(s, n))
+        else:
+            src.append(slice(-s, n))
+            dst.append(slice(0, n + s))
+    out[tuple(dst)] = frame[tuple(src)]
+    return out
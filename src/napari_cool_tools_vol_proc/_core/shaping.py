@@ -0,0 +1,173 @@
+"""
+This module contains numpy kernels for reshaping volumetric data from shape specs.
+
+A shape spec is a string such as "(-1,3,:,:)" listing the new dimensions:
+
+    n       an explicit positive length
+    -1      the length inferred from the total size (at most once)
+    :       the length of the current axis aligned from the right, i.e. the last
+            ':' keeps the last axis, the one before keeps the second to last...
+    s0*s1   a product of current axis lengths (sN) and integers, merging axes
+
+Longer specs split axes, shorter ones merge them, and named presets (see
+SHAPE_PRESETS) can be used in place of a spec.
+
+Only ndarrays (and memmaps) can be reshaped into views. Other array-likes such
+as .chunks stores (see _core.storage) always need a copy, which is regrouped
+tile by tile into an output allocated like the other kernel outputs.
+"""
+import re
+from functools import lru_cache
+from typing import Tuple
+
+import numpy as np
+
+from napari_cool_tools_vol_proc._core.storage import allocate
+from napari_cool_tools_vol_proc._core.tiling import DEFAULT_CHUNK_BYTES, tile_ranges
+
+SHAPE_PRESETS = {
+    "octa_mscans_2": "(-1,2,:,:)",
+    "octa_mscans_3": "(-1,3,:,:)",
+    "octa_mscans_4": "(-1,4,:,:)",
+    "octa_mscans_5": "(-1,5,:,:)",
+    "octa_merge_mscans": "(-1,:,:)",
+}
+
+_FACTOR = re.compile(r"^(s\d+|\d+)$")
+
+
+class CopyRequiredError(ValueError):
+    """Raised when a reshape cannot be a view of the data and copying was not allowed."""
+
+
+@lru_cache(maxsize=256)
+def parse_shape_spec(spec:str) -> Tuple[tuple, ...]:
+    """Parse a shape spec or preset name into a tuple of dimension tokens.
+
+    Returns:
+        Tuple with one token per new dimension: ("keep",), ("int", n) or
+        ("prod", source axes, integer factor)
+
+    Errors:
+        ValueError for malformed specs
+    """
+    spec = SHAPE_PRESETS.get(spec.strip(), spec)
+    spec = spec.replace(" ", "")
+    if not (spec.startswith("(") and spec.endswith(")")):
+        raise ValueError(f"Invalid shape spec {spec!r}, expected a parenthesized comma separated list "
+                         f"of +integers, -1, ':' or products such as s0*s1, or one of {list(SHAPE_PRESETS)}")
+    tokens = []
+    for entry in spec[1:-1].split(","):
+        if entry == ":":
+            tokens.append(("keep",))
+        elif re.fullmatch(r"-1|\d+", entry):
+            tokens.append(("int", int(entry)))
+        elif all(_FACTOR.match(factor) for factor in entry.split("*")):
+            factors = entry.split("*")
+            axes = tuple(int(factor[1:]) for factor in factors if factor.startswith("s"))
+            constant = int(np.prod([int(factor) for factor in factors if not factor.startswith("s")]))
+            tokens.append(("prod", axes, constant))
+        else:
+            raise ValueError(f"Invalid dimension {entry!r} in shape spec {spec!r}")
+    if sum(token == ("int", -1) for token in tokens) > 1:
+        raise ValueError(f"Shape spec {spec!r} may contain at most one -1")
+    return tuple(tokens)
+
+
+def resolve_shape_spec(spec:str, shape:tuple) -> Tuple[int, ...]:
+    """Resolve a shape spec against the current shape into an explicit new shape.
+
+    Errors:
+        ValueError when the spec refers to axes that do not exist or does not preserve the total size
+    """
+    tokens = parse_shape_spec(spec)
+    out_shape = []
+    for position, token in enumerate(tokens):
+        if token[0] == "keep":
+            source = len(shape) - (len(tokens) - position)
+            if source < 0:
+                raise ValueError(f"':' at position {position} of {spec!r} has no matching axis in shape {shape}")
+            out_shape.append(shape[source])
+        elif token[0] == "int":
+            out_shape.append(token[1])
+        else:
+            missing = [axis for axis in token[1] if axis >= len(shape)]
+            if missing:
+                raise ValueError(f"{spec!r} refers to axes {missing} missing from shape {shape}")
+            out_shape.append(int(np.prod([shape[axis] for axis in token[1]])) * token[2])
+
+    size = int(np.prod(shape))
+    if -1 in out_shape:
+        known = int(np.prod([n for n in out_shape if n != -1]))
+        if known == 0 or size % known:
+            raise ValueError(f"cannot infer -1 in {spec!r}: size {size} of shape {shape} is not divisible by {known}")
+        out_shape[out_shape.index(-1)] = size // known
+    if int(np.prod(out_shape)) != size:
+        raise ValueError(f"{spec!r} resolves to {tuple(out_shape)} which does not hold the {size} elements of shape {shape}")
+    return tuple(out_shape)
+
+
+def reshape_view(data, shape:tuple):
+    """Reshape data without copying, returning None when the memory layout (or a non ndarray input) requires a copy."""
+    if not isinstance(data, np.ndarray):
+        # np.reshape would silently load array-likes such as ChunkedArray into memory
+        return None
+    try:
+        return np.reshape(data, shape, copy=False)
+    except TypeError:
+        # numpy < 2.1 has no copy argument, assigning the shape of a view never copies
+        view = data.view()
+        try:
+            view.shape = shape
+        except AttributeError:
+            return None
+        return view
+    except ValueError:
+        return None
+
+
+def _regroup(data, shape:tuple, chunk_bytes:int=DEFAULT_CHUNK_BYTES):
+    # C order copy of data into an allocated output of shape, reading the leading slices of data covering each tile
+    out = allocate(shape, data.dtype, "reshape")
+    if not shape or not data.shape or int(np.prod(shape)) == 0:
+        out[...] = np.reshape(np.asarray(data), shape)
+        return out
+    in_row = int(np.prod(data.shape[1:]))
+    out_row = int(np.prod(shape[1:]))
+    tile_len = max(1, chunk_bytes // max(np.dtype(data.dtype).itemsize * out_row, 1))
+    for start, stop in tile_ranges(shape[0], tile_len):
+        first, last = start * out_row, stop * out_row
+        offset = (first // in_row) * in_row
+        rows = np.asarray(data[first // in_row:-(-last // in_row)]).reshape(-1)
+        out[start:stop] = rows[first - offset:last - offset].reshape((stop - start,) + tuple(shape[1:]))
+    return out
+
+
+def reshape(data, spec:str, allow_copy:bool=False):
+    """Reshape data according to a shape spec, guaranteeing a zero-copy view unless allowed otherwise.
+
+    Args:
+        data (array-like): array, memmap or .chunks store (ChunkedArray) to reshape
+        spec (str): shape spec or preset name, see module documentation
+        allow_copy (bool): Flag allowing a copy when the memory layout prevents a view
+
+    Returns:
+        Reshaped view of data (a memmap stays a memmap), or a copy when needed and allowed,
+        regrouped tile by tile into an allocated output for inputs other than ndarrays
+
+    Errors:
+        CopyRequiredError (a ValueError) reporting the size of the copy when one is needed but not allowed
+    """
+    out_shape = resolve_shape_spec(spec, tuple(data.shape))
+    view = reshape_view(data, out_shape)
+    if view is not None:
+        return view
+    if not allow_copy:
+        reason = "of the memory layout of the data" if isinstance(data, np.ndarray) else f"{type(data).__name__} inputs cannot be viewed"
+        raise CopyRequiredError(
+            f"reshaping {tuple(data.shape)} to {out_shape} needs a copy of "
+            f"{data.nbytes / 2**30:.2f} GB because {reason}"
+        )
+    if not isinstance(data, np.ndarray):
+        return _regroup(data, out_shape)
+    return np.reshape(data, out_shape)
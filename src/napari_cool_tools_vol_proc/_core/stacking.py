@@ -0,0 +1,185 @@
+"""
+This module contains a lazy array stacking several arrays without copying them.
+"""
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+from napari_cool_tools_vol_proc._core.storage import allocate
+from napari_cool_tools_vol_proc._core.tiling import Steps, axis_index, run_steps
+
+
+def _member_index(key, length:int, member_length:int):
+    # (index into the member, index into the selection along this axis) for one basic index over the common length
+    if isinstance(key, slice):
+        selected = range(*key.indices(length))
+        count = sum(1 for i in selected if i < member_length) if member_length < length else len(selected)
+        if count == len(selected):
+            return key, slice(None)
+        if count == 0:
+            return None, slice(0, 0)
+        if selected.step > 0:
+            kept = selected[:count]
+            return slice(kept[0], kept[-1] + 1, kept.step), slice(0, count)
+        kept = selected[len(selected) - count:]
+        return slice(kept[0], kept[-1] - 1 if kept[-1] > 0 else None, kept.step), slice(len(selected) - count, None)
+    key = int(key)
+    if key < -length or key >= length:
+        raise IndexError(f"index {key} is out of bounds for axis with size {length}")
+    key = key % length
+    return (key, None) if key < member_length else (None, None)
+
+
+class VirtualStack:
+    """Lazy stack of arrays along a new axis backed by the original buffers.
+
+    Only the members selected by an index are read, an integer index along the
+    stack axis returns a view of that member, and a contiguous copy is made only
+    by materialize (or numpy conversion). Members of different shapes can be
+    padded to the common (largest) shape with fill_value, members keep their
+    position at the origin of every axis.
+
+    Args:
+        arrays (Sequence): arrays of equal ndim supporting basic slicing (ndarray, memmap, ...)
+        axis (int): position of the stack axis in the result
+        pad (bool): Flag indicating that members of different shapes are padded to the common shape
+        fill_value (scalar): value of padded voxels
+    """
+
+    def __init__(self, arrays:Sequence, axis:int=0, pad:bool=False, fill_value=0):
+        self.arrays = list(arrays)
+        if not self.arrays:
+            raise ValueError("need at least one array to stack")
+        ndims = {len(array.shape) for array in self.arrays}
+        if len(ndims) != 1:
+            raise ValueError(f"cannot stack arrays of different dimensions {sorted(ndims)}")
+        shapes = [tuple(array.shape) for array in self.arrays]
+        if not pad and len(set(shapes)) > 1:
+            raise ValueError(f"cannot stack arrays of different shapes {sorted(set(shapes))} without padding")
+        self.member_shape = tuple(int(n) for n in np.max(shapes, axis=0)) if shapes[0] else ()
+        self.axis = axis % (len(self.member_shape) + 1)
+        self.fill_value = fill_value
+        self.dtype = np.result_type(*[array.dtype for array in self.arrays], np.min_scalar_type(fill_value) if pad else self.arrays[0].dtype)
+        self.shape = self.member_shape[:self.axis] + (len(self.arrays),) + self.member_shape[self.axis:]
+
+    @property
+    def ndim(self) -> int:
+        return len(self.shape)
+
+    @property
+    def size(self) -> int:
+        return int(np.prod(self.shape))
+
+    @property
+    def nbytes(self) -> int:
+        return self.size * self.dtype.itemsize
+
+    def __len__(self) -> int:
+        return self.shape[0]
+
+    def __repr__(self) -> str:
+        return f"VirtualStack(shape={self.shape}, dtype={self.dtype}, members={len(self.arrays)})"
+
+    def _expand_key(self, key) -> tuple:
+        key = key if isinstance(key, tuple) else (key,)
+        if any(k is None or not (isinstance(k, (slice, type(Ellipsis))) or np.ndim(k) == 0) for k in key):
+            raise IndexError("VirtualStack only supports basic indexing with integers and slices")
+        if any(k is Ellipsis for k in key):
+            position = key.index(Ellipsis)
+            fill = (slice(None),) * (self.ndim - len(key) + 1)
+            key = key[:position] + fill + key[position + 1:]
+        if len(key) > self.ndim:
+            raise IndexError(f"too many indices for array of dimension {self.ndim}")
+        return key + (slice(None),) * (self.ndim - len(key))
+
+    def _member(self, i:int, key:tuple):
+        # basic selection of member i over the common member shape, padding what the member does not cover
+        array = self.arrays[i]
+        if tuple(array.shape) == self.member_shape:
+            part = array[key]
+            return part if part.dtype == self.dtype else np.asarray(part, dtype=self.dtype)
+
+        member_key, out_key, out_shape = [], [], []
+        for k, n, m in zip(key, self.member_shape, array.shape):
+            inner, outer = _member_index(k, n, m)
+            member_key.append(inner)
+            if isinstance(k, slice):
+                out_key.append(outer)
+                out_shape.append(len(range(*k.indices(n))))
+        part = np.full(out_shape, self.fill_value, dtype=self.dtype)
+        if all(inner is not None for inner in member_key):
+            part[tuple(out_key)] = array[tuple(member_key)]
+        return part
+
+    def __getitem__(self, key):
+        key = self._expand_key(key)
+        stack_key = key[self.axis]
+        member_key = key[:self.axis] + key[self.axis + 1:]
+        if not isinstance(stack_key, slice):
+            index = int(stack_key)
+            if index < -len(self.arrays) or index >= len(self.arrays):
+                raise IndexError(f"index {index} is out of bounds for the stack axis with size {len(self.arrays)}")
+            return self._member(index % len(self.arrays), member_key)
+
+        position = sum(isinstance(k, slice) for k in key[:self.axis])
+        parts = [self._member(i, member_key) for i in range(*stack_key.indices(len(self.arrays)))]
+        if not parts:
+            shape = [len(range(*k.indices(n))) for k, n in zip(key, self.shape) if isinstance(k, slice)]
+            return np.empty(shape, dtype=self.dtype)
+        return np.stack([np.asarray(part) for part in parts], axis=position)
+
+    def materialize(self, out:Optional[np.ndarray]=None) -> np.ndarray:
+        """Copy the stack into a contiguous array, member by member.
+
+        Args:
+            out (array-like): optional preallocated output of the stack shape, e.g. a writable memmap
+
+        Returns:
+            Stacked array (out)
+        """
+        return run_steps(self.materialize_steps(out))
+
+    def materialize_steps(self, out:Optional[np.ndarray]=None) -> Steps:
+        """Step generator of materialize yielding (done, total) after every member and returning the stacked array."""
+        if out is None:
+            out = allocate(self.shape, self.dtype, "stack", write_axis=self.axis)
+        elif tuple(out.shape) != self.shape:
+            raise ValueError(f"out has shape {out.shape}, expected {self.shape}")
+        for i, array in enumerate(self.arrays):
+            # padded in memory and written with a single assignment, so outputs copying on indexing (ChunkedArray) work too
+            if tuple(array.shape) != self.member_shape:
+                padded = np.full(self.member_shape, self.fill_value, dtype=self.dtype)
+                padded[tuple(slice(0, n) for n in array.shape)] = array
+                array = padded
+            out[axis_index(self.ndim, self.axis, i)] = array
+            yield i + 1, len(self.arrays)
+        return out
+
+    def __array__(self, dtype=None, copy=None):
+        array = self.materialize(np.empty(self.shape, dtype=self.dtype))
+        return array if dtype is None else array.astype(dtype, copy=False)
+
+
+def stack_arrays(arrays:List, axis:int=0, virtual:bool=False, pad:bool=False, fill_value=0, out:Optional[np.ndarray]=None):
+    """Stack arrays along a new axis, lazily (VirtualStack) or into a contiguous array.
+
+    Args:
+        arrays (List): arrays of equal ndim
+        axis (int): position of the stack axis in the result
+        virtual (bool): Flag indicating that a VirtualStack backed by the arrays is returned instead of a copy
+        pad (bool): Flag indicating that arrays of different shapes are padded to the common shape
+        fill_value (scalar): value of padded voxels
+        out (array-like): optional preallocated output for the contiguous stack
+
+    Returns:
+        VirtualStack or stacked ndarray
+    """
+    return run_steps(stack_arrays_steps(arrays, axis, virtual, pad, fill_value, out))
+
+
+def stack_arrays_steps(arrays:List, axis:int=0, virtual:bool=False, pad:bool=False, fill_value=0, out:Optional[np.ndarray]=None) -> Steps:
+    """Step generator of stack_arrays yielding (done, total) after every copied array and returning the stack."""
+    stack = VirtualStack(arrays, axis=axis, pad=pad, fill_value=fill_value)
+    if virtual:
+        return stack
+    return (yield from stack.materialize_steps(out))
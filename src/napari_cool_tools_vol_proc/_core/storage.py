@@ -0,0 +1,505 @@
+"""
+This module contains memory-mapped and chunked on-disk storage for the inputs and outputs of the kernels.
+
+Two formats are supported: .npy files opened as memory maps, and .chunks
+directories holding a volume split along one axis (axis 0 by default) into
+chunk files, each optionally zlib compressed, with the shape, dtype and
+chunking in meta.json.
+ChunkedArray reads and writes .chunks directories through basic slicing and
+keeps a few decompressed chunks cached, so the kernels can use it wherever they
+accept an array-like.
+
+Kernels allocate their outputs with allocate. Without an output store this is
+np.empty, with one (configure_store, the output_store context manager or the
+NAPARI_COOL_TOOLS_STORE environment variable naming a directory) outputs of at
+least min_bytes are created on disk with their final shape and dtype and filled
+tile by tile, so chains of commands on multi-GB volumes stay within RAM.
+Kernels writing their output slice by slice along another axis pass it as
+write_axis, so .chunks outputs are chunked along it and each chunk is
+completed before the next one is touched instead of every slice cycling all
+chunks through the small chunk cache.
+"""
+import json
+import os
+import shutil
+import threading
+import uuid
+import zlib
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Optional, Union
+
+import numpy as np
+
+from napari_cool_tools_vol_proc._core.tiling import DEFAULT_CHUNK_BYTES, Steps, map_tiles, run_steps, tile_ranges
+
+STORE_ENV_VAR = "NAPARI_COOL_TOOLS_STORE"
+
+CHUNKS_SUFFIX = ".chunks"
+META_FILE = "meta.json"
+
+DEFAULT_STORE_CHUNK_BYTES = 16 * 2**20
+DEFAULT_MIN_BYTES = 64 * 2**20
+
+PathLike = Union[str, os.PathLike]
+
+
+def _selection_shape(shape:tuple, key:tuple) -> tuple:
+    # shape selected by a basic indexing key, computed on a zero memory broadcast view
+    return np.broadcast_to(np.empty((), dtype=bool), shape)[key].shape
+
+
+class ChunkedArray:
+    """Array stored in a .chunks directory as chunks along chunk_axis, see the module docstring.
+
+    Supports basic slicing for reading and writing (reading also accepts other
+    indices by loading the whole array), writes are cached and written back when
+    a chunk leaves the cache or on flush.
+
+    Args:
+        path (PathLike): .chunks directory created by ChunkedArray.create
+        mode (str): "r" for read only, "r+" for read and write
+        cache_chunks (int): number of decompressed chunks kept in memory
+    """
+
+    def __init__(self, path:PathLike, mode:str="r", cache_chunks:int=4):
+        self.path = Path(path)
+        meta = json.loads((self.path / META_FILE).read_text())
+        self.shape = tuple(meta["shape"])
+        self.dtype = np.dtype(meta["dtype"])
+        self.chunk_len = int(meta["chunk_len"])
+        self.chunk_axis = int(meta.get("chunk_axis", 0))
+        self.compression = int(meta.get("compression", 0))
+        self.fill_value = meta.get("fill_value", 0)
+        self.mode = mode
+        self.cache_chunks = max(1, int(cache_chunks))
+        self._cache = OrderedDict()
+        self._lock = threading.RLock()
+
+    @classmethod
+    def create(cls, path:PathLike, shape:tuple, dtype, chunk_len:Optional[int]=None, chunk_bytes:int=DEFAULT_STORE_CHUNK_BYTES, compression:int=1, fill_value=0, cache_chunks:int=4, chunk_axis:int=0) -> "ChunkedArray":
+        """Create an empty .chunks directory, chunks not written yet read as fill_value.
+
+        Args:
+            path (PathLike): directory to create, replaced if it holds a chunked array
+            shape (tuple): array shape
+            dtype (dtype): array dtype
+            chunk_len (int): slices along chunk_axis per chunk, derived from chunk_bytes when omitted
+            chunk_bytes (int): approximate uncompressed bytes per chunk
+            compression (int): zlib level from 1 (fast) to 9 (small), 0 to store chunks uncompressed
+            fill_value: value of the elements never written
+            cache_chunks (int): number of decompressed chunks kept in memory
+            chunk_axis (int): axis the array is split along, the axis it is written along slice by slice
+        """
+        path = Path(path)
+        shape = tuple(int(n) for n in shape)
+        dtype = np.dtype(dtype)
+        chunk_axis = chunk_axis % len(shape) if shape else 0
+        if chunk_len is None:
+            slice_bytes = dtype.itemsize * int(np.prod(shape[:chunk_axis] + shape[chunk_axis + 1:]))
+            chunk_len = max(1, chunk_bytes // max(slice_bytes, 1))
+        if (path / META_FILE).exists():
+            shutil.rmtree(path)
+        path.mkdir(parents=True, exist_ok=True)
+        meta = {"shape": shape, "dtype": dtype.str, "chunk_len": int(chunk_len), "chunk_axis": chunk_axis, "compression": int(compression), "fill_value": np.asarray(fill_value, dtype=dtype).item()}
+        (path / META_FILE).write_text(json.dumps(meta))
+        return cls(path, mode="r+", cache_chunks=cache_chunks)
+
+    @property
+    def ndim(self) -> int:
+        return len(self.shape)
+
+    @property
+    def size(self) -> int:
+        return int(np.prod(self.shape))
+
+    @property
+    def nbytes(self) -> int:
+        return self.size * self.dtype.itemsize
+
+    @property
+    def chunks(self) -> int:
+        """Number of chunks along chunk_axis."""
+        return -(-self.shape[self.chunk_axis] // self.chunk_len) if self.shape else 1
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __repr__(self):
+        return f"ChunkedArray({str(self.path)!r}, shape={self.shape}, dtype={self.dtype})"
+
+    def _chunk_file(self, index:int) -> Path:
+        return self.path / f"{index}.chunk"
+
+    def _chunk_shape(self, index:int) -> tuple:
+        axis = self.chunk_axis
+        start = index * self.chunk_len
+        return self.shape[:axis] + (min(self.chunk_len, self.shape[axis] - start),) + self.shape[axis + 1:]
+
+    def _chunk(self, index:int) -> np.ndarray:
+        # decompressed chunk from the cache, loaded (and an older one evicted) when missing
+        entry = self._cache.get(index)
+        if entry is not None:
+            self._cache.move_to_end(index)
+            return entry[0]
+        path = self._chunk_file(index)
+        if path.exists():
+            raw = path.read_bytes()
+            if self.compression:
+                raw = zlib.decompress(raw)
+            chunk = np.frombuffer(raw, dtype=self.dtype).reshape(self._chunk_shape(index)).copy()
+        else:
+            chunk = np.full(self._chunk_shape(index), self.fill_value, dtype=self.dtype)
+        self._cache[index] = [chunk, False]
+        while len(self._cache) > self.cache_chunks:
+            old, (old_chunk, dirty) = self._cache.popitem(last=False)
+            if dirty:
+                self._write_chunk(old, old_chunk)
+        return chunk
+
+    def _write_chunk(self, index:int, chunk:np.ndarray):
+        raw = np.ascontiguousarray(chunk).tobytes()
+        if self.compression:
+            raw = zlib.compress(raw, self.compression)
+        path = self._chunk_file(index)
+        temporary = path.with_suffix(".tmp")
+        temporary.write_bytes(raw)
+        os.replace(temporary, path)
+
+    def _normalize(self, key) -> Optional[tuple]:
+        # basic indexing key expanded to one index per axis, None for keys needing the whole array
+        key = key if isinstance(key, tuple) else (key,)
+        if any(k is None or not isinstance(k, (int, np.integer, slice, type(Ellipsis))) for k in key):
+            return None
+        if sum(k is Ellipsis for k in key) > 1:
+            raise IndexError("an index can only have a single ellipsis")
+        if Ellipsis in key:
+            i = key.index(Ellipsis)
+            key = key[:i] + (slice(None),) * (self.ndim - len(key) + 1) + key[i + 1:]
+        if len(key) > self.ndim:
+            raise IndexError(f"too many indices for array of {self.ndim} dimensions")
+        key = tuple(k if isinstance(k, slice) else int(k) for k in key + (slice(None),) * (self.ndim - len(key)))
+        for axis, (k, n) in enumerate(zip(key, self.shape)):
+            if not isinstance(k, slice) and not -n <= k < n:
+                raise IndexError(f"index {k} is out of bounds for axis {axis} with size {n}")
+        axis = self.chunk_axis
+        if not isinstance(key[axis], slice):
+            key = key[:axis] + (key[axis] % self.shape[axis],) + key[axis + 1:]
+        return key
+
+    def _parts(self, first):
+        # (chunk index, local chunk axis index, position in the selection) of every chunk touched by first
+        if isinstance(first, int):
+            index = first // self.chunk_len
+            yield index, first - index * self.chunk_len, None
+            return
+        start, stop, step = first.indices(self.shape[self.chunk_axis])
+        rows = np.arange(start, stop, step)
+        if rows.size == 0:
+            return
+        chunk_ids = rows // self.chunk_len
+        bounds = np.flatnonzero(np.diff(chunk_ids)) + 1
+        for lo, hi in zip(np.r_[0, bounds], np.r_[bounds, rows.size]):
+            index = int(chunk_ids[lo])
+            local = rows[lo:hi] - index * self.chunk_len
+            if step == 1:
+                local = slice(int(local[0]), int(local[-1]) + 1)
+            yield index, local, slice(int(lo), int(hi))
+
+    def _local_key(self, key:tuple, local) -> tuple:
+        # key with its chunk axis index replaced by an index within one chunk
+        return key[:self.chunk_axis] + (local,) + key[self.chunk_axis + 1:]
+
+    def _selection_axis(self, key:tuple) -> int:
+        # axis of the selection of key that the chunk axis maps to
+        return sum(isinstance(k, slice) for k in key[:self.chunk_axis])
+
+    def __getitem__(self, key):
+        normalized = self._normalize(key)
+        if normalized is None:
+            return np.asarray(self)[key]
+        key = normalized
+        first = key[self.chunk_axis]
+        with self._lock:
+            parts = [self._chunk(index)[self._local_key(key, local)].copy() for index, local, _ in self._parts(first)]
+        if isinstance(first, int):
+            return parts[0]
+        if not parts:
+            return np.empty(_selection_shape(self.shape, key), dtype=self.dtype)
+        return np.concatenate(parts, axis=self._selection_axis(key)) if len(parts) > 1 else parts[0]
+
+    def __setitem__(self, key, value):
+        if self.mode == "r":
+            raise ValueError(f"{self.path} is opened read only")
+        key = self._normalize(key)
+        if key is None:
+            raise IndexError("ChunkedArray only supports basic slicing for assignment")
+        value = np.broadcast_to(np.asarray(value), _selection_shape(self.shape, key))
+        lead = (slice(None),) * self._selection_axis(key)
+        with self._lock:
+            for index, local, position in self._parts(key[self.chunk_axis]):
+                chunk = self._chunk(index)
+                chunk[self._local_key(key, local)] = value if position is None else value[lead + (position,)]
+                self._cache[index][1] = True
+
+    def __array__(self, dtype=None, copy=None):
+        data = self[...]
+        return data if dtype is None else data.astype(dtype, copy=False)
+
+    def flush(self):
+        """Write every modified cached chunk to disk."""
+        with self._lock:
+            for index, entry in self._cache.items():
+                if entry[1]:
+                    self._write_chunk(index, entry[0])
+                    entry[1] = False
+
+    def move(self, path:PathLike):
+        """Flush and move the directory to path, replacing a chunked array stored there."""
+        with self._lock:
+            self.flush()
+            path = Path(path)
+            if (path / META_FILE).exists():
+                shutil.rmtree(path)
+            shutil.move(str(self.path), str(path))
+            self.path = path
+
+
+def is_store(path:PathLike) -> bool:
+    """Whether path is a .npy file or a .chunks directory that open_store can open."""
+    path = Path(path)
+    return (path.suffix == ".npy" and path.is_file()) or (path.is_dir() and (path / META_FILE).exists())
+
+
+def open_store(path:PathLike, mode:str="r"):
+    """Open a .npy file as a memory map or a .chunks directory as a ChunkedArray.
+
+    Args:
+        path (PathLike): .npy file or .chunks directory
+        mode (str): "r" for read only, "r+" for read and write
+
+    Returns:
+        np.memmap or ChunkedArray
+    """
+    path = Path(path)
+    if path.is_dir():
+        return ChunkedArray(path, mode=mode)
+    return np.load(path, mmap_mode=mode)
+
+
+def create_store(path:PathLike, shape:tuple, dtype, compression:int=1, chunk_bytes:int=DEFAULT_STORE_CHUNK_BYTES, chunk_axis:int=0):
+    """Create an array on disk, a .npy memory map or a .chunks directory when path ends with .chunks.
+
+    Args:
+        path (PathLike): .npy file or .chunks directory to create
+        shape (tuple): array shape
+        dtype (dtype): array dtype
+        compression (int): zlib level of .chunks directories, 0 for none
+        chunk_bytes (int): approximate uncompressed bytes per chunk of .chunks directories
+        chunk_axis (int): axis .chunks directories are split along
+
+    Returns:
+        np.memmap or ChunkedArray opened for writing
+    """
+    path = Path(path)
+    if path.suffix == CHUNKS_SUFFIX:
+        return ChunkedArray.create(path, shape, dtype, chunk_bytes=chunk_bytes, compression=compression, chunk_axis=chunk_axis)
+    return np.lib.format.open_memmap(path, mode="w+", dtype=np.dtype(dtype), shape=tuple(shape))
+
+
+def flush(data):
+    """Write pending changes of a memory map or ChunkedArray to disk, other arrays are left alone."""
+    if isinstance(data, (np.memmap, ChunkedArray)):
+        data.flush()
+
+
+def store_path(data) -> Optional[Path]:
+    """File or directory backing data, None for in-memory arrays."""
+    if isinstance(data, ChunkedArray):
+        return data.path
+    filename = getattr(data, "filename", None)
+    if filename is None:
+        base = getattr(data, "base", None)
+        filename = getattr(base, "filename", None)
+    return Path(filename) if filename else None
+
+
+def save_store(data, path:PathLike, compression:int=1, chunk_bytes:int=DEFAULT_CHUNK_BYTES, workers:int=0):
+    """Copy an array-like to a .npy file or .chunks directory tile by tile along axis 0.
+
+    See save_store_steps for the arguments.
+
+    Returns:
+        The stored array, opened for writing
+    """
+    return run_steps(save_store_steps(data, path, compression, chunk_bytes, workers))
+
+
+def save_store_steps(data, path:PathLike, compression:int=1, chunk_bytes:int=DEFAULT_CHUNK_BYTES, workers:int=0) -> Steps:
+    """Step generator of save_store yielding (done, total) after every tile and returning the stored array.
+
+    Args:
+        data (array-like): array supporting basic slicing (ndarray, memmap, VirtualStack, ...)
+        path (PathLike): .npy file or .chunks directory to create
+        compression (int): zlib level of .chunks directories, 0 for none
+        chunk_bytes (int): approximate number of bytes copied per tile
+        workers (int): number of worker threads, 0 for one per CPU core
+    """
+    out = create_store(path, tuple(data.shape), data.dtype, compression=compression)
+    if len(data.shape) == 0:
+        out[...] = np.asarray(data)
+        flush(out)
+        return out
+    slice_bytes = np.dtype(data.dtype).itemsize * int(np.prod(data.shape[1:]))
+
+    def run(start, stop):
+        out[start:stop] = np.asarray(data[start:stop])
+
+    ranges = tile_ranges(data.shape[0], max(1, chunk_bytes // max(slice_bytes, 1)))
+    for done, _ in enumerate(map_tiles(run, ranges, workers), 1):
+        yield done, len(ranges)
+    flush(out)
+    return out
+
+
+class OutputStore:
+    """Directory the kernel outputs of at least min_bytes are allocated in, see allocate.
+
+    Args:
+        directory (PathLike): directory holding the outputs, created when needed
+        chunked (bool): Flag indicating that outputs are .chunks directories instead of .npy memory maps
+        compression (int): zlib level of .chunks outputs, 0 for none
+        min_bytes (int): smaller outputs stay in memory
+    """
+
+    def __init__(self, directory:PathLike, chunked:bool=False, compression:int=1, min_bytes:int=DEFAULT_MIN_BYTES):
+        self.directory = Path(directory)
+        self.chunked = chunked
+        self.compression = compression
+        self.min_bytes = min_bytes
+        self._allocated = {}
+
+    def allocate(self, shape:tuple, dtype, name:str="result", write_axis:int=0):
+        """Create an output array of shape and dtype with a unique name in the directory, chunked along write_axis."""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        suffix = CHUNKS_SUFFIX if self.chunked else ".npy"
+        path = self.directory / f"{name}_{uuid.uuid4().hex[:8]}{suffix}"
+        out = create_store(path, shape, dtype, compression=self.compression, chunk_axis=write_axis)
+        self._allocated[path.resolve()] = tuple(out.shape)
+        return out
+
+    def output_path(self, data) -> Optional[Path]:
+        """File or directory of data when it is a whole output allocated by this store, None otherwise (views, in-memory arrays)."""
+        source = store_path(data)
+        source = source.resolve() if source is not None else None
+        if source is None or self._allocated.get(source) != tuple(data.shape) or not source.exists():
+            return None
+        if isinstance(data, np.ndarray) and not data.flags.c_contiguous:
+            return None
+        return source
+
+    def persist(self, data, path:PathLike) -> bool:
+        """Move an output allocated by this store to path (with the suffix of its format) instead of copying it.
+
+        Returns:
+            False when data is not a whole output of this store, e.g. a view of one or an in-memory array
+        """
+        source = self.output_path(data)
+        if source is None:
+            return False
+        path = Path(path)
+        if isinstance(data, ChunkedArray):
+            data.move(path)
+        else:
+            data.flush()
+            # the memory map stays valid after the rename
+            os.replace(source, path)
+        del self._allocated[source]
+        return True
+
+    def release(self, data) -> bool:
+        """Delete the file or directory of an output allocated by this store once nothing uses it anymore.
+
+        The data must not be read afterwards. Memory maps stay readable until
+        they are closed on POSIX systems, outputs that cannot be deleted yet
+        (mapped files on Windows) are left to clear.
+
+        Returns:
+            False when data is not a whole output of this store or could not be deleted
+        """
+        source = self.output_path(data)
+        if source is None:
+            return False
+        try:
+            if source.is_dir():
+                shutil.rmtree(source)
+            else:
+                os.remove(source)
+        except OSError:
+            return False
+        del self._allocated[source]
+        return True
+
+    def clear(self):
+        """Delete the directory and every output still in it."""
+        shutil.rmtree(self.directory, ignore_errors=True)
+        self._allocated.clear()
+
+
+_STORE: Optional[OutputStore] = None
+_STORE_CONFIGURED = False
+
+
+def active_store() -> Optional[OutputStore]:
+    """Output store used by allocate, configured from NAPARI_COOL_TOOLS_STORE on first use."""
+    global _STORE, _STORE_CONFIGURED
+    if not _STORE_CONFIGURED:
+        _STORE_CONFIGURED = True
+        directory = os.environ.get(STORE_ENV_VAR, "").strip()
+        if directory and _STORE is None:
+            _STORE = OutputStore(directory, chunked=directory.endswith(CHUNKS_SUFFIX))
+    return _STORE
+
+
+def configure_store(store:Optional[OutputStore]) -> Optional[OutputStore]:
+    """Make store the output store used by allocate, None to allocate outputs in memory.
+
+    Returns:
+        The previous output store
+    """
+    global _STORE, _STORE_CONFIGURED
+    previous = active_store()
+    _STORE = store
+    _STORE_CONFIGURED = True
+    return previous
+
+
+@contextmanager
+def output_store(directory:PathLike, chunked:bool=False, compression:int=1, min_bytes:int=DEFAULT_MIN_BYTES):
+    """Context allocating kernel outputs in directory, restoring the previous output store on exit."""
+    store = OutputStore(directory, chunked, compression, min_bytes)
+    previous = configure_store(store)
+    try:
+        yield store
+    finally:
+        configure_store(previous)
+
+
+def allocate(shape:tuple, dtype, name:str="result", write_axis:int=0):
+    """Output array of shape and dtype, on disk when an output store is active and it is at least min_bytes.
+
+    Args:
+        shape (tuple): output shape
+        dtype (dtype): output dtype
+        name (str): prefix of the file name of outputs allocated on disk
+        write_axis (int): axis the caller writes the output along, slice by slice or in tiles
+
+    Returns:
+        np.ndarray, np.memmap or ChunkedArray
+    """
+    store = active_store()
+    shape = tuple(int(n) for n in shape)
+    if store is None or np.dtype(dtype).itemsize * int(np.prod(shape)) < store.min_bytes:
+        return np.empty(shape, dtype=dtype)
+    return store.allocate(shape, dtype, name, write_axis)
@@ -0,0 +1,152 @@
+"""
+This module contains numpy kernels detecting bright retinal surfaces (ILM, RPE, ...) along the depth of every A-scan.
+"""
+import numpy as np
+
+from napari_cool_tools_vol_proc._core.tiling import DEFAULT_CHUNK_BYTES, Steps, map_tiles, run_steps, tile_ranges
+
+
+def smooth_depth(a:np.ndarray, window:int) -> np.ndarray:
+    """Mean of the window samples centered on every sample along the last axis, shrinking the window at the ends."""
+    depth = a.shape[-1]
+    half = max(int(window), 1) // 2
+    if half == 0:
+        return a.astype(np.float64, copy=False)
+    csum = np.zeros(a.shape[:-1] + (depth + 1,), dtype=np.float64)
+    np.cumsum(a, axis=-1, dtype=np.float64, out=csum[..., 1:])
+    index = np.arange(depth)
+    low = np.maximum(index - half, 0)
+    high = np.minimum(index + half + 1, depth)
+    return (csum[..., high] - csum[..., low]) / (high - low)
+
+
+def brightest_peaks(smoothed:np.ndarray, top_k:int) -> np.ndarray:
+    """Depths of the top_k brightest local maxima along the last axis, in increasing depth, -1 where fewer exist."""
+    depth = smoothed.shape[-1]
+    peak = np.ones(smoothed.shape, dtype=bool)
+    peak[..., 1:] &= smoothed[..., 1:] >= smoothed[..., :-1]
+    peak[..., :-1] &= smoothed[..., :-1] > smoothed[..., 1:]
+    score = np.where(peak, smoothed, -np.inf)
+    k = min(top_k, depth)
+    chosen = np.argpartition(-score, k - 1, axis=-1)[..., :k]
+    valid = np.isfinite(np.take_along_axis(score, chosen, axis=-1))
+    chosen = np.sort(np.where(valid, chosen, depth), axis=-1)
+    chosen = np.where(chosen == depth, -1, chosen)
+    if k < top_k:
+        chosen = np.concatenate([chosen, np.full(chosen.shape[:-1] + (top_k - k,), -1)], axis=-1)
+    return chosen
+
+
+def continuous_surface(smoothed:np.ndarray, max_jump:int) -> np.ndarray:
+    """Brightest path along the second to last axis moving at most max_jump samples in depth between neighbours.
+
+    The path maximizing the summed intensity is found by dynamic programming
+    (Viterbi) over all depths at once, vectorized over the leading axes.
+
+    Args:
+        smoothed (ndarray): intensities of shape (..., A-scans, depth)
+        max_jump (int): largest depth change between neighbouring A-scans
+
+    Returns:
+        int64 depths of shape (..., A-scans)
+    """
+    *lead, width, depth = smoothed.shape
+    max_jump = int(max_jump)
+    offset_dtype = np.int8 if max_jump < 128 else np.int32
+    back = np.zeros((width,) + tuple(lead) + (depth,), dtype=offset_dtype)
+    score = smoothed[..., 0, :].astype(np.float64)
+    best = np.empty_like(score)
+    candidate = np.empty_like(score)
+    for j in range(1, width):
+        # best predecessor within max_jump, ties keep the smallest jump
+        best[...] = score
+        step = back[j]
+        for offset in range(1, min(max_jump, depth - 1) + 1):
+            for sign in (-1, 1):
+                candidate.fill(-np.inf)
+                if sign < 0:
+                    candidate[..., offset:] = score[..., :-offset]
+                else:
+                    candidate[..., :-offset] = score[..., offset:]
+                better = candidate > best
+                best[better] = candidate[better]
+                step[better] = sign * offset
+        score, best = best + smoothed[..., j, :], score
+
+    path = np.empty(tuple(lead) + (width,), dtype=np.int64)
+    current = np.argmax(score, axis=-1)
+    path[..., width - 1] = current
+    for j in range(width - 1, 0, -1):
+        current = current + np.take_along_axis(back[j], current[..., np.newaxis], axis=-1)[..., 0]
+        path[..., j - 1] = current
+    return path
+
+
+def detect_surface(data, depth_axis:int=1, smooth:int=9, top_k:int=1, max_jump:int=0, chunk_bytes:int=DEFAULT_CHUNK_BYTES, workers:int=0) -> np.ndarray:
+    """Depth of the brightest layer(s) of every A-scan of a 3D volume.
+
+    See detect_surface_steps for the arguments.
+
+    Returns:
+        int32 depth map of the volume shape without depth_axis, with a leading top_k axis when top_k > 1
+    """
+    return run_steps(detect_surface_steps(data, depth_axis, smooth, top_k, max_jump, chunk_bytes, workers))
+
+
+def detect_surface_steps(data, depth_axis:int=1, smooth:int=9, top_k:int=1, max_jump:int=0, chunk_bytes:int=DEFAULT_CHUNK_BYTES, workers:int=0) -> Steps:
+    """Step generator of detect_surface yielding (done, total) after every tile and returning the depth map.
+
+    Every A-scan is smoothed along depth with a box filter, then its brightest
+    sample (or its top_k brightest local maxima, ordered by depth) is taken with
+    a vectorized argmax. With max_jump the single surface of each B-scan is the
+    brightest path whose depth changes by at most max_jump between neighbouring
+    A-scans. Tiles of whole B-scans are processed on a thread pool.
+
+    Args:
+        data (array-like): 3D volume supporting basic slicing (ndarray, memmap, ...)
+        depth_axis (int): axis along A-scans, B-scans are taken along axis 0 (axis 1 when depth_axis is 0)
+        smooth (int): width in samples of the box filter along depth, 1 disables smoothing
+        top_k (int): number of bright layers detected per A-scan
+        max_jump (int): largest depth change between neighbouring A-scans of a B-scan, 0 for none (top_k 1 only)
+        chunk_bytes (int): approximate number of working bytes per tile
+        workers (int): number of worker threads, 0 for one per CPU core
+
+    Errors:
+        ValueError for a non 3D volume, top_k < 1 or max_jump combined with top_k > 1
+    """
+    shape = tuple(data.shape)
+    if len(shape) != 3:
+        raise ValueError(f"expected a 3D volume, got shape {shape}")
+    if top_k < 1:
+        raise ValueError(f"top_k must be at least 1, got {top_k}")
+    if max_jump and top_k > 1:
+        raise ValueError("continuity constraints (max_jump) are only supported for a single surface (top_k 1)")
+    depth_axis = depth_axis % 3
+    tile_axis = 1 if depth_axis == 0 else 0
+    width_axis = ({0, 1, 2} - {depth_axis, tile_axis}).pop()
+    out_shape = (shape[tile_axis], shape[width_axis])
+    out = np.empty(((top_k,) if top_k > 1 else ()) + out_shape, dtype=np.int32)
+
+    # float64 working copies dominate the memory of a tile
+    slice_bytes = 8 * shape[depth_axis] * shape[width_axis] * (3 if max_jump else 2)
+    tile_len = max(1, chunk_bytes // max(slice_bytes, 1))
+
+    def run(start, stop):
+        index = [slice(None)] * 3
+        index[tile_axis] = slice(start, stop)
+        tile = np.asarray(data[tuple(index)])
+        # (B-scans, A-scans, depth) layout
+        tile = np.moveaxis(tile, (tile_axis, width_axis, depth_axis), (0, 1, 2))
+        smoothed = smooth_depth(tile, smooth)
+        if max_jump:
+            out[start:stop] = continuous_surface(smoothed, max_jump)
+        elif top_k == 1:
+            out[start:stop] = np.argmax(smoothed, axis=-1)
+        else:
+            out[:, start:stop] = np.moveaxis(brightest_peaks(smoothed, top_k), -1, 0)
+
+    ranges = tile_ranges(shape[tile_axis], tile_len)
+    for done, _ in enumerate(map_tiles(run, ranges, workers), 1):
+        yield done, len(ranges)
+
+    return out
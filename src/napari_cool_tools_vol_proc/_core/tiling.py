@@ -0,0 +1,111 @@
+"""
+This module contains helpers splitting volumes into tiles and running per-tile work on a thread pool.
+
+NumPy releases the GIL inside ufuncs and reductions so threads are enough to
+keep several cores busy. Kernels always use the same tile decomposition and
+combine tile results in tile order, so the result does not depend on the
+number of workers.
+
+Long running kernels are written as step generators (block_mean_steps, ...)
+yielding (done, total) after every tile and returning their result, so
+callers such as napari workers can report progress and stop between tiles.
+The plain kernels run their step generator to completion with run_steps.
+"""
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Generator, Iterator, List, Optional, Tuple
+
+DEFAULT_CHUNK_BYTES = 64 * 2**20
+
+Steps = Generator[Tuple[int, int], None, object]
+
+
+def axis_index(ndim:int, axis:int, index) -> tuple:
+    """Build an indexing tuple selecting index along axis and everything else.
+
+    Args:
+        ndim (int): number of dimensions of the indexed array
+        axis (int): axis to index
+        index (int or slice): index or slice to apply along axis
+
+    Returns:
+        Tuple usable with any array supporting basic slicing
+    """
+    return (slice(None),) * axis + (index,) + (slice(None),) * (ndim - axis - 1)
+
+
+def split_axis(shape:tuple, *reduced:int) -> Optional[int]:
+    """Largest axis of shape not in reduced, used to split work into independent tiles."""
+    free = [axis for axis in range(len(shape)) if axis not in reduced and shape[axis] > 1]
+    return max(free, key=lambda axis: shape[axis]) if free else None
+
+
+def resolve_workers(workers:int=0) -> int:
+    """Number of worker threads to use, 0 or None meaning one per CPU core."""
+    if workers is None or workers <= 0:
+        return os.cpu_count() or 1
+    return int(workers)
+
+
+def tile_ranges(length:int, tile_len:int) -> List[Tuple[int, int]]:
+    """Split range(length) into consecutive (start, stop) tiles of tile_len items."""
+    tile_len = max(1, int(tile_len))
+    return [(start, min(length, start + tile_len)) for start in range(0, length, tile_len)]
+
+
+def split_ranges(length:int, tiles:int) -> List[Tuple[int, int]]:
+    """Split range(length) into at most tiles consecutive (start, stop) tiles of near equal size."""
+    tiles = max(1, min(int(tiles), length))
+    bounds = [length * i // tiles for i in range(tiles + 1)]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def map_tiles(func:Callable[[int, int], object], ranges:List[Tuple[int, int]], workers:int=0) -> Iterator:
+    """Apply func(start, stop) to every tile range yielding the results in range order.
+
+    At most two tiles per worker are in flight at once, which bounds the memory
+    held by tile results that have been computed but not yet consumed. Closing
+    the generator early cancels the tiles that have not started and waits for
+    the running ones.
+
+    Args:
+        func (Callable): function of a tile (start, stop) range, typically writing into a preallocated output
+        ranges (List[Tuple[int, int]]): tile ranges as returned by tile_ranges or split_ranges
+        workers (int): number of worker threads, 0 for one per CPU core, 1 to run serially
+
+    Yields:
+        Return values of func in the order of ranges
+    """
+    workers = min(resolve_workers(workers), len(ranges))
+    if workers <= 1:
+        for start, stop in ranges:
+            yield func(start, stop)
+        return
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        remaining = iter(ranges)
+        try:
+            for start, stop in remaining:
+                pending.append(executor.submit(func, start, stop))
+                if len(pending) >= 2 * workers:
+                    break
+            while pending:
+                result = pending.popleft().result()
+                for start, stop in remaining:
+                    pending.append(executor.submit(func, start, stop))
+                    break
+                yield result
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def run_steps(steps:Steps):
+    """Run a step generator yielding (done, total) progress to completion and return its result."""
+    while True:
+        try:
+            next(steps)
+        except StopIteration as stop:
+            return stop.value
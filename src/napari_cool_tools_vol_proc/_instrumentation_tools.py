@@ -0,0 +1,33 @@
+"""
+This module contains code for enabling the per-stage instrumentation of commands
+"""
+from napari_cool_tools_vol_proc._core.instrument import JsonLinesSink, LoggingSink, add_sink, remove_sink
+from napari_cool_tools_vol_proc._napari import notification_sink, show_info
+
+_ACTIVE_SINKS = []
+
+def configure_instrumentation(log:bool=False, jsonl_path:str="", notify:bool=False, trace_allocations:bool=False):
+    """Publish the wall time, CPU time, bytes read/allocated and peak RSS of every command stage.
+    Replaces the sinks previously enabled by this command, leaving every option off disables instrumentation.
+
+    Args:
+        log (bool): Flag indicating that stage events are written to the napari_cool_tools_vol_proc logger
+        jsonl_path (str): file stage events are appended to as JSON lines, empty to disable
+        notify (bool): Flag indicating that stage events are shown as napari notifications
+        trace_allocations (bool): Flag indicating that numpy allocations are traced to report allocated bytes,
+            this slows down allocation heavy commands
+    """
+    while _ACTIVE_SINKS:
+        remove_sink(_ACTIVE_SINKS.pop())
+
+    sinks = []
+    if log:
+        sinks.append(LoggingSink())
+    if jsonl_path.strip():
+        sinks.append(JsonLinesSink(jsonl_path.strip()))
+    if notify:
+        sinks.append(notification_sink)
+    for sink in sinks:
+        _ACTIVE_SINKS.append(add_sink(sink, trace_allocations=trace_allocations))
+
+    show_info(f"Instrumentation {'enabled with ' + str(len(sinks)) + ' sinks' if sinks else 'disabled'}")
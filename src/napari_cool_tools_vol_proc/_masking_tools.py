@@ -3,20 +3,24 @@ This module contains code for mainpulating volumetric data with label masks.
 """
 
 import numpy as np
+from functools import partial
 from math import sqrt
-from napari.utils.notifications import show_info
-from napari.qt.threading import thread_worker
-from napari.layers import Image, Labels, Layer
-from napari_cool_tools_io import viewer
+from napari_cool_tools_vol_proc._core.cache import detached, result_cache
+from napari_cool_tools_vol_proc._core.instrument import stage
+from napari_cool_tools_vol_proc._core.labels import isolate_labels, mask_label
+from napari_cool_tools_vol_proc._core.surfaces import detect_surface_steps
+from napari_cool_tools_vol_proc._napari import add_layer, create_layer, show_info, thread_worker, watch_layer
 
-def isolate_labeled_volume(vol:Image,label_vol:Labels,label:int)->Image:
+def isolate_labeled_volume(vol:"napari.layers.Image",label_vol:"napari.layers.Labels",label:int) -> "napari.layers.Image":
     """"""
+    watch_layer(vol)
+    watch_layer(label_vol)
     isolate_labeled_volume_thread(vol=vol,label_vol=label_vol,label=label)
 
     return
     
-@thread_worker(connect={"returned": viewer.add_layer})
-def isolate_labeled_volume_thread(vol:Image,label_vol:Labels,label:int)->Image:
+@thread_worker(connect={"returned": add_layer})
+def isolate_labeled_volume_thread(vol:"napari.layers.Image",label_vol:"napari.layers.Labels",label:int) -> "napari.layers.Image":
     """"""
     show_info(f"Isolate labeled volume thread started")
     layer = isolate_labeled_volume_func(vol=vol,label_vol=label_vol,label=label)
@@ -24,7 +28,7 @@ def isolate_labeled_volume_thread(vol:Image,label_vol:Labels,label:int)->Image:
 
     return layer
 
-def isolate_labeled_volume_func(vol:Image,label_vol:Labels,label:int)->Layer:
+def isolate_labeled_volume_func(vol:"napari.layers.Image",label_vol:"napari.layers.Labels",label:int) -> "napari.layers.Layer":
     """"""
     img_data = vol.data
     lbl_data = label_vol.data
@@ -32,31 +36,123 @@ def isolate_labeled_volume_func(vol:Image,label_vol:Labels,label:int)->Layer:
     layer_type = 'image'
     add_kwargs = {"name":f"{name}"}
 
-    label_mask = lbl_data == label
-    out_vol = img_data.copy()
-    out_vol[~label_mask] = 0
-    layer = Layer.create(out_vol,add_kwargs,layer_type)
+    out_vol = result_cache().get("isolate_labeled_volume", (img_data, lbl_data), {"label":label})
+    if out_vol is None:
+        with stage("isolate_labeled_volume", "mask", bytes_read=img_data.nbytes + lbl_data.nbytes, label=label):
+            out_vol = mask_label(img_data, lbl_data, label)
+        result_cache().put("isolate_labeled_volume", (img_data, lbl_data), {"label":label}, out_vol, shared=True)
+    else:
+        out_vol = detached(out_vol)
+    layer = watch_layer(create_layer(out_vol,add_kwargs,layer_type))
 
     return layer
 
-def find_brightest_avg_pixels(vol:Image,pixels_to_avg:int=8,axis:int=1) -> Labels:
-    ''''''
-    data = vol.data
-    
+def isolate_labeled_volumes(vol:"napari.layers.Image",label_vol:"napari.layers.Labels",labels:str="1,2",crop:bool=True,in_place:bool=False,workers:int=0):
+    """Isolate the image data covered by each of several labels in one pass over the label volume.
+
+    Args:
+        vol (Image): vol representing volumetric or image stack data
+        label_vol (Labels): label volume with the same shape as vol
+        labels (str): comma separated label values to isolate
+        crop (bool): Flag indicating that each output is cropped to the bounding box of its label,
+            the offset of the crop is recorded in the layer translate
+        in_place (bool): Flag indicating that vol is masked in place to the union of the labels instead of
+            being copied, outputs are then views of vol
+        workers (int): number of worker threads, 0 for one per CPU core
 
-    reshape = data.reshape(-1,pixels_to_avg,data.shape[-1])
-    reshape_avg = reshape.mean(1)
+    Returns:
+        None, one image layer per label present in label_vol is added to the viewer
+    """
+    connect = {"yielded": add_layer}
+    if in_place:
+        # refresh on the GUI thread once the worker is done, vol.data was modified by it
+        connect["finished"] = partial(masked_in_place, vol)
+    isolate_labeled_volumes_thread(vol=vol,label_vol=label_vol,labels=labels,crop=crop,in_place=in_place,workers=workers,_connect=connect)
 
-    viewer.add_image(reshape_avg)
+    return
 
-    col_idx = reshape_avg.max(0).astype(np.uint8)
-    row_idx = np.arange(reshape_avg.shape[1])
+def masked_in_place(vol:"napari.layers.Image"):
+    """Drop the cached results derived from vol after its data was masked in place, then redraw it."""
+    result_cache().invalidate(vol.data)
+    vol.refresh()
 
-    print(col_idx,row_idx)
+@thread_worker(connect={"yielded": add_layer})
+def isolate_labeled_volumes_thread(vol:"napari.layers.Image",label_vol:"napari.layers.Labels",labels:str="1,2",crop:bool=True,in_place:bool=False,workers:int=0):
+    """Thread yielding the layers produced by isolate_labeled_volumes_func."""
+    show_info(f"Isolate labeled volumes thread started")
+    with stage("isolate_labeled_volumes", "isolate_labels", bytes_read=vol.data.nbytes + label_vol.data.nbytes, labels=labels):
+        for layer in isolate_labeled_volumes_func(vol=vol,label_vol=label_vol,labels=labels,crop=crop,in_place=in_place,workers=workers):
+            yield layer
+    show_info(f"Isolate labeled volumes thread completed")
 
-    bright_mask = np.zeros_like(reshape_avg,dtype=np.uint8)
-    bright_mask[(col_idx,row_idx)] = 2
+def isolate_labeled_volumes_func(vol:"napari.layers.Image",label_vol:"napari.layers.Labels",labels:str="1,2",crop:bool=True,in_place:bool=False,workers:int=0):
+    """Generate one image layer per label containing the image data covered by that label.
 
-    print(col_idx,row_idx)
-    viewer.add_labels(bright_mask)
-    
+    Args:
+        vol (Image): vol representing volumetric or image stack data
+        label_vol (Labels): label volume with the same shape as vol
+        labels (str): comma separated label values to isolate
+        crop (bool): Flag indicating that each output is cropped to the bounding box of its label
+        in_place (bool): Flag indicating that vol is masked in place instead of being copied
+        workers (int): number of worker threads, 0 for one per CPU core
+
+    Yields:
+        Layer for each label present in label_vol
+    """
+    label_values = [int(label) for label in labels.replace(" ","").split(",") if label]
+    scale = np.asarray(vol.scale)
+    translate = np.asarray(vol.translate)
+    layer_type = 'image'
+
+    for label,out_vol,offset in isolate_labels(vol.data,label_vol.data,label_values,crop=crop,in_place=in_place,workers=workers):
+        add_kwargs = {
+            "name":f"{vol.name}_{label}_mask",
+            "scale":scale,
+            "translate":translate + np.asarray(offset) * scale,
+        }
+        yield create_layer(out_vol,add_kwargs,layer_type)
+
+def detect_surface(vol:"napari.layers.Image",depth_axis:int=1,smooth:int=9,top_k:int=1,max_jump:int=0,workers:int=0):
+    """Detect the brightest layer (e.g. ILM or RPE) along every A-scan of a volume as a 2D surface depth map.
+
+    Args:
+        vol (Image): 3D structural OCT volume
+        depth_axis (int): axis along A-scans
+        smooth (int): width in pixels of the box filter applied along depth before detection, 1 disables it
+        top_k (int): number of bright layers detected per A-scan, stacked in increasing depth (-1 where missing)
+        max_jump (int): largest depth change in pixels between neighbouring A-scans of a B-scan, 0 for no
+            continuity constraint (single surface only)
+        workers (int): number of worker threads, 0 for one per CPU core
+    """
+    detect_surface_thread(vol=vol,depth_axis=depth_axis,smooth=smooth,top_k=top_k,max_jump=max_jump,workers=workers)
+
+    return
+
+@thread_worker(connect={"returned": add_layer}, progress={"desc": "Detecting surface"})
+def detect_surface_thread(vol:"napari.layers.Image",depth_axis:int=1,smooth:int=9,top_k:int=1,max_jump:int=0,workers:int=0) -> "napari.layers.Image":
+    """Thread running detect_surface_func."""
+    show_info(f"Detect surface thread started")
+    layer = yield from detect_surface_func(vol=vol,depth_axis=depth_axis,smooth=smooth,top_k=top_k,max_jump=max_jump,workers=workers)
+    show_info(f"Detect surface thread completed")
+
+    return layer
+
+def detect_surface_func(vol:"napari.layers.Image",depth_axis:int=1,smooth:int=9,top_k:int=1,max_jump:int=0,workers:int=0) -> "napari.layers.Layer":
+    """Surface depth map layer of vol, see detect_surface.
+
+    Yields:
+        (done, total) progress after every tile of B-scans
+
+    Returns:
+        Image layer of the depth of the surface for every A-scan, with a leading layer axis when top_k > 1
+    """
+    data = vol.data
+    name = f"{vol.name}_surface{'_' + str(top_k) if top_k > 1 else ''}"
+    add_kwargs = {"name":name}
+    layer_type = "image"
+
+    with stage("detect_surface", "detect_surface", bytes_read=data.nbytes, top_k=top_k, max_jump=max_jump):
+        depths = yield from detect_surface_steps(data, depth_axis=depth_axis, smooth=smooth, top_k=top_k, max_jump=max_jump, workers=workers)
+    layer = create_layer(depths,add_kwargs,layer_type)
+
+    return layer
@@ -2,22 +2,71 @@
 This module contains code for measuring volumetric data.
 """
 
+import logging
+import time
 import numpy as np
+from functools import lru_cache
 from math import sqrt
-from napari.qt.threading import thread_worker
-from napari.layers import Image, Layer
-from napari_cool_tools_io import viewer
-from magicgui import magicgui
+from napari_cool_tools_vol_proc._core.cache import result_cache
+from napari_cool_tools_vol_proc._core.drawing import CircleBrush, circle_mask
+from napari_cool_tools_vol_proc._core.instrument import stage
+from napari_cool_tools_vol_proc._core.labels import format_label_statistics, label_statistics_steps
+from napari_cool_tools_vol_proc._core.markers import MarkerStore
+from napari_cool_tools_vol_proc._core.masking import expand_mask, project_mask as project_mask_func, resolve_mask_axes
+from napari_cool_tools_vol_proc._core.regions import RegionIndex, format_region_volumes
+from napari_cool_tools_vol_proc._napari import add_layer, call_later, create_layer, get_viewer, magicgui, show_info, show_warning, thread_worker, watch_layer
 
-def calc_label_volumes(layer:Layer):
-    ''''''
-    retina_mask = layer.data == 1
-    choroid_mask = layer.data == 2
+logger = logging.getLogger(__name__)
+
+# minimum time in seconds between two redraws while dragging (~ display refresh rate)
+REDRAW_INTERVAL = 1 / 60
+
+def calc_label_volumes(layer:"napari.layers.Layer", per_bscan:bool=False, workers:int=0):
+    """Calculate the voxel count and physical volume of every label of a labels layer in a single pass.
+
+    Args:
+        layer (Layer): labels layer, volumes use the layer scale (mm³ for scales in mm)
+        per_bscan (bool): Flag indicating that voxel counts are also reported for every B-scan (axis 0)
+        workers (int): number of worker threads, 0 for one per CPU core
+
+    Returns:
+        The started worker, its returned signal carries the dict mapping each label to
+        {"voxels", "volume_mm3"} (and "per_bscan" counts when requested)
+    """
+    worker = calc_label_volumes_thread(layer=layer,per_bscan=per_bscan,workers=workers)
+
+    return worker
 
-    retina_voxels = np.count_nonzero(retina_mask)
-    choroid_voxels = np.count_nonzero(choroid_mask)
+@thread_worker(start_thread=True, progress={"desc": "Calculating label volumes"})
+def calc_label_volumes_thread(layer:"napari.layers.Layer", per_bscan:bool=False, workers:int=0) -> dict:
+    """Thread running calc_label_volumes_func, the statistics are reported when it completes."""
+    show_info(f'Calculate label volumes thread has started')
+    stats = yield from calc_label_volumes_func(layer=layer,per_bscan=per_bscan,workers=workers)
+    show_info(f'Calculate label volumes thread has completed')
 
-    print(f"retina volume: {retina_voxels} voxels\nchoroid volume: {choroid_voxels} voxels")
+    return stats
+
+def calc_label_volumes_func(layer:"napari.layers.Layer", per_bscan:bool=False, workers:int=0) -> dict:
+    """Calculate the voxel count and physical volume of every label of a labels layer in a single pass.
+
+    Args:
+        layer (Layer): labels layer, volumes use the layer scale (mm³ for scales in mm)
+        per_bscan (bool): Flag indicating that voxel counts are also reported for every B-scan (axis 0)
+        workers (int): number of worker threads, 0 for one per CPU core
+
+    Yields:
+        (done, total) progress after every tile
+
+    Returns:
+        Dict mapping each label to {"voxels", "volume_mm3"} (and "per_bscan" counts when requested)
+    """
+    with stage("calc_label_volumes", "label_statistics", bytes_read=layer.data.nbytes):
+        stats = yield from label_statistics_steps(layer.data, scale=layer.scale, per_bscan=per_bscan, workers=workers)
+    table = format_label_statistics(stats)
+    logger.info("label volumes of %s\n%s", layer.name, table)
+    show_info(f"{layer.name} label volumes\n{table}")
+
+    return stats
 
 def calc_radius(final,init)->int: 
     ''''''
@@ -28,168 +77,237 @@ def calc_radius(final,init)->int:
 
 def clear_labels(layer):
     ''''''
-    layer.data = np.zeros(layer.data.shape,dtype=np.int8)
+    layer.data[...] = 0
+    layer.refresh()
 
 def draw_circle(layer, x, y, r, label_val=1):
     ''''''
     labels = layer.data
-    y, x = np.ogrid[-x:labels.shape[0]-x, -y:labels.shape[1]-y]
-    mask = x*x + y*y <= r*r
-    labels[mask] = label_val
+    box, mask = circle_mask(labels.shape, (x, y), r)
+    labels[box][mask] = label_val
 
-@magicgui(call_button='Activate')
-def project_mask(mask_layer:Layer,labels_layer:Layer):
-    ''''''
-    i0 = labels_layer.data.shape.index(mask_layer.data.shape[0])
-    i1 = labels_layer.data.shape.index(mask_layer.data.shape[1])
-    #i0 = mask_layer.data.shape.index(labels_layer.data.shape[0]) + 1
-    #i1 = mask_layer.data.shape.index(labels_layer.data.shape[2]) + 1
-    print(f"i0: {i0}, i1: {i1}")
-    dims = range(labels_layer.data.ndim - 1)
-    print(f"dims: {dims}, ndim: {labels_layer.data.ndim}")
-    new_dim = list(set((i0,i1)) ^ set(range(labels_layer.data.ndim)))[0]
-    new_dim_val = labels_layer.data.shape[new_dim]
-    #orig_dims = (i1,new_dim,i0)
-    #trans_dim = (new_dim,i0,i1)
-
-    #new_dims = (i0,new_dim,i1)
-    #new_dims = (2,0,1)
-
-    mask_3d = np.repeat(mask_layer.data[np.newaxis,:],new_dim_val,axis=0)
-    print(f"mask 3d shape: {mask_3d.shape}")
-
-    d0 = mask_3d.data.shape.index(labels_layer.data.shape[0])
-    d1 = mask_3d.data.shape.index(labels_layer.data.shape[1])
-    d2 = mask_3d.data.shape.index(labels_layer.data.shape[2])
+def paint_labels(layer, coords, value):
+    """Write value at coords of a labels layer refreshing only the touched region when napari supports it."""
+    if hasattr(layer, "data_setitem"):
+        layer.data_setitem(coords, value)
+    else:
+        layer.data[coords] = value
+        layer.refresh()
 
-    print(f"match indicies: {d0,d1,d2}, match vals {mask_3d.data.shape[d0],mask_3d.data.shape[d1],mask_3d.data.shape[d2]}")
-    new_dims = (d0,d1,d2)#(2,0,1)
+def parse_axes(axes:str):
+    """Parse an axes string such as "(2,0)" into a tuple of ints, "auto" or "" giving None."""
+    axes = axes.strip().strip("()").replace(" ","")
+    if axes in ("", "auto"):
+        return None
+    return tuple(int(axis) for axis in axes.split(","))
 
-    out = np.transpose(mask_3d, new_dims)
-    print(f"labels shape: {labels_layer.data.shape}, output shape: {out.shape}")
-    result = out * labels_layer.data
-    viewer.add_labels(result)
+def project_mask(mask_layer:"napari.layers.Layer",labels_layer:"napari.layers.Layer",mask_axes:str="auto",in_place:bool=False):
+    """Keep the labels whose projection falls inside a 2D enface mask.
 
+    Args:
+        mask_layer (Layer): 2D mask, nonzero pixels are kept
+        labels_layer (Layer): 3D labels the mask is projected through
+        mask_axes (str): labels axes matched by mask axes 0 and 1, e.g. "(2,0)" for an xy MIP enface,
+            "auto" matches them by shape and fails when that is ambiguous
+        in_place (bool): Flag indicating that labels_layer is masked in place instead of adding a new layer
+    """
+    out = labels_layer.data if in_place else None
+    with stage("project_mask", "project_mask", bytes_read=labels_layer.data.nbytes):
+        result = project_mask_func(mask_layer.data, labels_layer.data, mask_axes=parse_axes(mask_axes), out=out)
+    if in_place:
+        labels_layer.refresh()
+    else:
+        get_viewer().add_labels(result, name=f"{labels_layer.name}_{mask_layer.name}", scale=labels_layer.scale, translate=labels_layer.translate)
+
+@lru_cache(maxsize=None)
+def project_mask_widget():
+    """project_mask widget, created the first time it is docked."""
+    return magicgui(project_mask, call_button='Activate')
+
+def is_label_volume(layer) -> bool:
+    """Whether layer holds a 3D integer label volume that region volumes can be measured in."""
+    data = layer.data
+    return len(data.shape) == 3 and np.dtype(data.dtype).kind in "biu"
+
+def attach_region_index(mask_layer, labels_layer, enface_axes):
+    """Index the labels of labels_layer in the background and attach the index to mask_layer once built,
+    circles drawn on mask_layer then report the label volumes they enclose."""
+    watch_layer(labels_layer)
+    worker = region_index_thread(labels_layer=labels_layer,enface_axes=tuple(enface_axes))
+    worker.returned.connect(lambda index: mask_layer.metadata.update(region_index=index))
+    worker.start()
+
+@thread_worker
+def region_index_thread(labels_layer:"napari.layers.Labels", enface_axes=(0,2)) -> RegionIndex:
+    """Thread building (or fetching from the result cache) the RegionIndex of a label volume."""
+    data = labels_layer.data
+    params = {"enface_axes":enface_axes, "scale":tuple(labels_layer.scale)}
+    index = result_cache().get("region_index", (data,), params)
+    if index is None:
+        with stage("region_index", "thickness_maps", bytes_read=data.nbytes):
+            index = RegionIndex.from_labels(data, enface_axes=enface_axes, scale=labels_layer.scale)
+        result_cache().put("region_index", (data,), params, index)
+
+    return index
+
+def region_volumes_text(index:RegionIndex, center, radius) -> str:
+    """Volume of every label inside a circle of radius pixels drawn on the enface mask."""
+    counts = index.disk(center, radius, spacing=(1.0, 1.0))
+    return ", ".join(f"label {label}: {volume:.6g}" for label, volume in index.volumes(counts).items())
+
+def show_region_volumes(layer, center, radius):
+    """Show the label volumes inside the circle live in the viewer text overlay when layer has a region index."""
+    index = layer.metadata.get("region_index")
+    if index is None:
+        return
+    overlay = getattr(get_viewer(), "text_overlay", None)
+    if overlay is not None:
+        overlay.text = f"r = {radius} px: {region_volumes_text(index, center, radius)}"
+        overlay.visible = True
 
 def click_drag(layer, event):
     init_pos = event.position
     clear_labels(layer)
+    brush = CircleBrush(layer.data.shape, (init_pos[2], init_pos[0]), label_val=1)
 
     #layer.selected_label = 1
     print('mouse down')
     print(f'init position: {init_pos}\n')
     dragged = False
+    # position not drawn yet and time of the last redraw, shared with the trailing redraw timer
+    state = {"pending": None, "last_draw": 0.0, "scheduled": False}
+
+    def flush():
+        state["scheduled"] = False
+        if state["pending"] is not None:
+            redraw_circle(layer, brush, state["pending"], init_pos)
+            show_region_volumes(layer, brush.center, brush.radius)
+            state["pending"] = None
+            state["last_draw"] = time.perf_counter()
+
     yield
-    # on move
+    # on move, coalescing events arriving faster than REDRAW_INTERVAL, the last one is drawn by a timer
     while event.type == 'mouse_move':
-        #radius = calc_radius(event.position,init_pos)
-        #print('Clear Labels')
-        #print(f'Draw circle of radius: {radius} centered at: ({int(init_pos[0])},{int(init_pos[1])})')
-        #layer.data[int(event.position[0]),int(event.position[1])] = 1
-        #layer.refresh()
-        #print(event.position)
-        final_pos = event.position
-        clear_labels(layer)
-        radius = calc_radius(final_pos,init_pos)
-        print(f'Draw circle of radius: {radius} centered at: ({int(init_pos[2])},{int(init_pos[0])})')
-        draw_circle(layer,init_pos[2],init_pos[0],radius,label_val=1)
-        layer.refresh()
+        state["pending"] = event.position
+        wait = REDRAW_INTERVAL - (time.perf_counter() - state["last_draw"])
+        if wait <= 0:
+            flush()
+        elif not state["scheduled"]:
+            state["scheduled"] = True
+            call_later(wait, flush)
         dragged = True
         yield
     # on release
     if dragged:
-        #final_pos = event.position
-        #radius = calc_radius(final_pos,init_pos)
-        #print(f'Draw circle of radius: {radius} centered at: ({int(init_pos[2])},{int(init_pos[0])})')
-        #draw_circle(layer,init_pos[2],init_pos[0],radius,label_val=2)
-        #layer.refresh()
-        viewer.window.add_dock_widget(project_mask,name="projection_mask",area="right")
+        flush()
+        if "region_index" in layer.metadata:
+            index = layer.metadata["region_index"]
+            show_region_volumes(layer, brush.center, brush.radius)
+            show_info(f"Label volumes inside r = {brush.radius} px\n{format_region_volumes(index, {'circle': index.disk(brush.center, brush.radius, spacing=(1.0, 1.0))})}")
+        get_viewer().window.add_dock_widget(project_mask_widget(),name="projection_mask",area="right")
         layer.mouse_drag_callbacks.remove(click_drag)
         #project_mask.show(run=True)
+        logger.debug("drew circle of radius %s centered at (%d, %d)", brush.radius, int(init_pos[2]), int(init_pos[0]))
         print('drag end')
     else:
         layer.mouse_drag_callbacks.remove(click_drag)
         print('clicked!')
 
-def draw_circle_mask(enface:Layer, vol:Layer):
-    """Generate maximum intensity projections (MIP) along selected orthoganal image planes from structural OCT data.
-    
+def redraw_circle(layer, brush, final_pos, init_pos):
+    """Resize the circle drawn by brush to reach final_pos, repainting only the pixels that change."""
+    changed = brush.set_radius(calc_radius(final_pos,init_pos))
+    if changed is not None:
+        paint_labels(layer, *changed)
+
+def match_enface_axes(enface_shape:tuple, vol:"napari.layers.Layer", mask_axes:str="auto"):
+    """Axes of vol matched by the axes of an enface mask, None after warning when they cannot be resolved."""
+    try:
+        return resolve_mask_axes(tuple(enface_shape), tuple(vol.data.shape), parse_axes(mask_axes))
+    except ValueError as error:
+        show_warning(f"Cannot match the enface to {vol.name}: {error}\n")
+        return None
+
+def draw_circle_mask(enface:"napari.layers.Layer", vol:"napari.layers.Layer", mask_axes:str="auto"):
+    """Add a 2D mask layer on an enface image in which circles are drawn by click and drag.
+
+    The viewer is reoriented so the enface plane of vol is displayed. When vol is a
+    label volume the volume of every label inside the circle is shown while drawing.
+
     Args:
-        img (Image): 3D ndarray representing structural OCT data
-        xy (bool): Toggle xy plane MIP (enface plane by default)
-        yz (bool): Toggle yz plane MIP
-        zx (bool): Toggle zx plane MIP
-    
-    Returns:
-        List of napari Layers containing selected MIP planes
+        enface (Layer): 2D enface image (e.g. a MIP) of vol
+        vol (Layer): volume the enface was projected from
+        mask_axes (str): vol axes matched by enface axes 0 and 1, e.g. "(2,0)" for an xy MIP enface,
+            "auto" matches them by shape
     """
 
+    viewer = get_viewer()
     mask_name = f"{enface.name}_mask"
     
     labels_layer = viewer.add_labels(np.zeros(enface.data.shape,dtype=np.int8), name=mask_name)
     labels_layer.mode = 'paint'
     labels_layer.selected_label = 0
 
-    target_shape = enface.data.shape
-    #current_shape = vol.data.shape
-    order_1 = vol.data.shape.index(target_shape[0])
-    order_2 = vol.data.shape.index(target_shape[1])
-    order_0 = list(set((order_2,order_1)) ^ set(viewer.dims.order))[0]
-    viewer.dims.order = (order_0,order_1,order_2)
-
     labels_layer.mouse_drag_callbacks.append(click_drag)
+    axes = match_enface_axes(enface.data.shape, vol, mask_axes)
+    if axes is None:
+        return
+    viewer.dims.order = (({0, 1, 2} - set(axes)).pop(),) + tuple(axes)
+    if is_label_volume(vol):
+        attach_region_index(labels_layer, vol, axes)
 
     
     return
 
-def mark_fovea(layer, fovea_pos):
-    """"""
+def marker_position(layer, event):
+    """(row, column) of a mouse event in the data coordinates of a 2D layer."""
+    return tuple(layer.world_to_data(event.position)[-2:])
 
-    print(layer.data.shape)
-    layer.data = layer.data[:,0,:]
-    print(layer.data.shape)
-    draw_circle(layer,fovea_pos[2],fovea_pos[0],10)
-    layer.data[int(fovea_pos[2]),int(fovea_pos[0])] = 6
-    layer.refresh()
+def show_markers(layer):
+    """Show the markers stored on a zone mask layer in its points layer."""
+    store = layer.metadata["markers"]
+    points = layer.metadata["markers_layer"]
+    points.data = store.coordinates()
+    points.features = {"marker": store.names()}
+    points.refresh()
+
+def mark_fovea(layer, fovea_pos):
+    """Store the fovea marker and wait for the optic disc to be clicked."""
+    layer.metadata["markers"].set("fovea", fovea_pos)
+    show_markers(layer)
 
     layer.mouse_drag_callbacks.remove(click_fovea)
     layer.mouse_drag_callbacks.append(click_disc)
 
-
-
 def mark_disc(layer, disc_pos):
-    """"""
-
-    print(layer.data.shape)
-    draw_circle(layer,disc_pos[1],disc_pos[2],10,2)
-    layer.data[int(disc_pos[1]),int(disc_pos[2])] = 10
-    layer.refresh()
+    """Store the optic disc marker and draw Zone 1."""
+    layer.metadata["markers"].set("disc", disc_pos)
+    show_markers(layer)
     layer.mouse_drag_callbacks.remove(click_disc)
 
-    draw_z1(layer,10,6)
-
-def draw_z1(layer,disc_int,fovea_int):
-    """"""
-    disc_mask = layer.data == disc_int
-    fovea_mask = layer.data == fovea_int
-    disc = disc_mask.nonzero()
-    fovea = fovea_mask.nonzero()
-    fy,fx = fovea[0][0],fovea[1][0]
-    dy,dx = disc[0][0], disc[1][0]
+    draw_z1(layer)
 
-    r = sqrt((dy-fy)*(dy-fy) + (dx-fx)*(dx-fx))
-    #For two points on a 2D coordinate plane: d = √ [ (x₂ - x₁)² + (y₂ - y₁)²]
+def draw_z1(layer):
+    """Draw Zone 1, the circle centered on the optic disc of radius twice the optic disc to fovea distance."""
+    store = layer.metadata["markers"]
+    fy,fx = store.get("fovea")
+    dy,dx = store.get("disc")
+    r = store.distance("fovea", "disc")
 
     print(f'disc: {dx,dy}, fovea: {fx,fy}\n')
+    clear_labels(layer)
     draw_circle(layer,dy,dx,2*r)
     layer.refresh()
 
-    viewer.window.add_dock_widget(project_mask,name="projection_mask",area="right")
+    index = layer.metadata.get("region_index")
+    if index is not None:
+        zone1 = {"zone 1": index.disk((dy,dx), 2*r, spacing=(1.0, 1.0))}
+        show_info(f"Zone 1 label volumes\n{format_region_volumes(index, zone1)}")
+
+    get_viewer().window.add_dock_widget(project_mask_widget(),name="projection_mask",area="right")
 
 
 def click_fovea(layer, event):
-    init_pos = event.position
-    clear_labels(layer)
+    init_pos = marker_position(layer, event)
 
     print('mouse down')
     print(f'init position: {init_pos}\n')
@@ -197,15 +315,11 @@ def click_fovea(layer, event):
     yield
     # on move
     while event.type == 'mouse_move':
-
-        final_pos = event.position
-        #clear_labels(layer)
-        #layer.refresh()
         dragged = True
         yield
     # on release
     if dragged:
-        final_pos = event.position
+        final_pos = marker_position(layer, event)
         print(f'final position: {final_pos}\n')
         print('drag end')
         mark_fovea(layer,final_pos)
@@ -215,8 +329,7 @@ def click_fovea(layer, event):
         mark_fovea(layer,init_pos)
 
 def click_disc(layer, event):
-    init_pos = event.position
-    #clear_labels(layer)
+    init_pos = marker_position(layer, event)
 
     print('mouse down')
     print(f'init position: {init_pos}\n')
@@ -224,15 +337,11 @@ def click_disc(layer, event):
     yield
     # on move
     while event.type == 'mouse_move':
-
-        final_pos = event.position
-        #clear_labels(layer)
-        layer.refresh()
         dragged = True
         yield
     # on release
     if dragged:
-        final_pos = event.position
+        final_pos = marker_position(layer, event)
         print(f'final position: {final_pos}\n')
         print('drag end')
         mark_disc(layer,final_pos)
@@ -241,34 +350,64 @@ def click_disc(layer, event):
         print('clicked!')
         mark_disc(layer,init_pos)
 
-def calc_zone1(enface:Layer, vol:Layer):
-    """Generate maximum intensity projections (MIP) along selected orthoganal image planes from structural OCT data.
-    
+def calc_zone1(enface:"napari.layers.Layer", vol:"napari.layers.Layer", mask_axes:str="auto"):
+    """Measure Zone 1 from a fovea and an optic disc clicked on an enface image.
+
+    Clicks are recorded on an enface sized 2D mask layer and kept in a points layer,
+    the first click marks the fovea and the second the optic disc, after which Zone 1
+    is drawn into the mask. Use project_mask to keep the labels of a volume inside it
+    and export_zone_mask to create the full 3D mask.
+
     Args:
-        img (Image): 3D ndarray representing structural OCT data
-        xy (bool): Toggle xy plane MIP (enface plane by default)
-        yz (bool): Toggle yz plane MIP
-        zx (bool): Toggle zx plane MIP
-    
-    Returns:
-        List of napari Layers containing selected MIP planes
+        enface (Layer): 2D enface image (e.g. a MIP) of vol
+        vol (Layer): volume the enface was projected from, Zone 1 volumes are reported when it is a label volume
+        mask_axes (str): vol axes matched by enface axes 0 and 1, e.g. "(2,0)" for an xy MIP enface,
+            "auto" matches them by shape
     """
 
+    viewer = get_viewer()
     mask_name = f"{enface.name}_mask"
+    enface_shape = enface.data.shape[-2:]
     
-    labels_layer = viewer.add_labels(np.zeros(vol.data.shape,dtype=np.int8), name=mask_name)
+    labels_layer = viewer.add_labels(np.zeros(enface_shape,dtype=np.int8), name=mask_name, scale=enface.scale[-2:], translate=enface.translate[-2:])
     labels_layer.mode = 'paint'
     labels_layer.selected_label = 0
-
-    """
-    target_shape = enface.data.shape
-    #current_shape = vol.data.shape
-    order_1 = vol.data.shape.index(target_shape[0])
-    order_2 = vol.data.shape.index(target_shape[1])
-    order_0 = list(set((order_2,order_1)) ^ set(viewer.dims.order))[0]
-    viewer.dims.order = (order_0,order_1,order_2)
-    """
+    markers_layer = viewer.add_points(np.empty((0,2)), name=f"{enface.name}_markers", features={"marker": []}, text="marker", size=10, face_color="yellow", scale=enface.scale[-2:], translate=enface.translate[-2:])
+    labels_layer.metadata["markers"] = MarkerStore()
+    labels_layer.metadata["markers_layer"] = markers_layer
+    viewer.layers.selection.active = labels_layer
 
     labels_layer.mouse_drag_callbacks.append(click_fovea)
+    if is_label_volume(vol):
+        axes = match_enface_axes(enface_shape, vol, mask_axes)
+        if axes is not None:
+            attach_region_index(labels_layer, vol, axes)
     
-    return
\ No newline at end of file
+    return
+
+def export_zone_mask(mask_layer:"napari.layers.Labels", vol:"napari.layers.Layer", mask_axes:str="auto", workers:int=0):
+    """Create the 3D mask of vol repeating a 2D zone mask along the remaining axis, written tile by tile.
+
+    Args:
+        mask_layer (Labels): 2D mask drawn by calc_zone1 or draw_circle_mask
+        vol (Layer): volume giving the shape of the 3D mask
+        mask_axes (str): vol axes matched by mask axes 0 and 1, e.g. "(2,0)" for an xy MIP enface,
+            "auto" matches them by shape and fails when that is ambiguous
+        workers (int): number of worker threads, 0 for one per CPU core
+    """
+    export_zone_mask_thread(mask_layer=mask_layer,vol=vol,mask_axes=mask_axes,workers=workers)
+
+    return
+
+@thread_worker(connect={"returned": add_layer})
+def export_zone_mask_thread(mask_layer:"napari.layers.Labels", vol:"napari.layers.Layer", mask_axes:str="auto", workers:int=0) -> "napari.layers.Labels":
+    """Thread expanding the 2D zone mask of mask_layer into a 3D labels layer of the vol shape."""
+    show_info(f'Export zone mask thread has started')
+    shape = tuple(vol.data.shape)
+    with stage("export_zone_mask", "expand_mask", mask_axes=mask_axes):
+        mask = expand_mask(np.asarray(mask_layer.data), shape, mask_axes=parse_axes(mask_axes), dtype=mask_layer.data.dtype, workers=workers)
+    add_kwargs = {"name": f"{mask_layer.name}_3D", "scale": vol.scale, "translate": vol.translate}
+    layer = create_layer(mask,add_kwargs,"labels")
+    show_info(f'Export zone mask thread has completed')
+
+    return layer
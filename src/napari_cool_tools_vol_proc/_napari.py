@@ -0,0 +1,189 @@
+"""
+This module contains lazy accessors for napari, the shared viewer and magicgui.
+
+Adapter modules reach napari through these helpers at call time instead of at
+import time, so importing the plugin (by npe2 while napari starts, or headless
+through the batch runner) only loads numpy and the compute kernels. Adapters
+annotate their parameters with strings such as "napari.layers.Image", which
+magicgui resolves when it builds a widget.
+"""
+import weakref
+from functools import partial, wraps
+from inspect import isgeneratorfunction
+
+from napari_cool_tools_vol_proc._core.cache import result_cache
+from napari_cool_tools_vol_proc._core.instrument import format_event, register_sink_factory
+from napari_cool_tools_vol_proc._core.storage import active_store, store_path
+
+_RELEASING_VIEWER = None
+
+
+def get_viewer():
+    """Viewer shared by the cool tools plugins, outputs on disk are deleted with their layers (see release_removed_output)."""
+    global _RELEASING_VIEWER
+    from napari_cool_tools_io import viewer
+    if viewer is not None and _RELEASING_VIEWER is not viewer:
+        viewer.layers.events.removed.connect(partial(release_removed_output, viewer))
+        _RELEASING_VIEWER = viewer
+    return viewer
+
+
+def release_removed_output(viewer, event):
+    """layers.removed callback deleting the output store file of a removed layer once no other layer shows it.
+
+    Cached results living in the file are dropped first, so they are recomputed
+    rather than read from a deleted file.
+    """
+    store = active_store()
+    if store is None:
+        return
+    data = event.value.data
+    path = store.output_path(data)
+    if path is None:
+        return
+    for layer in viewer.layers:
+        other = store_path(layer.data)
+        if other is not None and other.resolve() == path:
+            return
+    result_cache().discard_stored(path)
+    store.release(data)
+
+
+def add_layer(layer):
+    """Add a layer to the shared viewer, usable as a worker callback."""
+    return get_viewer().add_layer(layer)
+
+
+def add_layers(layers):
+    """Add several layers to the shared viewer, usable as a worker callback."""
+    viewer = get_viewer()
+    for layer in layers:
+        viewer.add_layer(layer)
+
+
+def show_info(message:str):
+    """napari.utils.notifications.show_info"""
+    from napari.utils.notifications import show_info as _show_info
+    _show_info(message)
+
+
+def show_warning(message:str):
+    """napari.utils.notifications.show_warning"""
+    from napari.utils.notifications import show_warning as _show_warning
+    _show_warning(message)
+
+
+def notification_sink(event:dict):
+    """Instrumentation sink showing each stage event as a napari notification."""
+    show_info(format_event(event))
+
+
+register_sink_factory("notify", lambda argument: notification_sink)
+
+_WATCHED_LAYERS = weakref.WeakSet()
+
+
+def watch_layer(layer):
+    """Invalidate the cached results derived from, or shared as, the data of layer whenever it is set or painted.
+
+    Connects once per layer, results of in-place edits that emit no event are
+    still caught by the fingerprint check of the cache.
+    """
+    if layer in _WATCHED_LAYERS:
+        return layer
+
+    def invalidate(event=None):
+        result_cache().invalidate(layer.data)
+        result_cache().invalidate_result(layer.data)
+
+    for name in ("data", "paint", "labels_update"):
+        emitter = getattr(layer.events, name, None)
+        if emitter is not None:
+            emitter.connect(invalidate)
+    _WATCHED_LAYERS.add(layer)
+    return layer
+
+
+def create_layer(data, add_kwargs:dict, layer_type:str):
+    """napari.layers.Layer.create"""
+    from napari.layers import Layer
+    return Layer.create(data, add_kwargs, layer_type)
+
+
+def call_later(seconds:float, callback):
+    """Run callback on the GUI thread after seconds, qtpy.QtCore.QTimer.singleShot"""
+    from qtpy.QtCore import QTimer
+    QTimer.singleShot(max(int(seconds * 1000), 0), callback)
+
+
+def magicgui(function=None, **options):
+    """magicgui.magicgui"""
+    from magicgui import magicgui as _magicgui
+    return _magicgui(function, **options)
+
+
+def _update_progress(worker, value):
+    # yielded callback moving the worker progress bar to a (done, total) step
+    pbar = getattr(worker, "pbar", None)
+    if pbar is None or not (isinstance(value, tuple) and len(value) == 2):
+        return
+    done, total = value
+    if pbar.total != total:
+        pbar.total = total
+    pbar.update(done - pbar.n)
+
+
+def _release(worker):
+    # aborted callback closing the generator so the buffers it holds are freed right away
+    generator = getattr(worker, "_gen", None)
+    if generator is not None:
+        generator.close()
+
+
+def thread_worker(function=None, *, connect=None, start_thread=None, progress=None):
+    """Lazy equivalent of napari.qt.threading.thread_worker.
+
+    The decorated function returns a napari worker like thread_worker would,
+    napari is only imported when the worker is created. As with thread_worker,
+    the worker starts immediately when connect is given, and _connect,
+    _start_thread or _progress keyword arguments override the decorator options
+    for a single call.
+
+    Generator functions with a progress bar may yield (done, total) steps, such
+    as those of the kernel step generators, which set the bar to done out of
+    total so the total does not have to be known when the worker is created
+    (when progress gives a total, napari counts every yield instead).
+    The worker can be stopped between yields from the progress bar or with
+    worker.quit(), the generator is then closed so its partial buffers are
+    released.
+
+    Args:
+        function (Callable): function or generator function run in the worker thread
+        connect (dict): mapping of worker signal names to callbacks
+        start_thread (bool): Flag indicating that the worker is started on creation
+        progress (bool or dict): napari progress bar options, see napari.qt.threading.create_worker
+    """
+    def decorator(func):
+        @wraps(func)
+        def create(*args, **kwargs):
+            from napari.qt.threading import create_worker
+            options = {"_connect": connect, "_start_thread": start_thread, "_progress": progress}
+            for key in options:
+                if key in kwargs:
+                    options[key] = kwargs.pop(key)
+            start = options.pop("_start_thread")
+            if start is None:
+                start = bool(options["_connect"])
+            # connect the progress callbacks before the first step can be yielded
+            worker = create_worker(func, *args, _start_thread=False, **options, **kwargs)
+            if isgeneratorfunction(func):
+                worker.aborted.connect(partial(_release, worker))
+                progress_options = options["_progress"]
+                if progress_options and not (isinstance(progress_options, dict) and progress_options.get("total")):
+                    # without a fixed total napari leaves the bar to the yielded steps
+                    worker.yielded.connect(partial(_update_progress, worker))
+            if start:
+                worker.start()
+            return worker
+        return create
+    return decorator if function is None else decorator(function)
@@ -2,12 +2,22 @@
 This module contains code for calculating and manipulating projections of volumetric data.
 """
 from typing import List
-from napari.utils.notifications import show_info
-from napari.layers import Image, Layer
-from napari.qt.threading import thread_worker
-from napari_cool_tools_io import viewer
+from napari_cool_tools_vol_proc._core.cache import detached, result_cache
+from napari_cool_tools_vol_proc._core.instrument import stage
+from napari_cool_tools_vol_proc._core.projection import PLANES, ProjectionType, SlabMaxIndex, projections
+from napari_cool_tools_vol_proc._napari import add_layer, create_layer, get_viewer, magicgui, show_info, thread_worker, watch_layer
 
-def mip(img:Image,yx=True,zy=False,xz=False):
+PROJECTION_PREFIX = {
+    ProjectionType.MAX: "MIP",
+    ProjectionType.MIN: "MinIP",
+    ProjectionType.MEAN: "AIP",
+    ProjectionType.SUM: "SumIP",
+    ProjectionType.STD: "StdIP",
+    ProjectionType.ARGMAX: "ArgMaxIP",
+}
+PLANE_NAMES = {"yx": "xy", "zy": "yz", "xz": "xz"}
+
+def mip(img:"napari.layers.Image",yx=True,zy=False,xz=False,projection_type:ProjectionType=ProjectionType.MAX,workers:int=0):
     """Generate maximum intensity projections (MIP) along selected orthoganal image planes from structural OCT data.
     
     Args:
@@ -15,53 +25,116 @@ def mip(img:Image,yx=True,zy=False,xz=False):
         xy (bool): Toggle xy plane MIP (enface plane by default)
         yz (bool): Toggle yz plane MIP
         zx (bool): Toggle zx plane MIP
+        projection_type (ProjectionType): statistic projected (max, min, mean, sum, std or argmax/depth-of-max)
+        workers (int): number of worker threads, 0 for one per CPU core
     
     Returns:
         List of napari Layers containing selected MIP planes
     """
 
-    worker = mip_thread(img=img,yx=yx,zy=zy,xz=xz)
+    watch_layer(img)
+    worker = mip_thread(img=img,yx=yx,zy=zy,xz=xz,projection_type=projection_type,workers=workers)
     
     return
 
-@thread_worker(connect={"yielded": viewer.add_layer})
-def mip_thread(img:Image,yx=True,zy=False,xz=False) -> List[Layer]:
+@thread_worker(connect={"yielded": add_layer})
+def mip_thread(img:"napari.layers.Image",yx=True,zy=False,xz=False,projection_type:ProjectionType=ProjectionType.MAX,workers:int=0) -> List["napari.layers.Layer"]:
     """Generate maximum intensity projections (MIP) along selected orthoganal image planes.
+    All selected planes are computed in a single tiled pass over the volume, every tile
+    contributes to every plane, so no plane is complete before the pass ends: the layers
+    are yielded one after the other as soon as it does (right away on a cache hit),
+    rather than one per separate pass as before.
     
     Args:
         img (Image): 3D ndarray to calulate maximum intensity projection from
         xy (bool): Toggle xy plane MIP (enface plane by default)
         yz (bool): Toggle yz plane MIP
         zx (bool): Toggle zx plane MIP
+        projection_type (ProjectionType): statistic projected (max, min, mean, sum, std or argmax/depth-of-max)
+        workers (int): number of worker threads, 0 for one per CPU core
     
     Yields:
-        List of napari Layers containing selected MIP planes
+        napari Layer of each selected MIP plane, in the order yx, zy, xz
     """
 
     show_info(f'Maximum Intensity Projection thread has started')
     data = img.data
     name = img.name
     layer_type = "image"
+    projection_type = ProjectionType(projection_type)
+    prefix = PROJECTION_PREFIX[projection_type]
 
-    if yx == True:
-        mip_yx_name = f"MIP_xy_{name}"
-        yx = data.transpose(1,2,0)
-        mip_yx = yx.max(0)
-        add_kwargs = {"name": f"{mip_yx_name}"}
-        layer = Layer.create(mip_yx,add_kwargs,layer_type)
-        yield layer
-    if zy == True:
-        mip_zy_name = f"MIP_yz_{name}"
-        mip_zy = data.max(0)
-        add_kwargs = {"name": f"{mip_zy_name}"}
-        layer = Layer.create(mip_zy,add_kwargs,layer_type)
-        yield layer
-    if xz == True:
-        mip_xz_name = f"MIP_xz_{name}"
-        xz = data.transpose(1,0,2)
-        mip_xz = xz.max(2)
-        add_kwargs = {"name": f"{mip_xz_name}"}
-        layer = Layer.create(mip_xz,add_kwargs,layer_type)
+    planes = [plane for plane,selected in (("yx",yx),("zy",zy),("xz",xz)) if selected]
+    params = {"planes":planes, "projection_type":projection_type}
+    results = result_cache().get("mip", (data,), params)
+    if results is None:
+        with stage("mip", "projections", bytes_read=data.nbytes, planes=planes, projection_type=projection_type.value):
+            results = projections(data, planes=planes, stats=(projection_type,), workers=workers)
+        result_cache().put("mip", (data,), params, results, shared=True)
+    else:
+        results = detached(results)
+
+    for (plane,stat),projection in results.items():
+        add_kwargs = {"name": f"{prefix}_{PLANE_NAMES[plane]}_{name}"}
+        layer = watch_layer(create_layer(projection,add_kwargs,layer_type))
         yield layer
 
-    show_info(f'Maximum Intensity Projection thread has completed')
\ No newline at end of file
+    show_info(f'Maximum Intensity Projection thread has completed')
+
+def slab_mip(img:"napari.layers.Image",axis:int=1,memory_budget_mb:int=1024):
+    """Generate an interactive maximum intensity projection (MIP) of a slab of structural OCT data.
+    A range-max index is built once in the background, after which a docked widget selects the slab [z0, z1)
+    along axis and the projection updates in time proportional to the enface size only.
+
+    Args:
+        img (Image): 3D ndarray representing structural OCT data
+        axis (int): depth axis along which slabs are selected (1 matches the xy/enface MIP)
+        memory_budget_mb (int): memory in MB the index may use, more levels make thick slabs cheaper
+
+    Returns:
+        None, the slab MIP layer and range widget are added once the index is ready
+    """
+
+    worker = slab_mip_thread(img=img,axis=axis,memory_budget_mb=memory_budget_mb)
+    worker.returned.connect(lambda index: _add_slab_mip(img.name,index))
+    worker.start()
+
+    return
+
+@thread_worker
+def slab_mip_thread(img:"napari.layers.Image",axis:int=1,memory_budget_mb:int=1024) -> SlabMaxIndex:
+    """Build the range-max index used by slab_mip.
+
+    Args:
+        img (Image): 3D ndarray representing structural OCT data
+        axis (int): depth axis along which slabs are selected
+        memory_budget_mb (int): memory in MB the index may use
+
+    Returns:
+        SlabMaxIndex over img data along axis
+    """
+
+    show_info(f'Slab MIP index thread has started')
+    with stage("slab_mip", "index", bytes_read=img.data.nbytes) as record:
+        index = SlabMaxIndex(img.data,axis=axis,memory_budget=memory_budget_mb*2**20)
+        record.add(levels=len(index.levels), index_bytes=index.nbytes)
+    show_info(f'Slab MIP index thread has completed ({len(index.levels)} levels, {index.nbytes/2**20:.0f} MB)')
+
+    return index
+
+def _add_slab_mip(name:str,index:SlabMaxIndex):
+    """Add the slab MIP layer for index and dock the widget selecting the slab."""
+    transpose = index.ndim == 3 and any(axis == index.axis and t for axis,t in PLANES.values())
+    orient = (lambda proj: proj.T) if transpose else (lambda proj: proj)
+    length = index.length
+    viewer = get_viewer()
+
+    layer = viewer.add_image(orient(index.query(0,length)),name=f"MIP_slab_{name}")
+
+    @magicgui(auto_call=True,z0={"widget_type":"Slider","min":0,"max":length-1},z1={"widget_type":"Slider","min":1,"max":length})
+    def slab_range(z0:int=0,z1:int=length):
+        if z1 > z0:
+            layer.data = orient(index.query(z0,z1))
+            layer.name = f"MIP_slab_{z0}_{z1}_{name}"
+
+    viewer.window.add_dock_widget(slab_range,name=f"Slab MIP {name}",area="right")
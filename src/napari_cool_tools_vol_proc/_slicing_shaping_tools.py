@@ -1,26 +1,31 @@
 '''Tools for slicing and reshaping multidimensional data'''
 
+from typing import List
+
 import numpy as np
-from tqdm import tqdm
-from napari.utils.notifications import show_info, show_warning
-from napari.layers import Image, Layer
-from napari.types import LayerDataTuple
-from napari.qt.threading import thread_worker
-from napari_cool_tools_io import viewer
-
-def reshape_vol(vol:Image, new_shape:str="(-1,3,:,:)",debug:bool=False) -> Layer:
+from napari_cool_tools_vol_proc._core.chunking import Remainder, iter_chunks
+from napari_cool_tools_vol_proc._core.instrument import stage
+from napari_cool_tools_vol_proc._core.shaping import CopyRequiredError, reshape, resolve_shape_spec
+from napari_cool_tools_vol_proc._core.stacking import VirtualStack, stack_arrays_steps
+from napari_cool_tools_vol_proc._napari import add_layer, add_layers, create_layer, get_viewer, show_info, show_warning, thread_worker
+
+def reshape_vol(vol:"napari.layers.Image", new_shape:str="(-1,3,:,:)",allow_copy:bool=False,debug:bool=False) -> "napari.layers.Layer":
     """Function allowing reshaping of image data array Specifically intended for 
     reshaping OCTA data to represent individual m-scans in a separate dimension.
     Input the new data shape as a string in parenthases indicating the new dimensions
     of the volume. Use '-1' to indicate a single dimension to be autofilled. Use ':' 
-    to indicate using the current dimensions along the given axis. This function
-    is an implementation of numpy.reshape()/ndarray.reshape().
+    to indicate using the current dimensions along the given axis (aligned from the
+    right). Use products of current dimensions such as 's0*s1' to merge axes. Named
+    presets such as 'octa_mscans_3' or 'octa_merge_mscans' may be entered instead.
+    The result is a view of the volume data whenever the memory layout allows it.
 
-    To reshape an OCTA volume with integer n m-scans you would enter '-1,n,:,:'
+    To reshape an OCTA volume with integer n m-scans you would enter '(-1,n,:,:)'
+    To merge the m-scans of a 4D OCTA volume back you would enter '(-1,:,:)'
 
     Args:
         vol (Image): vol representing volumetric or image stack data
-        new_shape (string): new shape used to reshape the volume data
+        new_shape (string): new shape or preset name used to reshape the volume data
+        allow_copy (bool): Flag allowing the data to be copied when a view is not possible
 
     Returns:
         Layer volume reshaped to fit shape
@@ -29,208 +34,174 @@ def reshape_vol(vol:Image, new_shape:str="(-1,3,:,:)",debug:bool=False) -> Layer
         Will fail if total number of data points are not divisible by the dimensions of
         the new shape data.
 
-        All input must consist of charaters "():,-0123456789" or space
+        Will fail reporting the size of the copy if the volume cannot be reshaped
+        without copying and allow_copy is not set.
     """
 
-    reshape_vol_thread(vol=vol,new_shape=new_shape,debug=debug)
+    reshape_vol_thread(vol=vol,new_shape=new_shape,allow_copy=allow_copy,debug=debug)
     
     return
 
-@thread_worker(connect={"returned": viewer.add_layer})
-def reshape_vol_thread(vol:Image, new_shape:str="(-1,3,:,:)",debug:bool=False) -> Layer:
-    """Function allowing reshaping of image data array Specifically intended for 
-    reshaping OCTA data to represent individual m-scans in a separate dimension.
-    Input the new data shape as a string in parenthases indicating the new dimensions
-    of the volume. Use '-1' to indicate a single dimension to be autofilled. Use ':' 
-    to indicate using the current dimensions along the given axis. This function
-    is an implementation of numpy.reshape()/ndarray.reshape().
-
-    To reshape an OCTA volume with integer n m-scans you would enter '-1,n,:,:'
-
-    Args:
-        vol (Image): vol representing volumetric or image stack data
-        new_shape (string): new shape used to reshape the volume data
-
-    Returns:
-        Layer volume reshaped to fit shape
-
-    Errors:
-        Will fail if total number of data points are not divisible by the dimensions of
-        the new shape data.
-
-        All input must consist of charaters "():,-0123456789" or space
-    """
+@thread_worker(connect={"returned": add_layer})
+def reshape_vol_thread(vol:"napari.layers.Image", new_shape:str="(-1,3,:,:)",allow_copy:bool=False,debug:bool=False) -> "napari.layers.Layer":
+    """Thread running reshape_vol_func."""
 
     show_info(f'Reshape volume thread has started')
-    layer = reshape_vol_func(vol=vol,new_shape=new_shape,debug=debug)
+    layer = reshape_vol_func(vol=vol,new_shape=new_shape,allow_copy=allow_copy,debug=debug)
     show_info(f'Reshape volume thread has completed')
 
     return layer
 
-def reshape_vol_func(vol:Image, new_shape:str="(-1,3,:,:)",debug:bool=False) -> Layer:
-    """Function allowing reshaping of image data array Specifically intended for 
-    reshaping OCTA data to represent individual m-scans in a separate dimension.
-    Input the new data shape as a string in parenthases indicating the new dimensions
-    of the volume. Use '-1' to indicate a single dimension to be autofilled. Use ':' 
-    to indicate using the current dimensions along the given axis. This function
-    is an implementation of numpy.reshape()/ndarray.reshape().
-
-    To reshape an OCTA volume with integer n m-scans you would enter '-1,n,:,:'
-
-    Args:
-        vol (Image): vol representing volumetric or image stack data
-        new_shape (string): new shape used to reshape the volume data
-
-    Returns:
-        Layer volume reshaped to fit shape
+def reshape_vol_func(vol:"napari.layers.Image", new_shape:str="(-1,3,:,:)",allow_copy:bool=False,debug:bool=False) -> "napari.layers.Layer":
+    """Layer of vol reshaped to new_shape, a view of the data unless a copy is needed and allowed, see reshape_vol.
 
     Errors:
-        Will fail if total number of data points are not divisible by the dimensions of
-        the new shape data.
-
-        All input must consist of charaters "():,-0123456789" or space
+        CopyRequiredError (a ValueError) when the reshape needs a copy and allow_copy is not set
     """
+
     data = vol.data
-    shape = data.shape
+    out_shape = resolve_shape_spec(new_shape, tuple(data.shape))
     if debug:
-        show_info(f"New shape: {new_shape} of type {type(new_shape)}\n")
+        show_info(f"New shape: {new_shape} resolved to {out_shape} from {data.shape}\n")
     else:
         pass
 
-    new_shape = new_shape.strip()
-    new_shape = new_shape.replace(" ","")
-    if new_shape.startswith('(') and new_shape.endswith(')'):
-        new_shape = new_shape.strip("()")
-        new_dims = new_shape.split(",")
-
-        if debug:
-            show_info(f"New dimensions: {new_dims}\n")
-        else:
-            pass
-
-    else:
-        show_info("Invalid input for reshape_vol function.\nInput should be comma separated list of +integers, -1, or ':'s spaces are allowed.'")
-
-    out_shape = []
-    # case new shape longer than old shape
-    if len(new_dims) > len(shape):
-        # traverse existing shape and input existing values for any : found
-        for i in range(len(new_dims)):
-            j = (i+1)*-1
-            #print(i,j)
-            if i < len(shape):
-                if new_dims[j] == ':':
-                    out_shape.append(shape[j])
-                else:
-                    out_shape.append(int(new_dims[j]))
-            else:
-                out_shape.append(int(new_dims[j]))
-
-        #show_info(f"outshape: {out_shape}\nout shape flip: {out_shape[::-1]}\n")
-        out_shape = out_shape[::-1]
-
-    # case new shape shorter than old shape
-    elif len(shape) > len(new_dims):
-        show_info(f"Not Yet Implemented")
-    # case new shape same length as old shape
-    else:
-        show_info(f"Not Yet Implemented")
-    
-    reshaped = data.reshape(out_shape)
+    try:
+        with stage("reshape_vol", "reshape_view"):
+            reshaped = reshape(data, new_shape)
+    except CopyRequiredError as error:
+        if not allow_copy:
+            raise CopyRequiredError(f"{vol.name}: {error}, enable allow_copy to proceed") from None
+        show_warning(f"Reshaping {vol.name} to {out_shape} copies {data.nbytes / 2**30:.2f} GB\n")
+        with stage("reshape_vol", "copy", bytes_read=data.nbytes):
+            reshaped = reshape(data, new_shape, allow_copy=True)
 
     name = f"{vol.name}_RS"
     add_kwargs = {"name":name}
     layer_type = "image"
-    layer = Layer.create(reshaped,add_kwargs,layer_type)
+    layer = create_layer(reshaped,add_kwargs,layer_type)
 
     return layer
 
-def split_vol(vol:Image, subvolumes:int=3, axis:int=1, debug:bool=False) -> LayerDataTuple:
+def split_vol(vol:"napari.layers.Image", subvolumes:int=3, axis:int=1, halo:int=0, remainder:Remainder=Remainder.DROP, debug:bool=False):
     """Function splits volumes into subvolumes along the specified axis
 
     Args:
         vol (Image): vol representing volumetric or image stack data
         subvolumes (int): number of subvolumes to split manin volume into
         axis (int): axis along which to split the volume into subvolumes
+        halo (int): number of neighbouring slices included on both sides of each subvolume
+        remainder (Remainder): handling of the slices left over when axis is not divisible by subvolumes,
+            dropped, merged into the last subvolume, added as an extra subvolume or spread over the subvolumes
 
     Returns:
-        Subvolumes # Layers containing the subvolume layer data
+        Subvolumes # Layers containing the subvolume layer data, views of the volume data
+    """
+    split_vol_thread(vol=vol,subvolumes=subvolumes,axis=axis,halo=halo,remainder=remainder,debug=debug)
+
+    return
+
+@thread_worker(connect={"returned": add_layers}, progress={"desc": "Splitting volume"})
+def split_vol_thread(vol:"napari.layers.Image", subvolumes:int=3, axis:int=1, halo:int=0, remainder:Remainder=Remainder.DROP, debug:bool=False) -> List["napari.layers.Layer"]:
+    """Thread running split_vol_func and returning the subvolume layers once every subvolume is split."""
+    show_info(f'Split volume thread has started')
+    layers = yield from split_vol_func(vol=vol,subvolumes=subvolumes,axis=axis,halo=halo,remainder=remainder,debug=debug)
+    show_info(f'Split volume thread has completed')
+
+    return layers
+
+def split_vol_func(vol:"napari.layers.Image", subvolumes:int=3, axis:int=1, halo:int=0, remainder:Remainder=Remainder.DROP, debug:bool=False) -> List["napari.layers.Layer"]:
+    """Function splits volumes into subvolumes along the specified axis
+
+    Args:
+        vol (Image): vol representing volumetric or image stack data
+        subvolumes (int): number of subvolumes to split manin volume into
+        axis (int): axis along which to split the volume into subvolumes
+        halo (int): number of neighbouring slices included on both sides of each subvolume
+        remainder (Remainder): handling of the slices left over when axis is not divisible by subvolumes,
+            dropped, merged into the last subvolume, added as an extra subvolume or spread over the subvolumes
+
+    Yields:
+        (done, total) progress after every subvolume
+
+    Returns:
+        Subvolumes # Layers containing the subvolume layer data, views of the volume data
     """
 
     data = vol.data
-    shape = data.shape
     layers_out = []
 
     # calc step
     i_step = int(data.shape[axis]/subvolumes)
+    left = data.shape[axis] - (subvolumes*i_step)
 
     # check that volume along axis is divisible by subvolumes
-    if data.shape[axis]%subvolumes == 0:
+    if left == 0:
         show_info(f"Axis {axis} is divisble by {subvolumes}\nAxis {axis} will be split into {subvolumes} x {i_step} chunks.")
-    else:            
-        show_warning(f"Axis {axis} is not divisble by {subvolumes}\nAxis {axis} will be split into {subvolumes} x {i_step} chunks.\n{data.shape[axis] - (subvolumes*i_step)} units along this dimenison will be lost\n")
-
-    for i in range(subvolumes):
-
-        # calc indicies
-        i_start = (i*i_step)*(1-0**(i_step-1))+i
-
-        # get slices
-        slices = []
+    elif remainder == Remainder.DROP:
+        show_warning(f"Axis {axis} is not divisble by {subvolumes}\nAxis {axis} will be split into {subvolumes} x {i_step} chunks.\n{left} units along this dimenison will be lost\n")
+    else:
+        show_info(f"Axis {axis} is not divisble by {subvolumes}\nThe {left} remaining units along this dimension will be handled by {remainder.value}.")
 
-        for j in range(len(shape)):
-            if j == axis:
-                slices.append(slice(i_start,i_start+i_step))
-            else:
-                slices.append(slice(0,shape[j],1))
+    chunks = list(iter_chunks(data, subvolumes, axis=axis, halo=halo, remainder=remainder))
+    for chunk in chunks:
 
         if debug:
-            show_info(f"slices: {slices}\n")
-            show_info(f"Subvolume shape: {data[tuple(slices)].shape}\n")
+            show_info(f"core: {chunk.core}, padded: {chunk.padded}\n")
+            show_info(f"Subvolume shape: {chunk.data.shape}\n")
         else:
             pass
-        #print(f"data: {data[tuple(slices)]}\n")
 
-        name = f"{vol.name}_{i}"
-        #name = {i}
+        name = f"{vol.name}_{chunk.index}"
         add_kwargs = {"name":name}
         layer_type = "image"
-        out = data[tuple(slices)].squeeze() # squeeze to eliminate axis eliminated by process
-        #layer = Layer.create(data[tuple(slices)],add_kwargs,layer_type)
-        layer_data_tuple = (out,add_kwargs,layer_type)
-
-        #layers_out.append(layer)
-        layers_out.append(layer_data_tuple)
+        out = chunk.data
+        if out.shape[axis] == 1:
+            out = out.squeeze(axis=axis) # only eliminate the split axis when single slices are split off
+        layers_out.append(create_layer(out,add_kwargs,layer_type))
+        yield chunk.index + 1, len(chunks)
     
     return layers_out
 
-def stack_selected(name:str='stacked_layers', axis:int=0, debug:bool=False)->Layer:
-    """"""
-    current_selection = list(viewer.layers.selection)
+def stack_selected(name:str='stacked_layers', axis:int=0, virtual:bool=False, pad:bool=False, debug:bool=False):
+    """Function stacking the data of the selected layers (sorted by name) along a new axis.
+
+    Args:
+        name (str): name of the output layer
+        axis (int): position of the new stack axis
+        virtual (bool): Flag indicating that the output is a lazy stack backed by the selected layer data
+            instead of a copy, use materialize_stack to turn it into a contiguous array later
+        pad (bool): Flag indicating that layers of different shapes are zero padded to the common shape
+
+    Returns:
+        Layer containing the stacked data
+    """
+    current_selection = list(get_viewer().layers.selection)
     current_selection.sort(key=lambda x: x.name)
     data_stack = []
     
     for layer in current_selection:
         data_stack.append(layer.data)
 
-    out_data = np.stack(data_stack,axis)
     name = f"{name}_axis_{axis}"
-    add_kwargs = {"name": f"{name}"}
     layer_type = current_selection[0].as_layer_data_tuple()[2]
-    layer = Layer.create(out_data,add_kwargs,layer_type)
-    
-    return layer
+    stack_thread(data_stack,name=name,layer_type=layer_type,axis=axis,virtual=virtual,pad=pad,debug=debug,command="stack_selected")
 
-def stack_selected_2D(name:str='stacked_layers') -> Layer:
-    """"""
-    # optional kwargs for viewer.add_* method
-    add_kwargs = {"name": f"{name}"}
+    return
 
+def stack_selected_2D(name:str='stacked_layers', virtual:bool=False, pad:bool=False):
+    """Function stacking the squeezed data of the selected layers (sorted by name) along a new first axis.
 
-    # optional layer type argument
-    layer_type = "image"
+    Args:
+        name (str): name of the output layer
+        virtual (bool): Flag indicating that the output is a lazy stack backed by the selected layer data
+            instead of a copy, use materialize_stack to turn it into a contiguous array later
+        pad (bool): Flag indicating that layers of different shapes are zero padded to the common shape
 
-    sel = list(viewer.layers.selection)
+    Returns:
+        Layer containing the stacked data
+    """
+    sel = list(get_viewer().layers.selection)
     sel.sort(key=lambda x: x.name)
     sel_layer_types_res = map(lambda x: x.as_layer_data_tuple()[2],sel)
     sel_layer_types = list(sel_layer_types_res)
@@ -239,9 +210,75 @@ def stack_selected_2D(name:str='stacked_layers') -> Layer:
     if len(set_types) == 1:
         sel_data_res = map(lambda x: x.data.squeeze(), sel)
         sel_data = list(sel_data_res)
-        new_data = np.stack(sel_data,axis=0)
         layer_type = set_types.pop()
-        layer = Layer.create(new_data,add_kwargs,layer_type)
-        return layer
+        stack_thread(sel_data,name=name,layer_type=layer_type,axis=0,virtual=virtual,pad=pad,command="stack_selected_2D")
+        return
     else:
-        raise Exception("Something's Wrong!! Fixit !!")   
\ No newline at end of file
+        raise Exception("Something's Wrong!! Fixit !!")
+
+@thread_worker(connect={"returned": add_layer}, progress={"desc": "Stacking layers"})
+def stack_thread(arrays:List, name:str='stacked_layers', layer_type:str="image", axis:int=0, virtual:bool=False, pad:bool=False, debug:bool=False, command:str="stack_selected") -> "napari.layers.Layer":
+    """Thread running stack_func on layer data gathered from the selection on the GUI thread."""
+    show_info(f'Stack layers thread has started')
+    layer = yield from stack_func(arrays,name=name,layer_type=layer_type,axis=axis,virtual=virtual,pad=pad,debug=debug,command=command)
+    show_info(f'Stack layers thread has completed')
+
+    return layer
+
+def stack_func(arrays:List, name:str='stacked_layers', layer_type:str="image", axis:int=0, virtual:bool=False, pad:bool=False, debug:bool=False, command:str="stack_selected") -> "napari.layers.Layer":
+    """Function stacking arrays along a new axis into a layer.
+
+    Args:
+        arrays (List): layer data to stack, in stacking order
+        name (str): name of the output layer
+        layer_type (str): type of the output layer
+        axis (int): position of the new stack axis
+        virtual (bool): Flag indicating that the output is a lazy stack backed by arrays instead of a copy
+        pad (bool): Flag indicating that arrays of different shapes are zero padded to the common shape
+        command (str): command name the stacking is instrumented under
+
+    Yields:
+        (done, total) progress after every copied array
+
+    Returns:
+        Layer containing the stacked data
+    """
+    with stage(command, "stack", virtual=virtual):
+        out_data = yield from stack_arrays_steps(arrays, axis, virtual=virtual, pad=pad)
+    if debug:
+        show_info(f"Stacked {len(arrays)} layers into {out_data.shape} ({'virtual' if virtual else 'copy'})\n")
+    add_kwargs = {"name": f"{name}"}
+    layer = create_layer(out_data,add_kwargs,layer_type)
+    
+    return layer
+
+def materialize_stack(layer:"napari.layers.Layer"):
+    """Function copying the lazy stack of a virtually stacked layer into a contiguous array.
+
+    Args:
+        layer (Layer): layer created by stack_selected or stack_selected_2D with virtual set
+
+    Returns:
+        Layer containing the stacked data as a contiguous array
+    """
+    data = layer.data
+    if not isinstance(data, VirtualStack):
+        show_info(f"{layer.name} is not a virtual stack, its data is already materialized")
+        return
+
+    materialize_stack_thread(layer)
+
+    return
+
+@thread_worker(connect={"returned": add_layer}, progress={"desc": "Materializing stack"})
+def materialize_stack_thread(layer:"napari.layers.Layer") -> "napari.layers.Layer":
+    """Thread copying the virtual stack of layer into a contiguous array layer, one member at a time."""
+    data = layer.data
+    name = f"{layer.name}_mat"
+    add_kwargs = {"name":name}
+    layer_type = layer.as_layer_data_tuple()[2]
+    with stage("materialize_stack", "materialize", bytes_read=data.nbytes):
+        out = yield from data.materialize_steps()
+    layer = create_layer(out,add_kwargs,layer_type)
+
+    return layer
@@ -0,0 +1,66 @@
+"""
+This module contains code for reading volumes from and writing them to memory-mapped or chunked on-disk storage
+"""
+from pathlib import Path
+
+from napari_cool_tools_vol_proc._core.instrument import stage
+from napari_cool_tools_vol_proc._core.storage import OutputStore, configure_store, open_store, save_store_steps
+from napari_cool_tools_vol_proc._napari import add_layer, create_layer, show_info, thread_worker
+
+def open_stored_volume(path:str, layer_type:str="image"):
+    """Add a layer backed by a .npy file (memory map) or a .chunks directory without loading it into RAM.
+
+    Args:
+        path (str): .npy file or .chunks directory
+        layer_type (str): "image" or "labels"
+    """
+    path = Path(path)
+    data = open_store(path, mode="r")
+    layer = create_layer(data,{"name":path.stem},layer_type)
+    add_layer(layer)
+
+    return
+
+def save_layer_to_store(layer:"napari.layers.Layer", path:str, compression:int=1):
+    """Write the data of layer to a .npy file, or to a compressed .chunks directory when path ends with .chunks.
+
+    Args:
+        layer (Layer): layer whose data is written
+        path (str): .npy file or .chunks directory to create
+        compression (int): zlib level of .chunks directories from 1 (fast) to 9 (small), 0 for none
+    """
+    save_layer_to_store_thread(layer=layer,path=path,compression=compression)
+
+    return
+
+@thread_worker(start_thread=True, progress={"desc": "Saving layer"})
+def save_layer_to_store_thread(layer:"napari.layers.Layer", path:str, compression:int=1):
+    """Thread copying the data of layer to path tile by tile."""
+    show_info(f"Save layer thread has started")
+    data = layer.data
+    with stage("save_layer_to_store", "save", bytes_read=data.nbytes):
+        yield from save_store_steps(data, path, compression=compression)
+    show_info(f"Saved {layer.name} to {path}")
+
+def configure_output_store(directory:str="", chunked:bool=False, compression:int=1, min_mb:int=64):
+    """Allocate the outputs of the averaging, angiography, masking and stacking commands on disk.
+
+    Outputs are created in directory with their final shape and dtype and filled
+    tile by tile, so results larger than RAM can be produced and displayed. An
+    output is deleted when the last layer showing it is removed from the viewer,
+    save it with save_layer_to_store first to keep it.
+
+    Args:
+        directory (str): directory outputs are written to, empty to keep outputs in RAM
+        chunked (bool): Flag indicating that outputs are compressed .chunks directories instead of .npy memory maps
+        compression (int): zlib level of .chunks outputs from 1 (fast) to 9 (small), 0 for none
+        min_mb (int): outputs smaller than this many MB stay in RAM
+    """
+    directory = directory.strip()
+    store = OutputStore(directory, chunked, compression, min_mb * 2**20) if directory else None
+    configure_store(store)
+
+    if store is None:
+        show_info(f"Outputs are kept in RAM")
+    else:
+        show_info(f"Outputs of at least {min_mb} MB are written to {directory} as {'.chunks directories' if chunked else '.npy memory maps'}")
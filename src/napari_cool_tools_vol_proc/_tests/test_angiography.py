@@ -0,0 +1,67 @@
+"""
+Tests of the angiography flow kernels against plain numpy references.
+"""
+import numpy as np
+import pytest
+
+from napari_cool_tools_vol_proc._core.angiography import FlowMethod, flow_volume, group_mscans
+from napari_cool_tools_vol_proc._core.storage import ChunkedArray
+
+
+def _decorrelation_reference(grouped):
+    grouped = grouped.astype(np.float64)
+    a, b = grouped[:, :-1], grouped[:, 1:]
+    energy = 0.5 * (a * a + b * b)
+    ratio = np.divide(a * b, energy, out=np.ones_like(energy), where=energy > 0)
+    return 1 - ratio.mean(axis=1)
+
+
+@pytest.mark.parametrize("workers", [1, 3])
+def test_decorrelation_matches_reference(workers):
+    data = np.random.default_rng(0).random((12, 5, 4)).astype(np.float32)
+    data[3:6, 0, 0] = 0
+    result = flow_volume(data, mscans=3, chunk_bytes=1, workers=workers)
+    assert result.dtype == np.float32 and result.shape == (4, 5, 4)
+    np.testing.assert_allclose(result, _decorrelation_reference(data.reshape(4, 3, 5, 4)), rtol=1e-5, atol=1e-6)
+    assert result[1, 0, 0] == 0
+
+
+@pytest.mark.parametrize("workers", [1, 3])
+def test_speckle_variance_matches_reference(workers):
+    data = np.random.default_rng(1).integers(0, 500, (4, 4, 3, 6)).astype(np.uint16)
+    result = flow_volume(data, method=FlowMethod.SPECKLE_VARIANCE, chunk_bytes=1, workers=workers)
+    np.testing.assert_allclose(result, data.astype(np.float64).var(axis=1), rtol=1e-5)
+
+
+def test_flow_of_non_contiguous_4d_input_and_single_position():
+    data = np.random.default_rng(2).random((1, 6, 2, 8))[:, ::2]
+    result = flow_volume(data, method=FlowMethod.SPECKLE_VARIANCE)
+    np.testing.assert_allclose(result, data.var(axis=1), rtol=1e-5)
+
+
+def test_flow_of_chunked_and_non_contiguous_3d_input(tmp_path):
+    data = np.random.default_rng(4).random((9, 3, 4)).astype(np.float32)
+    chunked = ChunkedArray.create(tmp_path / "vol.chunks", data.shape, data.dtype, chunk_len=2)
+    chunked[:] = data
+    expected = _decorrelation_reference(data.reshape(3, 3, 3, 4))
+    np.testing.assert_allclose(flow_volume(chunked, mscans=3, chunk_bytes=1, workers=2), expected, rtol=1e-5, atol=1e-6)
+    strided = np.asfortranarray(data)
+    np.testing.assert_allclose(flow_volume(strided, mscans=3), expected, rtol=1e-5, atol=1e-6)
+
+
+def test_flow_writes_into_out():
+    data = np.random.default_rng(3).random((6, 2, 2))
+    out = np.empty((3, 2, 2), dtype=np.float64)
+    assert flow_volume(data, mscans=2, out=out) is out
+    np.testing.assert_allclose(out, _decorrelation_reference(data.reshape(3, 2, 2, 2)), rtol=1e-5, atol=1e-6)
+
+
+def test_group_mscans_is_a_view():
+    data = np.zeros((6, 2, 2))
+    assert np.shares_memory(group_mscans(data, 3), data)
+
+
+@pytest.mark.parametrize("shape, mscans", [((7, 2, 2), 3), ((6, 2, 2), 1), ((6, 2, 2), None), ((6, 2), 2)])
+def test_group_mscans_rejects_bad_groups(shape, mscans):
+    with pytest.raises(ValueError):
+        group_mscans(np.zeros(shape), mscans)
@@ -0,0 +1,144 @@
+"""
+Tests of the averaging kernels against plain numpy references.
+"""
+import numpy as np
+import pytest
+
+from napari_cool_tools_vol_proc._core.averaging import EdgeMode, Precision, block_mean, block_mean_shape, precision_dtypes, rounded_mean, sliding_mean, sliding_mean_shape
+from napari_cool_tools_vol_proc._core.tiling import axis_index
+
+
+def _sliding_reference(data, window, axis, edge_mode):
+    # sliding average built from padded copies of data
+    half = window // 2
+    moved = np.moveaxis(np.asarray(data, dtype=np.float64), axis, 0)
+    length = len(moved)
+    if edge_mode == EdgeMode.SHRINK:
+        out = np.stack([moved[max(0, i - half):i + half + 1].mean(0) for i in range(length)])
+    else:
+        pad = {EdgeMode.REFLECT: "reflect", EdgeMode.NEAREST: "edge"}.get(edge_mode)
+        padded = np.pad(moved, [(half, half)] + [(0, 0)] * (moved.ndim - 1), mode=pad) if pad else moved
+        out = np.lib.stride_tricks.sliding_window_view(padded, window, axis=0).mean(-1)
+        if edge_mode == EdgeMode.COPY:
+            out = np.concatenate([moved[:half], out, moved[length - half:]])
+    return np.moveaxis(out, 0, axis)
+
+
+@pytest.mark.parametrize("edge_mode", list(EdgeMode))
+@pytest.mark.parametrize("axis", [0, 1, 2])
+@pytest.mark.parametrize("workers", [1, 3])
+def test_sliding_mean_matches_reference(edge_mode, axis, workers):
+    data = np.random.default_rng(0).integers(0, 1000, (7, 6, 5)).astype(np.uint16)
+    result = sliding_mean(data, 5, axis=axis, edge_mode=edge_mode, workers=workers)
+    assert result.shape == sliding_mean_shape(data.shape, 5, axis, edge_mode)
+    assert result.dtype == np.float64
+    np.testing.assert_allclose(result, _sliding_reference(data, 5, axis, edge_mode))
+
+
+def test_sliding_mean_of_non_contiguous_input():
+    data = np.random.default_rng(1).random((6, 9, 4)).transpose(2, 0, 1)[:, ::2]
+    np.testing.assert_allclose(sliding_mean(data, 3, axis=1, workers=2), _sliding_reference(data, 3, 1, EdgeMode.TRIM))
+
+
+@pytest.mark.parametrize("shape, window", [((1, 4, 1), 1), ((3, 1, 1), 3), ((5, 1, 7), 3)])
+def test_sliding_mean_of_length_one_axes(shape, window):
+    data = np.arange(np.prod(shape), dtype=np.float32).reshape(shape)
+    for edge_mode in (EdgeMode.TRIM, EdgeMode.SHRINK, EdgeMode.NEAREST):
+        np.testing.assert_allclose(sliding_mean(data, window, edge_mode=edge_mode), _sliding_reference(data, window, 0, edge_mode))
+
+
+@pytest.mark.filterwarnings("ignore:invalid value:RuntimeWarning")
+@pytest.mark.parametrize("bad", [np.nan, np.inf])
+@pytest.mark.parametrize("edge_mode", [EdgeMode.TRIM, EdgeMode.SHRINK, EdgeMode.REFLECT])
+@pytest.mark.parametrize("axis", [0, 2])
+def test_non_finite_slice_only_affects_its_windows(bad, edge_mode, axis):
+    data = np.random.default_rng(8).random((9, 4, 9)).astype(np.float32)
+    data[axis_index(3, axis, 4)] = bad
+    data[axis_index(3, axis, 5)][0, 0] = -np.inf
+    result = sliding_mean(data, 3, axis=axis, edge_mode=edge_mode, workers=2)
+    expected = _sliding_reference(data, 3, axis, edge_mode)
+    np.testing.assert_allclose(result, expected)
+    assert np.isfinite(np.take(result, [0, 1], axis)).all() and np.isfinite(np.take(result, [-1], axis)).all()
+
+
+def test_sliding_mean_writes_into_out():
+    data = np.random.default_rng(2).random((5, 3, 3))
+    out = np.empty((3, 3, 3))
+    assert sliding_mean(data, 3, out=out) is out
+    with pytest.raises(ValueError):
+        sliding_mean(data, 3, out=np.empty((5, 3, 3)))
+
+
+@pytest.mark.parametrize("window, edge_mode", [(2, EdgeMode.TRIM), (0, EdgeMode.TRIM), (7, EdgeMode.TRIM), (11, EdgeMode.REFLECT)])
+def test_sliding_mean_rejects_bad_windows(window, edge_mode):
+    with pytest.raises(ValueError):
+        sliding_mean(np.zeros((5, 2, 2)), window, edge_mode=edge_mode)
+
+
+def _block_reference(data, block, axis):
+    moved = np.moveaxis(np.asarray(data, dtype=np.float64), axis, 0)
+    out = np.stack([moved[start:start + block].mean(0) for start in range(0, len(moved), block)])
+    return np.moveaxis(out, 0, axis)
+
+
+@pytest.mark.parametrize("block", [1, 2, 3, 7, 9])
+@pytest.mark.parametrize("axis", [0, 1, 2])
+@pytest.mark.parametrize("chunk_bytes", [1, 2**20])
+def test_block_mean_matches_reference(block, axis, chunk_bytes):
+    data = np.random.default_rng(3).integers(0, 1000, (7, 6, 5)).astype(np.int32)
+    result = block_mean(data, block, axis=axis, chunk_bytes=chunk_bytes, workers=3)
+    assert result.shape == block_mean_shape(data.shape, block, axis) and result.dtype == np.float64
+    np.testing.assert_allclose(result, _block_reference(data, block, axis))
+
+
+def test_block_mean_of_non_contiguous_and_length_one_input():
+    data = np.random.default_rng(4).random((5, 8, 3)).transpose(1, 2, 0)[::3]
+    np.testing.assert_allclose(block_mean(data, 2, axis=2), _block_reference(data, 2, 2))
+    single = np.random.default_rng(5).random((1, 1, 4))
+    np.testing.assert_allclose(block_mean(single, 3), single)
+
+
+def test_block_mean_writes_into_memmap(tmp_path):
+    data = np.random.default_rng(6).random((6, 2, 3))
+    out = np.lib.format.open_memmap(tmp_path / "avg.npy", mode="w+", dtype=np.float64, shape=(2, 2, 3))
+    assert block_mean(data, 3, out=out, chunk_bytes=1) is out
+    np.testing.assert_allclose(np.load(tmp_path / "avg.npy"), _block_reference(data, 3, 0))
+    with pytest.raises(ValueError):
+        block_mean(data, 0)
+
+
+@pytest.mark.parametrize("dtype, precision, expected", [
+    (np.uint16, Precision.FLOAT64, (np.float64, np.float64)),
+    (np.float32, Precision.FLOAT64, (np.float64, np.float32)),
+    (np.uint16, Precision.FLOAT32, (np.float32, np.float32)),
+    (np.uint8, Precision.FLOAT16, (np.float32, np.float16)),
+    (np.int16, Precision.INTEGER, (np.int64, np.int16)),
+    (np.uint64, Precision.INTEGER, (np.uint64, np.uint64)),
+])
+def test_precision_dtypes(dtype, precision, expected):
+    assert precision_dtypes(dtype, precision) == tuple(np.dtype(d) for d in expected)
+
+
+@pytest.mark.parametrize("precision", list(Precision))
+def test_precisions_match_reference(precision):
+    data = np.random.default_rng(7).integers(-300, 300, (9, 4, 5)).astype(np.int16)
+    _, out_dtype = precision_dtypes(data.dtype, precision)
+    block = block_mean(data, 2, precision=precision)
+    sliding = sliding_mean(data, 3, edge_mode=EdgeMode.SHRINK, precision=precision)
+    references = (_block_reference(data, 2, 0), _sliding_reference(data, 3, 0, EdgeMode.SHRINK))
+    for result, reference in zip((block, sliding), references):
+        assert result.dtype == out_dtype
+        if precision == Precision.INTEGER:
+            # round half up, also for negative means
+            np.testing.assert_array_equal(result, np.floor(reference + 0.5))
+        else:
+            np.testing.assert_allclose(result, reference, rtol=1e-3 if precision == Precision.FLOAT16 else 1e-6)
+
+
+def test_rounded_mean_rounds_half_up():
+    np.testing.assert_array_equal(rounded_mean(np.array([-3, -1, 1, 3, 5]), 2), [-1, 0, 1, 2, 3])
+
+
+def test_integer_precision_needs_integer_data():
+    with pytest.raises(ValueError):
+        block_mean(np.zeros((2, 2, 2)), 2, precision=Precision.INTEGER)
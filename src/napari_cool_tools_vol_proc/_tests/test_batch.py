@@ -0,0 +1,90 @@
+"""
+Tests of the headless batch runner against plain numpy references.
+"""
+import json
+
+import numpy as np
+import pytest
+
+from napari_cool_tools_vol_proc._batch import find_volumes, load_pipeline, main, run_batch, run_volume
+from napari_cool_tools_vol_proc._core.projection import PLANES
+from napari_cool_tools_vol_proc._core.storage import open_store, save_store
+
+PIPELINE = [
+    {"op": "average_bscans", "scans_per_avg": 2, "save": True},
+    {"op": "mip", "planes": ["yx", "zy"]},
+]
+
+
+def _expected(data):
+    # results of PIPELINE by suffix
+    averaged = data.reshape(-1, 2, *data.shape[1:]).mean(1)
+    expected = {"avg_2": averaged}
+    for plane in ("yx", "zy"):
+        axis, transpose = PLANES[plane]
+        mip = averaged.max(axis)
+        expected[f"avg_2_maxip_{plane}"] = mip.T if transpose else mip
+    return expected
+
+
+def test_load_pipeline_from_json_and_validation(tmp_path):
+    path = tmp_path / "pipeline.json"
+    path.write_text(json.dumps(PIPELINE))
+    assert load_pipeline(path) == PIPELINE
+    assert load_pipeline(json.dumps(PIPELINE)) == PIPELINE
+    with pytest.raises(ValueError, match="unknown operation"):
+        load_pipeline([{"op": "nope"}])
+    with pytest.raises(ValueError, match="unknown parameters"):
+        load_pipeline([{"op": "mip", "axis": 0}])
+
+
+def test_find_volumes_pairs_labels_and_shards(tmp_path):
+    for name in ("a", "b", "c", "a_labels"):
+        np.save(tmp_path / f"{name}.npy", np.zeros((2, 2, 2)))
+    save_store(np.zeros((2, 2, 2)), tmp_path / "b_labels.chunks")
+    (tmp_path / "notes.txt").write_text("")
+    pairs = find_volumes(tmp_path)
+    assert [(p.name, l.name if l else None) for p, l in pairs] == [("a.npy", "a_labels.npy"), ("b.npy", "b_labels.chunks"), ("c.npy", None)]
+    assert [p.name for p, _ in find_volumes(tmp_path, shard=(1, 2))] == ["b.npy"]
+    with pytest.raises(ValueError):
+        find_volumes(tmp_path, shard=(2, 2))
+
+
+@pytest.mark.parametrize("output_format", ["npy", "chunks"])
+def test_run_volume_matches_reference(tmp_path, output_format):
+    data = np.random.default_rng(0).integers(0, 100, (6, 3, 4)).astype(np.uint16)
+    np.save(tmp_path / "vol.npy", np.asfortranarray(data))
+    written = run_volume(tmp_path / "vol.npy", load_pipeline(PIPELINE), tmp_path / "out", output_format=output_format)
+    suffix = ".chunks" if output_format == "chunks" else ".npy"
+    expected = _expected(data)
+    assert sorted(written) == sorted(str(tmp_path / "out" / f"vol_{name}{suffix}") for name in expected)
+    for name, reference in expected.items():
+        np.testing.assert_allclose(np.asarray(open_store(tmp_path / "out" / f"vol_{name}{suffix}")), reference)
+    assert sorted(p.name for p in (tmp_path / "out").iterdir()) == sorted(f"vol_{name}{suffix}" for name in expected)
+
+
+def test_run_volume_with_labels_and_statistics(tmp_path):
+    labels = np.zeros((3, 4, 1), dtype=np.uint8)
+    labels[1:, 1:3] = 2
+    np.save(tmp_path / "vol.npy", labels)
+    written = run_volume(tmp_path / "vol.npy", [{"op": "label_volumes", "scale": [1, 1, 0.5]}], tmp_path)
+    assert json.loads((tmp_path / "vol_label_volumes.json").read_text()) == {"2": {"voxels": 4, "volume_mm3": 2.0}}
+    assert written == [str(tmp_path / "vol_label_volumes.json")]
+    with pytest.raises(ValueError, match="needs a label volume"):
+        run_volume(tmp_path / "vol.npy", [{"op": "isolate_labels"}], tmp_path)
+
+
+def test_run_batch_reports_failing_volumes(tmp_path):
+    inputs = tmp_path / "in"
+    inputs.mkdir()
+    data = np.random.default_rng(1).random((4, 2, 3))
+    np.save(inputs / "good.npy", data)
+    np.save(inputs / "bad.npy", np.zeros((4, 2)))
+    outcomes = run_batch(PIPELINE, inputs, tmp_path / "out", processes=1)
+    assert isinstance(outcomes[str(inputs / "bad.npy")], str)
+    assert len(outcomes[str(inputs / "good.npy")]) == 3
+    np.testing.assert_allclose(np.load(tmp_path / "out" / "good_avg_2_maxip_yx.npy"), _expected(data)["avg_2_maxip_yx"])
+    pipeline = tmp_path / "pipeline.json"
+    pipeline.write_text(json.dumps(PIPELINE))
+    assert main([str(pipeline), str(inputs), str(tmp_path / "cli"), "--processes", "1", "--pattern", "good*"]) == 0
+    assert main([str(pipeline), str(inputs), str(tmp_path / "cli"), "--processes", "1"]) == 1
@@ -0,0 +1,112 @@
+"""
+Tests of the result cache.
+"""
+import gc
+
+import numpy as np
+import pytest
+
+from napari_cool_tools_vol_proc._core.cache import ResultCache, detached, fingerprint, result_nbytes, writable
+from napari_cool_tools_vol_proc._core.storage import ChunkedArray
+
+
+def test_hit_returns_read_only_result_and_writable_copies():
+    cache = ResultCache(2**20)
+    source = np.arange(12.0).reshape(3, 4)
+    result = cache.put("mean", (source,), {"axis": 0}, source.mean(0))
+    assert cache.get("mean", (source,), {"axis": 0}) is result
+    assert cache.get("mean", (source,), {"axis": 1}) is None
+    with pytest.raises(ValueError):
+        result[0] = 1
+    copy = writable({"plane": result})["plane"]
+    copy[0] = -1
+    assert copy.flags.writeable and cache.get("mean", (source,), {"axis": 0})[0] == 4.0
+
+
+def test_shared_results_stay_writable_until_edited():
+    cache = ResultCache(2**20)
+    source = np.arange(12.0).reshape(3, 4)
+    result = source.mean(0)
+    assert cache.put("mean", (source,), {}, result, shared=True) is result
+    assert result.flags.writeable
+    hit = cache.get("mean", (source,), {})
+    assert hit is result
+    copy = detached({"plane": hit})["plane"]
+    assert copy is not result and np.array_equal(copy, result)
+    result[0] = -1
+    assert cache.get("mean", (source,), {}) is None
+
+    cache.put("mean", (source,), {}, result, shared=True)
+    cache.invalidate_result(result)
+    assert len(cache) == 0 and cache.nbytes == 0
+
+
+def test_shared_results_are_spilled_as_frozen_copies(tmp_path):
+    cache = ResultCache(1000, str(tmp_path))
+    sources = [np.full(100, i, dtype=np.float64) for i in range(2)]
+    shared = sources[0] * 2
+    cache.put("double", (sources[0],), {}, shared, shared=True)
+    cache.put("double", (sources[1],), {}, sources[1] * 2)
+    shared[:] = 0
+    loaded = cache.get("double", (sources[0],), {})
+    assert loaded is not shared and not loaded.flags.writeable and np.array_equal(loaded, sources[0] * 2)
+
+
+def test_in_place_edit_of_source_is_a_miss():
+    cache = ResultCache(2**20)
+    source = np.zeros((4, 4))
+    cache.put("sum", (source,), {}, source.sum(0))
+    source[1, 2] = 5
+    assert cache.get("sum", (source,), {}) is None
+
+
+def test_entries_die_with_their_source():
+    cache = ResultCache(2**20)
+    source = np.zeros(8)
+    cache.put("copy", (source,), {}, source + 1)
+    del source
+    gc.collect()
+    assert len(cache) == 0 and cache.nbytes == 0
+
+
+def test_lru_eviction_and_spill(tmp_path):
+    sources = [np.full(100, i, dtype=np.float64) for i in range(3)]
+    dropping = ResultCache(1700)
+    for i, source in enumerate(sources):
+        dropping.put("double", (source,), {}, source * 2)
+    assert dropping.get("double", (sources[0],), {}) is None
+    assert dropping.get("double", (sources[2],), {})[0] == 4
+
+    spilling = ResultCache(1700, str(tmp_path))
+    for source in sources:
+        spilling.put("double", (source,), {}, source * 2)
+    assert spilling.nbytes <= 1700 and list(tmp_path.iterdir())
+    assert np.array_equal(spilling.get("double", (sources[0],), {}), sources[0] * 2)
+    spilling.clear()
+    assert not list(tmp_path.iterdir())
+
+
+def test_arrays_on_disk_are_free_and_spilled_by_path(tmp_path):
+    on_disk = np.lib.format.open_memmap(tmp_path / "a.npy", mode="w+", dtype=np.float32, shape=(50, 40))
+    on_disk[:] = 3
+    chunked = ChunkedArray.create(tmp_path / "b.chunks", (6, 5), np.int16)
+    assert result_nbytes({"a": on_disk, "b": chunked, "c": np.zeros(10)}) == 80
+
+    spill = tmp_path / "spill"
+    cache = ResultCache(100, str(spill))
+    source, other = np.zeros(3), np.ones(3)
+    cache.put("mixed", (source,), {}, (on_disk, np.zeros(10)))
+    cache.put("filler", (other,), {}, np.zeros(10))
+    (pickled,) = spill.iterdir()
+    assert pickled.stat().st_size < on_disk.nbytes
+    loaded = cache.get("mixed", (source,), {})[0]
+    assert isinstance(loaded, np.memmap) and np.array_equal(loaded, on_disk)
+    assert writable(loaded) is loaded
+
+
+def test_fingerprint_samples_large_arrays():
+    data = np.zeros((200, 200, 64), dtype=np.float64)
+    before = fingerprint(data)
+    data[0, 0, 0] = 1
+    assert fingerprint(data) != before
+    assert fingerprint(np.zeros(5)) == fingerprint(np.zeros(5))
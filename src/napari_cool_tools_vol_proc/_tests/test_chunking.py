@@ -0,0 +1,64 @@
+"""
+Tests of chunked streaming and stitching against plain numpy references.
+"""
+import numpy as np
+import pytest
+
+from napari_cool_tools_vol_proc._core.chunking import Remainder, chunk_bounds, iter_chunks, process_chunks, stitch
+
+
+@pytest.mark.parametrize("remainder, expected", [
+    (Remainder.DROP, [(0, 3), (3, 6), (6, 9)]),
+    (Remainder.LAST, [(0, 3), (3, 6), (6, 10)]),
+    (Remainder.EXTRA, [(0, 3), (3, 6), (6, 9), (9, 10)]),
+    (Remainder.SPREAD, [(0, 3), (3, 6), (6, 10)]),
+])
+def test_chunk_bounds_by_count(remainder, expected):
+    assert chunk_bounds(10, chunks=3, remainder=remainder) == expected
+
+
+def test_chunk_bounds_by_length_and_short_axes():
+    assert chunk_bounds(7, chunk_len=3) == [(0, 3), (3, 6), (6, 7)]
+    assert chunk_bounds(7, chunk_len=3, remainder=Remainder.SPREAD) == [(0, 2), (2, 4), (4, 7)]
+    assert chunk_bounds(2, chunk_len=5, remainder=Remainder.DROP) == [(0, 2)]
+    assert chunk_bounds(1, chunks=1) == [(0, 1)]
+    for kwargs in ({"chunks": 0}, {"chunks": 3}, {}, {"chunk_len": 0}):
+        with pytest.raises(ValueError):
+            chunk_bounds(2, **kwargs)
+
+
+@pytest.mark.parametrize("axis", [0, 1, 2])
+def test_iter_chunks_are_views_with_clipped_halos(axis):
+    data = np.arange(7 * 8 * 9).reshape(7, 8, 9)
+    chunks = list(iter_chunks(data, chunks=3, axis=axis, halo=2, remainder=Remainder.LAST))
+    cores = [c for chunk in chunks for c in range(chunk.core.start, chunk.core.stop)]
+    assert cores == list(range(data.shape[axis]))
+    for chunk in chunks:
+        assert np.shares_memory(chunk.data, data)
+        assert chunk.padded == slice(max(0, chunk.core.start - 2), min(data.shape[axis], chunk.core.stop + 2))
+        np.testing.assert_array_equal(np.take(chunk.data, range(chunk.inner.start, chunk.inner.stop), axis), np.take(data, range(chunk.core.start, chunk.core.stop), axis))
+
+
+def _neighbour_sum(data, axis):
+    # sum of every slice and its two neighbours along axis, zero beyond the ends
+    padded = np.pad(np.moveaxis(data, axis, 0), [(1, 1)] + [(0, 0)] * (data.ndim - 1))
+    return np.moveaxis(padded[:-2] + padded[1:-1] + padded[2:], 0, axis)
+
+
+@pytest.mark.parametrize("axis", [0, 1, 2])
+@pytest.mark.parametrize("chunk_len", [1, 3, 64])
+@pytest.mark.parametrize("workers", [1, 3])
+def test_process_chunks_matches_whole_volume(axis, chunk_len, workers):
+    data = np.random.default_rng(0).random((6, 7, 5)).transpose(1, 2, 0)
+    out = np.empty(data.shape)
+    assert process_chunks(lambda chunk: _neighbour_sum(chunk, axis), data, out, axis=axis, chunk_len=chunk_len, halo=1, workers=workers) is out
+    np.testing.assert_allclose(out, _neighbour_sum(data, axis))
+
+
+def test_stitch_accepts_core_results_and_rejects_other_lengths():
+    data = np.arange(10.0)
+    chunks = list(iter_chunks(data, chunk_len=4, halo=1))
+    out = stitch(((chunk, 2 * data[chunk.core]) for chunk in chunks), np.empty(10))
+    np.testing.assert_array_equal(out, 2 * data)
+    with pytest.raises(ValueError):
+        stitch([(chunks[0], np.zeros(3))], np.empty(10))
@@ -0,0 +1,41 @@
+"""
+Tests of the circle drawing kernels against plain numpy references.
+"""
+import numpy as np
+import pytest
+
+from napari_cool_tools_vol_proc._core.drawing import CircleBrush, circle_box, circle_mask
+
+
+def _reference(shape, center, radius):
+    rows, cols = np.mgrid[:shape[0], :shape[1]]
+    return (rows - center[0]) ** 2 + (cols - center[1]) ** 2 <= radius * radius
+
+
+@pytest.mark.parametrize("center", [(10, 12), (10.4, 3.6), (0, 0), (1, 27.5)])
+@pytest.mark.parametrize("radius", [0, 0.7, 3, 5.5, 40])
+def test_circle_mask_matches_reference(center, radius):
+    shape = (21, 28)
+    box, mask = circle_mask(shape, center, radius)
+    drawn = np.zeros(shape, dtype=bool)
+    drawn[box] = mask
+    assert np.array_equal(drawn, _reference(shape, center, radius))
+
+
+def test_circle_box_is_clipped():
+    assert circle_box((10, 10), (-20, 5), 3) == (slice(0, 0), slice(2, 9))
+
+
+def test_brush_changes_paint_the_circle_of_each_radius():
+    shape = (30, 25)
+    center = (14.5, 9.2)
+    brush = CircleBrush(shape, center, label_val=3)
+    image = np.zeros(shape, dtype=np.uint8)
+    for radius in [4, 9.5, 9.5, 2, 0, 30, 1.5]:
+        changed = brush.set_radius(radius)
+        if changed is not None:
+            coordinates, value = changed
+            assert (image[coordinates] != value).all()
+            image[coordinates] = value
+        assert np.array_equal(image, np.where(_reference(shape, center, radius), 3, 0))
+    assert brush.set_radius(1.5) is None
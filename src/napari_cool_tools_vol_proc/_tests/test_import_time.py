@@ -0,0 +1,61 @@
+"""
+Import time regression tests, the plugin must stay cheap to import for napari startup and headless use.
+"""
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+# seconds allowed for importing the package and every adapter module on top of numpy
+IMPORT_BUDGET = 1.0
+
+MODULES = (
+    "napari_cool_tools_vol_proc",
+    "napari_cool_tools_vol_proc._angiography_tools",
+    "napari_cool_tools_vol_proc._averaging_tools",
+    "napari_cool_tools_vol_proc._cache_tools",
+    "napari_cool_tools_vol_proc._instrumentation_tools",
+    "napari_cool_tools_vol_proc._masking_tools",
+    "napari_cool_tools_vol_proc._measuring_tools",
+    "napari_cool_tools_vol_proc._projection_tools",
+    "napari_cool_tools_vol_proc._slicing_shaping_tools",
+    "napari_cool_tools_vol_proc._storage_tools",
+)
+
+HEAVY = ("napari", "magicgui", "napari_cool_tools_io", "qtpy", "skimage", "tqdm")
+
+SCRIPT = f"""
+import importlib, json, sys, time
+import numpy
+start = time.perf_counter()
+for module in {MODULES!r}:
+    importlib.import_module(module)
+elapsed = time.perf_counter() - start
+print(json.dumps({{"elapsed": elapsed, "loaded": [m for m in {HEAVY!r} if m in sys.modules]}}))
+"""
+
+
+def _run(script:str) -> str:
+    # fresh interpreter so modules imported by other tests do not hide the cost
+    source_root = str(Path(__file__).resolve().parents[2])
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [source_root, os.environ.get("PYTHONPATH")])))
+    return subprocess.run([sys.executable, "-c", script], check=True, capture_output=True, text=True, env=env).stdout
+
+
+def _import_report():
+    return json.loads(_run(SCRIPT).strip().splitlines()[-1])
+
+
+def test_import_does_not_load_gui_dependencies():
+    assert _import_report()["loaded"] == []
+
+
+def test_import_time_within_budget():
+    elapsed = min(_import_report()["elapsed"] for _ in range(3))
+    assert elapsed < IMPORT_BUDGET, f"importing the plugin took {elapsed:.3f}s, budget is {IMPORT_BUDGET}s"
+
+
+def test_batch_runner_is_imported_on_first_use():
+    script = "import sys, napari_cool_tools_vol_proc as p; lazy = 'napari_cool_tools_vol_proc._batch' not in sys.modules; p.run_batch; print(lazy and 'napari_cool_tools_vol_proc._batch' in sys.modules)"
+    assert _run(script).strip() == "True"
@@ -0,0 +1,34 @@
+"""
+Tests of the stage instrumentation and its sinks.
+"""
+import json
+import tracemalloc
+
+import numpy as np
+import pytest
+
+from napari_cool_tools_vol_proc._core.instrument import JsonLinesSink, add_sink, remove_sink, stage
+
+
+def test_stage_publishes_events(tmp_path):
+    path = tmp_path / "stages.jsonl"
+    sink = add_sink(JsonLinesSink(str(path)), trace_allocations=True)
+    try:
+        with stage("command", "first", bytes_read=10) as record:
+            np.ones(2**16)
+            record.add(bytes_read=5, planes=2)
+        with pytest.raises(KeyError):
+            with stage("command", "second"):
+                raise KeyError("x")
+    finally:
+        remove_sink(sink)
+    first, second = [json.loads(line) for line in path.read_text().splitlines()]
+    assert (first["stage"], first["bytes_read"], first["planes"], first["status"]) == ("first", 15, 2, "ok")
+    assert first["wall_s"] >= 0 and "allocated_bytes" in first
+    assert ("allocated_peak_bytes" in first) == hasattr(tracemalloc, "reset_peak")
+    assert second["status"] == "KeyError"
+    assert not tracemalloc.is_tracing()
+
+
+def test_stage_without_sinks_is_shared_no_op():
+    assert stage("a", "b") is stage("c", "d")
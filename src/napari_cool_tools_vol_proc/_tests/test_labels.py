@@ -0,0 +1,117 @@
+"""
+Tests of the label kernels against plain numpy references.
+"""
+import numpy as np
+import pytest
+
+from napari_cool_tools_vol_proc._core.labels import isolate_labels, label_bounding_boxes, label_codes, label_statistics, mask_label
+
+
+def _reference_box(data, label):
+    hits = np.argwhere(data == label)
+    if hits.size == 0:
+        return None
+    return tuple(slice(int(lo), int(hi) + 1) for lo, hi in zip(hits.min(0), hits.max(0)))
+
+
+@pytest.mark.parametrize("shape", [(4,), (1, 7), (9, 1, 5), (6, 5, 4), (3, 4, 5, 2)])
+@pytest.mark.parametrize("workers", [1, 3])
+def test_bounding_boxes_match_reference(shape, workers):
+    data = np.random.default_rng(0).integers(0, 4, shape).astype(np.uint8)
+    # small tiles so several tiles are merged
+    boxes = label_bounding_boxes(data, [3, 1, 2, 7], chunk_bytes=8, workers=workers)
+    assert list(boxes) == [3, 1, 2, 7]
+    for label, box in boxes.items():
+        assert box == _reference_box(data, label)
+
+
+def test_bounding_boxes_1d():
+    assert label_bounding_boxes(np.array([0, 1, 1, 0]), [1]) == {1: (slice(1, 3),)}
+
+
+def test_bounding_boxes_of_no_labels():
+    assert label_bounding_boxes(np.zeros((3, 4), dtype=np.int32), []) == {}
+
+
+def test_label_codes_wide_dtypes():
+    tile = np.array([[5, -3], [100000, 5]], dtype=np.int64)
+    labels = np.array([-3, 5])
+    assert np.array_equal(label_codes(tile, labels), [[2, 1], [0, 2]])
+    assert not label_codes(tile, np.array([], dtype=np.int64)).any()
+
+
+@pytest.mark.parametrize("crop", [True, False])
+def test_isolate_labels_matches_reference(crop):
+    rng = np.random.default_rng(1)
+    img = rng.random((8, 6, 5)).astype(np.float32)
+    lbl = np.zeros(img.shape, dtype=np.uint16)
+    lbl[2:5, 1:3, 1:4] = 1
+    lbl[6, 4, 0] = 2
+    results = {label: (volume, offset) for label, volume, offset in isolate_labels(img, lbl, [1, 2, 9], crop=crop, chunk_bytes=64)}
+    assert sorted(results) == ([1, 2] if crop else [1, 2, 9])
+    for label, (volume, offset) in results.items():
+        box = _reference_box(lbl, label) if crop else tuple(slice(0, n) for n in img.shape)
+        assert offset == tuple(s.start for s in box)
+        assert np.array_equal(volume, np.where(lbl == label, img, 0)[box])
+
+
+def test_isolate_labels_in_place_masks_union():
+    img = np.arange(24, dtype=np.int32).reshape(4, 6)
+    lbl = np.tile(np.array([0, 1, 2, 0, 1, 3]), (4, 1))
+    expected = np.where(np.isin(lbl, [1, 2]), img, 0)
+    outputs = list(isolate_labels(img, lbl, [1, 2], crop=False, in_place=True))
+    assert np.array_equal(img, expected)
+    assert all(np.shares_memory(volume, img) for _, volume, _ in outputs)
+
+
+def test_isolate_labels_of_no_labels_leaves_image():
+    img = np.ones((3, 3))
+    assert list(isolate_labels(img, np.ones((3, 3), dtype=np.uint8), [], in_place=True)) == []
+    assert img.all()
+
+
+def test_mask_label_non_contiguous_input():
+    rng = np.random.default_rng(2)
+    img = rng.integers(0, 50, (10, 8, 6)).astype(np.int16)[:, ::2, ::-1]
+    lbl = rng.integers(0, 3, (10, 8, 6)).astype(np.uint8)[:, ::2, ::-1]
+    assert np.array_equal(mask_label(img, lbl, 2, chunk_bytes=16, workers=2), np.where(lbl == 2, img, 0))
+    with pytest.raises(ValueError):
+        mask_label(img, lbl[:5], 2)
+
+
+def _reference_statistics(data, scale, include_background):
+    values, counts = np.unique(data, return_counts=True)
+    voxel = float(np.prod(scale)) if scale is not None else 1.0
+    return {int(v): (int(c), c * voxel) for v, c in zip(values, counts) if include_background or v != 0}
+
+
+@pytest.mark.parametrize("dtype", [np.uint8, np.int32, np.int64, bool])
+@pytest.mark.parametrize("axis", [0, 1, 2])
+@pytest.mark.parametrize("workers", [1, 3])
+def test_label_statistics_match_reference(dtype, axis, workers):
+    data = np.random.default_rng(2).integers(0, 5, (6, 7, 4)).astype(dtype)
+    if dtype == np.int64:
+        data[data == 4] = 2**40
+    scale = (0.5, 0.25, 2.0)
+    stats = label_statistics(data, scale=scale, per_bscan=True, axis=axis, include_background=True, chunk_bytes=1, workers=workers)
+    expected = _reference_statistics(data, scale, True)
+    assert list(stats) == sorted(expected)
+    for label, (voxels, volume) in expected.items():
+        assert stats[label]["voxels"] == voxels and stats[label]["volume_mm3"] == pytest.approx(volume)
+        per_slice = (np.moveaxis(data, axis, 0) == label).reshape(data.shape[axis], -1).sum(1)
+        np.testing.assert_array_equal(stats[label]["per_bscan"], per_slice)
+
+
+def test_label_statistics_of_negative_labels_and_background():
+    data = np.array([[[-3, 0], [0, 7]], [[7, 7], [-3, 0]]], dtype=np.int16)
+    stats = label_statistics(data)
+    assert stats == {-3: {"voxels": 2, "volume_mm3": 2.0}, 7: {"voxels": 3, "volume_mm3": 3.0}}
+    assert label_statistics(np.zeros((2, 1, 1), dtype=np.uint8)) == {}
+
+
+def test_label_statistics_of_non_contiguous_and_length_one_input():
+    data = np.random.default_rng(3).integers(0, 3, (5, 8, 2)).transpose(2, 0, 1)[:, ::3]
+    assert {label: entry["voxels"] for label, entry in label_statistics(data, chunk_bytes=1).items()} == \
+        {label: voxels for label, (voxels, _) in _reference_statistics(data, None, False).items()}
+    single = label_statistics(np.full((1, 1, 1), 4, dtype=np.uint16), per_bscan=True)
+    assert single[4]["voxels"] == 1 and list(single[4]["per_bscan"]) == [1]
@@ -0,0 +1,44 @@
+"""
+Tests of the enface marker store and enface axes matching against plain numpy references.
+"""
+import numpy as np
+import pytest
+
+from napari_cool_tools_vol_proc._core.markers import MarkerStore
+from napari_cool_tools_vol_proc._core.masking import resolve_mask_axes
+
+
+def test_markers_keep_placement_order():
+    store = MarkerStore({"fovea": (10, 20)})
+    store.set("disc", (30.5, 4))
+    store.set("fovea", (11, 21))
+    assert store.names() == ["disc", "fovea"] and list(store) == store.names()
+    np.testing.assert_array_equal(store.coordinates(), [[30.5, 4.0], [11.0, 21.0]])
+    assert "disc" in store and len(store) == 2 and store.get("macula") is None
+
+
+def test_empty_store_coordinates_back_a_points_layer():
+    store = MarkerStore({"fovea": (1, 2)})
+    store.remove("fovea")
+    store.remove("fovea")
+    assert store.coordinates().shape == (0, 2) and store.names() == []
+
+
+def test_distance_matches_numpy():
+    store = MarkerStore({"fovea": (3, 4), "disc": (7, -2)})
+    expected = np.linalg.norm((np.array([7, -2]) - [3, 4]) * [0.5, 2.0])
+    assert store.distance("fovea", "disc", spacing=(0.5, 2.0)) == pytest.approx(expected)
+    assert store.distance("disc", "fovea") == pytest.approx(np.hypot(4, 6))
+    with pytest.raises(KeyError):
+        store.distance("fovea", "macula")
+
+
+def test_enface_axes_matched_by_shape_or_explicitly():
+    assert resolve_mask_axes((30, 10), (10, 20, 30)) == (2, 0)
+    assert resolve_mask_axes((20, 20), (20, 5, 20), mask_axes=(2, 0)) == (2, 0)
+    with pytest.raises(ValueError):
+        resolve_mask_axes((20, 20), (20, 5, 20))
+    with pytest.raises(ValueError):
+        resolve_mask_axes((20, 20), (20, 5, 20), mask_axes=(1, 0))
+    with pytest.raises(ValueError):
+        resolve_mask_axes((20, 20), (20, 20))
@@ -0,0 +1,60 @@
+"""
+Tests of the 2D mask kernels against plain numpy references.
+"""
+import itertools
+
+import numpy as np
+import pytest
+
+from napari_cool_tools_vol_proc._core.masking import expand_mask, project_mask
+
+SHAPE = (4, 5, 6)
+
+
+def _reference_mask(mask, axes, shape):
+    # mask repeated along the remaining axis with the explicit loops numpy broadcasting replaces
+    out = np.empty(shape, dtype=mask.dtype)
+    for index in itertools.product(*map(range, shape)):
+        out[index] = mask[index[axes[0]], index[axes[1]]]
+    return out
+
+
+@pytest.mark.parametrize("axes", list(itertools.permutations(range(3), 2)))
+@pytest.mark.parametrize("workers", [1, 3])
+def test_project_and_expand_match_reference(axes, workers):
+    rng = np.random.default_rng(0)
+    mask = rng.integers(0, 3, (SHAPE[axes[0]], SHAPE[axes[1]])).astype(np.int8)
+    volume = rng.integers(1, 100, SHAPE).astype(np.uint16)
+    expected = _reference_mask(mask, axes, SHAPE)
+
+    masked = project_mask(mask, volume, mask_axes=axes, chunk_bytes=1, workers=workers)
+    assert masked.dtype == volume.dtype
+    np.testing.assert_array_equal(masked, np.where(expected != 0, volume, 0))
+
+    expanded = expand_mask(mask, SHAPE, mask_axes=axes, chunk_bytes=1, workers=workers)
+    assert expanded.dtype == np.int8
+    np.testing.assert_array_equal(expanded, expected)
+
+
+def test_project_mask_in_place_on_non_contiguous_volume():
+    volume = np.random.default_rng(1).random((6, 5, 8)).transpose(2, 0, 1)[::2]
+    reference = volume.copy()
+    mask = np.random.default_rng(2).random((6, 5)) > 0.5
+    assert project_mask(mask, volume, out=volume) is volume
+    np.testing.assert_array_equal(volume, reference * mask[None])
+
+
+def test_masks_with_length_one_axes():
+    volume = np.arange(20.0).reshape(1, 4, 5)
+    mask = np.array([[1, 0, 1, 1, 0]])
+    np.testing.assert_array_equal(project_mask(mask, volume, mask_axes=(0, 2)), volume * mask[:, None])
+    np.testing.assert_array_equal(expand_mask(mask, (1, 4, 5), mask_axes=(0, 2)), np.broadcast_to(mask[:, None], (1, 4, 5)))
+
+
+def test_masks_reject_mismatched_shapes():
+    with pytest.raises(ValueError):
+        project_mask(np.ones((3, 3)), np.zeros((3, 4, 5)))
+    with pytest.raises(ValueError):
+        project_mask(np.ones((3, 4)), np.zeros((3, 4, 5)), out=np.zeros((3, 4, 4)))
+    with pytest.raises(ValueError):
+        expand_mask(np.ones((4, 5)), (3, 4, 5), out=np.zeros((3, 4)))
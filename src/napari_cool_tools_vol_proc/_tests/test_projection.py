@@ -0,0 +1,87 @@
+"""
+Tests of the projection kernels against plain numpy references.
+"""
+import numpy as np
+import pytest
+
+from napari_cool_tools_vol_proc._core.projection import PLANES, ProjectionType, SlabMaxIndex, projections
+from napari_cool_tools_vol_proc._core.tiling import axis_index
+
+REFERENCE = {
+    ProjectionType.MAX: lambda data, axis: data.max(axis),
+    ProjectionType.MIN: lambda data, axis: data.min(axis),
+    ProjectionType.MEAN: lambda data, axis: data.mean(axis, dtype=np.float64),
+    ProjectionType.SUM: lambda data, axis: data.sum(axis),
+    ProjectionType.STD: lambda data, axis: data.std(axis, dtype=np.float64),
+    ProjectionType.ARGMAX: lambda data, axis: data.argmax(axis),
+}
+
+
+def _check(data, tile_bytes, workers):
+    results = projections(data, planes=list(PLANES), stats=list(ProjectionType), tile_bytes=tile_bytes, workers=workers)
+    assert list(results) == [(plane, stat) for plane in PLANES for stat in ProjectionType]
+    for (plane, stat), result in results.items():
+        axis, transpose = PLANES[plane]
+        expected = REFERENCE[stat](np.asarray(data), axis)
+        expected = expected.T if transpose else expected
+        assert result.shape == expected.shape
+        if stat in (ProjectionType.MEAN, ProjectionType.STD):
+            np.testing.assert_allclose(result, expected, rtol=1e-10, atol=1e-10)
+        else:
+            assert result.dtype == expected.dtype
+            np.testing.assert_array_equal(result, expected)
+
+
+@pytest.mark.parametrize("tile_bytes", [1, 100, 2**20])
+@pytest.mark.parametrize("workers", [1, 3])
+def test_projections_match_reference(tile_bytes, workers):
+    _check(np.random.default_rng(0).integers(-50, 50, (9, 5, 7)).astype(np.int16), tile_bytes, workers)
+
+
+def test_projections_of_non_contiguous_and_length_one_input():
+    _check(np.random.default_rng(1).random((8, 6, 10)).transpose(2, 0, 1)[::3], 64, 2)
+    _check(np.random.default_rng(2).random((1, 1, 4)), 1, 1)
+
+
+def test_integer_sums_are_exact():
+    data = np.full((5, 1, 2), 2**53 + 1, dtype=np.int64)
+    results = projections(data, planes=["zy", "yx"], stats=[ProjectionType.SUM], tile_bytes=8)
+    assert results[("zy", ProjectionType.SUM)].dtype == np.int64
+    np.testing.assert_array_equal(results[("zy", ProjectionType.SUM)], data.sum(0))
+    np.testing.assert_array_equal(results[("yx", ProjectionType.SUM)], data.sum(1).T)
+
+
+def test_projections_reject_bad_input():
+    with pytest.raises(ValueError):
+        projections(np.zeros((2, 2)))
+    with pytest.raises(ValueError):
+        projections(np.zeros((2, 2, 2)), planes=["xy"])
+
+
+@pytest.mark.parametrize("axis", [0, 1, 2])
+@pytest.mark.parametrize("max_levels, memory_budget", [(None, None), (1, None), (2, None), (None, 0)])
+def test_slab_max_index_matches_reference(axis, max_levels, memory_budget):
+    data = np.random.default_rng(3).integers(0, 255, (11, 13, 4)).astype(np.uint8)
+    index = SlabMaxIndex(data, axis=axis, max_levels=max_levels, memory_budget=memory_budget, tile_bytes=7)
+    length = data.shape[axis]
+    for z0 in range(length):
+        for z1 in range(z0 + 1, length + 1):
+            expected = data[axis_index(3, axis, slice(z0, z1))].max(axis)
+            np.testing.assert_array_equal(index.query(z0, z1), expected)
+
+
+def test_slab_max_index_of_non_contiguous_and_length_one_input():
+    data = np.random.default_rng(4).random((6, 9, 5)).transpose(2, 0, 1)[:, ::2]
+    index = SlabMaxIndex(data, axis=1)
+    np.testing.assert_array_equal(index.query(1, 3), data[:, 1:3].max(1))
+    single = SlabMaxIndex(np.arange(6.0).reshape(2, 1, 3), axis=1)
+    assert single.nbytes == 0
+    np.testing.assert_array_equal(single.query(0, 1), np.arange(6.0).reshape(2, 3))
+
+
+def test_slab_queries_are_clipped_and_empty_slabs_rejected():
+    data = np.random.default_rng(5).random((3, 6, 2))
+    index = SlabMaxIndex(data, axis=1)
+    np.testing.assert_array_equal(index.query(-4, 99), data.max(1))
+    with pytest.raises(ValueError):
+        index.query(4, 4)
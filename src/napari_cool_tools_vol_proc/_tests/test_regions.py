@@ -0,0 +1,80 @@
+"""
+Tests of the region volume engine against plain numpy references.
+"""
+import numpy as np
+import pytest
+
+from napari_cool_tools_vol_proc._core.drawing import RADIUS_TOLERANCE, circle_mask
+from napari_cool_tools_vol_proc._core.regions import SECTORS, RegionIndex, summed_area_table, thickness_maps
+
+SECTOR_START = {"right": -45, "top": 45, "left": 135, "bottom": 225}
+
+
+@pytest.fixture(scope="module")
+def labels():
+    return np.random.default_rng(0).integers(0, 4, (12, 40, 36)).astype(np.uint8)
+
+
+def _region(shape, center, radius, inner=0.0, sector=None, spacing=(1.0, 1.0)):
+    rows, cols = np.mgrid[:shape[0], :shape[1]]
+    dy = (rows - center[0]) * spacing[0]
+    dx = (cols - center[1]) * spacing[1]
+    d2 = dy * dy + dx * dx
+    inside = d2 <= radius * radius * (1 + RADIUS_TOLERANCE)
+    if inner > 0:
+        inside &= d2 > inner * inner * (1 + RADIUS_TOLERANCE)
+    if sector is not None:
+        angle = (np.degrees(np.arctan2(-dy, dx)) - SECTOR_START[sector]) % 360
+        inside &= (angle < 90) & ((dy != 0) | (dx != 0))
+    return inside
+
+
+@pytest.mark.parametrize("enface_axes", [(0, 2), (1, 2), (2, 0), (0, 1)])
+def test_thickness_maps_match_reference(labels, enface_axes):
+    depth = ({0, 1, 2} - set(enface_axes)).pop()
+    values, maps = thickness_maps(labels, enface_axes, chunk_bytes=1000, workers=2)
+    assert list(values) == [1, 2, 3]
+    for value, counts in zip(values, maps):
+        reference = (labels == value).sum(depth)
+        assert np.array_equal(counts, reference.T if enface_axes[0] > enface_axes[1] else reference)
+    values, maps = thickness_maps(labels, enface_axes, labels=[3, 0, 7])
+    assert list(values) == [0, 3, 7] and not maps[2].any()
+    assert np.array_equal(maps[0].sum(), (labels == 0).sum())
+
+
+def test_summed_area_table():
+    maps = np.arange(24).reshape(2, 3, 4)
+    sat = summed_area_table(maps)
+    assert sat.shape == (2, 4, 5) and sat[1, 2, 3] == maps[1, :2, :3].sum()
+
+
+@pytest.mark.parametrize("center", [(20.4, 19.6), (20.5, 20.5), (3, 4), (0.2, 35.7)])
+@pytest.mark.parametrize("radius", [0, 0.5, 2.5, 7, 10.3, 60])
+def test_disk_matches_drawn_circle(labels, center, radius):
+    index = RegionIndex.from_labels(labels, enface_axes=(1, 2))
+    _, maps = thickness_maps(labels, (1, 2))
+    box, mask = circle_mask(index.shape, center, radius)
+    drawn = np.zeros(index.shape, dtype=bool)
+    drawn[box] = mask
+    assert np.array_equal(index.disk(center, radius), maps[:, drawn].sum(1))
+
+
+@pytest.mark.parametrize("spacing", [(1.0, 1.0), (0.5, 1.5), (0.25, 0.125)])
+@pytest.mark.parametrize("sector", [None] + list(SECTORS))
+def test_annuli_and_sectors_match_reference(labels, spacing, sector):
+    index = RegionIndex.from_labels(labels, enface_axes=(1, 2))
+    _, maps = thickness_maps(labels, (1, 2))
+    for center in [(20, 18), (17.3, 22.8)]:
+        for radius, inner in [(3.0, 0.0), (6.0, 1.5), (4.5, 4.0)]:
+            expected = maps[:, _region(index.shape, center, radius, inner, sector, spacing)].sum(1)
+            assert np.array_equal(index.disk(center, radius, inner, sector, spacing=spacing), expected)
+
+
+def test_box_and_etdrs_partition(labels):
+    index = RegionIndex.from_labels(labels, enface_axes=(1, 2), scale=(1.0, 0.1, 0.1))
+    _, maps = thickness_maps(labels, (1, 2))
+    assert np.array_equal(index.box(slice(3, 9), slice(-5, None)), maps[:, 3:9, -5:].sum((1, 2)))
+    regions = index.etdrs((20.2, 17.9), diameters=(0.6, 1.2, 2.0))
+    total = index.disk((20.2, 17.9), 1.0)
+    assert np.array_equal(sum(regions.values()), total)
+    assert index.volumes(total)[1] == pytest.approx(total[0] * 0.01)
@@ -0,0 +1,105 @@
+"""
+Tests of the registration kernels and registered averaging against plain numpy references.
+"""
+import numpy as np
+import pytest
+
+from napari_cool_tools_vol_proc._core.averaging import EdgeMode, block_mean, sliding_mean
+from napari_cool_tools_vol_proc._core.registration import cached_frame_shifts, frame_shifts, group_references, shift_frame, window_shifts
+
+OFFSETS = np.array([[0, 0], [2, -1], [-3, 4], [1, 1], [5, -2], [-1, -4], [0, 3]])
+
+
+def _image(shape=(48, 40), seed=0):
+    # smooth random image with a sharp correlation peak
+    rng = np.random.default_rng(seed)
+    spectrum = np.fft.rfft2(rng.standard_normal(shape))
+    fy = np.fft.fftfreq(shape[0])[:, None]
+    fx = np.fft.rfftfreq(shape[1])[None, :]
+    return np.fft.irfft2(spectrum * np.exp(-(fy**2 + fx**2) * 40), s=shape)
+
+
+def _stack(offsets=OFFSETS, axis=0):
+    base = _image()
+    frames = np.stack([np.roll(base, tuple(offset), axis=(0, 1)) for offset in offsets])
+    return np.moveaxis(frames, 0, axis)
+
+
+@pytest.mark.parametrize("group", [None, 1, 3, 7])
+@pytest.mark.parametrize("axis", [0, 1])
+def test_frame_shifts_relative_to_group_reference(group, axis):
+    shifts = frame_shifts(_stack(axis=axis), axis=axis, group=group, batch_bytes=1)
+    references = group_references(len(OFFSETS), group)
+    np.testing.assert_array_equal(shifts, OFFSETS - OFFSETS[references])
+
+
+def test_group_references():
+    np.testing.assert_array_equal(group_references(7, 3), [1, 1, 1, 4, 4, 4, 6])
+    np.testing.assert_array_equal(group_references(4), [1, 1, 1, 1])
+    with pytest.raises(ValueError):
+        group_references(4, 0)
+
+
+@pytest.mark.parametrize("length", [0, 1])
+def test_short_axis_has_no_shifts(length):
+    data = np.random.default_rng(1).random((length, 16, 16))
+    assert frame_shifts(data).shape == (length, 2) and not frame_shifts(data).any()
+    assert window_shifts(data, 3).shape == (length, 3, 2) and not window_shifts(data, 3).any()
+
+
+def test_window_shifts_pairs():
+    window = 5
+    half = window // 2
+    shifts = window_shifts(_stack(), window, batch_bytes=1)
+    for i in range(len(OFFSETS)):
+        for d in range(-half, half + 1):
+            expected = OFFSETS[i + d] - OFFSETS[i] if 0 <= i + d < len(OFFSETS) else 0
+            np.testing.assert_array_equal(shifts[i, half + d], expected)
+
+
+def test_registered_block_mean_matches_reference():
+    data = _stack()
+    shifts = frame_shifts(data, group=3)
+    aligned = np.stack([shift_frame(frame, -shift) for frame, shift in zip(data, shifts)])
+    expected = np.stack([aligned[start:start + 3].mean(0) for start in range(0, len(data), 3)])
+    np.testing.assert_allclose(block_mean(data, 3, shifts=shifts, workers=2), expected)
+
+
+@pytest.mark.parametrize("edge_mode", list(EdgeMode))
+def test_registered_sliding_mean_matches_reference(edge_mode):
+    data = _stack()
+    window, half = 3, 1
+    shifts = window_shifts(data, window)
+    unregistered = sliding_mean(data, window, edge_mode=edge_mode)
+    result = sliding_mean(data, window, edge_mode=edge_mode, shifts=shifts, workers=2)
+    assert result.shape == unregistered.shape
+
+    expected = []
+    for i in range(len(data)):
+        sources = [j for j in range(i - half, i + half + 1) if 0 <= j < len(data)]
+        if edge_mode == EdgeMode.REFLECT:
+            sources = [abs(j) if j < len(data) else 2 * (len(data) - 1) - j for j in range(i - half, i + half + 1)]
+        elif edge_mode == EdgeMode.NEAREST:
+            sources = [min(max(j, 0), len(data) - 1) for j in range(i - half, i + half + 1)]
+        full = half <= i < len(data) - half
+        if edge_mode == EdgeMode.TRIM and not full:
+            continue
+        if edge_mode == EdgeMode.COPY and not full:
+            expected.append(data[i])
+            continue
+        expected.append(np.mean([shift_frame(data[k], -shifts[i, half + k - i]) for k in sources], axis=0))
+    np.testing.assert_allclose(result, np.stack(expected))
+
+
+def test_registered_sliding_mean_rejects_frame_shifts():
+    data = _stack()
+    with pytest.raises(ValueError):
+        sliding_mean(data, 3, shifts=frame_shifts(data))
+
+
+def test_cached_shifts_follow_in_place_edits():
+    data = _stack()
+    first = cached_frame_shifts(data, group=3)
+    assert cached_frame_shifts(data, group=3) is first
+    data[0] = np.roll(data[1], (1, 2), axis=(0, 1))
+    np.testing.assert_array_equal(cached_frame_shifts(data, group=3)[0], OFFSETS[1] + [1, 2] - OFFSETS[1])
@@ -0,0 +1,70 @@
+"""
+Tests of the shape spec reshaping kernels against plain numpy references.
+"""
+import numpy as np
+import pytest
+
+from napari_cool_tools_vol_proc._core.shaping import CopyRequiredError, reshape, resolve_shape_spec
+from napari_cool_tools_vol_proc._core.storage import ChunkedArray, output_store
+
+
+@pytest.mark.parametrize("spec, shape, expected", [
+    ("(-1,3,:,:)", (12, 5, 4), (4, 3, 5, 4)),
+    ("octa_mscans_3", (12, 5, 4), (4, 3, 5, 4)),
+    ("(-1,:,:)", (4, 3, 5, 4), (12, 5, 4)),
+    ("(s0*s1,:)", (2, 3, 4), (6, 4)),
+    ("(s0*2,-1)", (2, 3, 4), (4, 6)),
+    ("(1,:,:)", (1, 1, 7), (1, 1, 7)),
+    ("( -1 , : )", (3, 1), (3, 1)),
+])
+def test_resolve_shape_spec(spec, shape, expected):
+    assert resolve_shape_spec(spec, shape) == expected
+    assert reshape(np.zeros(shape), spec).shape == expected
+
+
+@pytest.mark.parametrize("spec, shape", [
+    ("-1,3", (6,)),
+    ("(-1,-1)", (6,)),
+    ("(-1,4)", (6,)),
+    ("(:,:,:)", (6, 2)),
+    ("(s3,-1)", (6, 2)),
+    ("(0x2)", (6,)),
+])
+def test_invalid_specs(spec, shape):
+    with pytest.raises(ValueError):
+        resolve_shape_spec(spec, shape)
+
+
+def test_contiguous_reshape_is_a_view_matching_numpy():
+    data = np.arange(60).reshape(12, 5)
+    result = reshape(data, "(-1,3,:)")
+    np.testing.assert_array_equal(result, data.reshape(4, 3, 5))
+    assert np.shares_memory(result, data)
+
+
+def test_memmap_stays_a_memmap(tmp_path):
+    data = np.lib.format.open_memmap(tmp_path / "vol.npy", mode="w+", dtype=np.uint16, shape=(6, 4, 2))
+    result = reshape(data, "(-1,2,:,:)")
+    assert isinstance(result, np.memmap) and result.shape == (3, 2, 4, 2)
+
+
+def test_non_contiguous_input_needs_an_allowed_copy():
+    data = np.arange(24).reshape(4, 6).T
+    with pytest.raises(CopyRequiredError):
+        reshape(data, "(-1)")
+    result = reshape(data, "(-1)", allow_copy=True)
+    np.testing.assert_array_equal(result, np.reshape(data, -1))
+    assert not np.shares_memory(result, data)
+
+
+@pytest.mark.parametrize("spec", ["(-1,3,:,:)", "(-1,:)", "(s0*s1,:)", "(4,-1)", "(-1)"])
+def test_chunked_input_is_regrouped_into_a_store(tmp_path, spec):
+    data = np.random.default_rng(0).integers(0, 100, (6, 4, 5)).astype(np.uint16)
+    chunked = ChunkedArray.create(tmp_path / "vol.chunks", data.shape, data.dtype, chunk_len=2)
+    chunked[:] = data
+    with pytest.raises(CopyRequiredError):
+        reshape(chunked, spec)
+    with output_store(tmp_path / "out", chunked=True, min_bytes=0):
+        result = reshape(chunked, spec, allow_copy=True)
+        assert isinstance(result, ChunkedArray)
+        np.testing.assert_array_equal(np.asarray(result), np.reshape(data, resolve_shape_spec(spec, data.shape)))
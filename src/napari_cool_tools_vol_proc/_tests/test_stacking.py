@@ -0,0 +1,100 @@
+"""
+Tests of the lazy stack against plain numpy references.
+"""
+import numpy as np
+import pytest
+
+from napari_cool_tools_vol_proc._core.stacking import VirtualStack, stack_arrays, stack_arrays_steps
+
+KEYS = [
+    (),
+    0,
+    -1,
+    (slice(None), 1),
+    (slice(None, None, -1), slice(1, None, 2)),
+    (Ellipsis, slice(3, 0, -2)),
+    (1, Ellipsis, 0),
+    (slice(-2, None), slice(None), -3, slice(None, None, -1)),
+    (slice(5, 1), 0),
+]
+
+
+def _padded_reference(arrays, axis, fill_value):
+    # members padded at the far end of every axis with np.pad, then stacked
+    shape = np.max([array.shape for array in arrays], axis=0)
+    padded = [np.pad(array, [(0, n - m) for n, m in zip(shape, array.shape)], constant_values=fill_value) for array in arrays]
+    return np.stack(padded, axis=axis)
+
+
+@pytest.mark.parametrize("axis", [0, 1, 2, 3, -1])
+@pytest.mark.parametrize("key", KEYS)
+def test_indexing_matches_np_stack(axis, key):
+    rng = np.random.default_rng(0)
+    arrays = [rng.random((4, 5, 6)) for _ in range(3)]
+    stack = VirtualStack(arrays, axis=axis)
+    expected = np.stack(arrays, axis=axis)
+    assert stack.shape == expected.shape and stack.dtype == expected.dtype
+    np.testing.assert_array_equal(stack[key], expected[key])
+
+
+@pytest.mark.parametrize("axis", [0, 2])
+@pytest.mark.parametrize("key", KEYS)
+def test_padded_indexing_matches_reference(axis, key):
+    rng = np.random.default_rng(1)
+    arrays = [rng.integers(0, 9, shape).astype(np.uint8) for shape in [(4, 5, 6), (2, 5, 1), (4, 1, 3)]]
+    stack = VirtualStack(arrays, axis=axis, pad=True, fill_value=-1)
+    expected = _padded_reference([a.astype(np.int16) for a in arrays], axis, -1)
+    assert stack.dtype == np.int16
+    np.testing.assert_array_equal(stack[key], expected[key])
+    np.testing.assert_array_equal(np.asarray(stack), expected)
+
+
+def test_integer_index_returns_a_view_of_non_contiguous_members():
+    base = np.random.default_rng(2).random((6, 8, 5))
+    arrays = [base.transpose(2, 0, 1)[:, ::2], base.transpose(2, 0, 1)[:, 1::2]]
+    stack = VirtualStack(arrays, axis=1)
+    assert np.shares_memory(stack[:, 1], base)
+    np.testing.assert_array_equal(stack[:, 1], arrays[1])
+    np.testing.assert_array_equal(stack[2:4, :, 1:], np.stack(arrays, axis=1)[2:4, :, 1:])
+
+
+def test_length_one_members():
+    arrays = [np.full((1, 3, 1), i) for i in range(2)]
+    expected = np.stack(arrays, axis=3)
+    stack = VirtualStack(arrays, axis=3)
+    assert stack.shape == (1, 3, 1, 2)
+    np.testing.assert_array_equal(stack[0, ..., 1], expected[0, ..., 1])
+    np.testing.assert_array_equal(stack_arrays(arrays, axis=3), expected)
+
+
+@pytest.mark.parametrize("axis", [0, 1, 3])
+def test_stack_arrays_into_out_with_progress(axis):
+    rng = np.random.default_rng(3)
+    arrays = [rng.random((3, 4, 2)), rng.random((3, 2, 2))]
+    expected = _padded_reference(arrays, axis, 0.5)
+    out = np.empty(expected.shape)
+    steps = stack_arrays_steps(arrays, axis=axis, pad=True, fill_value=0.5, out=out)
+    progress = []
+    try:
+        while True:
+            progress.append(next(steps))
+    except StopIteration as stop:
+        assert stop.value is out
+    assert progress == [(1, 2), (2, 2)]
+    np.testing.assert_array_equal(out, expected)
+    assert isinstance(stack_arrays(arrays, axis=axis, virtual=True, pad=True), VirtualStack)
+
+
+def test_stack_rejects_bad_input():
+    with pytest.raises(ValueError):
+        VirtualStack([])
+    with pytest.raises(ValueError):
+        VirtualStack([np.zeros((2, 2)), np.zeros((2, 2, 2))], pad=True)
+    with pytest.raises(ValueError):
+        VirtualStack([np.zeros((2, 2)), np.zeros((2, 3))])
+    stack = VirtualStack([np.zeros((2, 2))] * 3)
+    for key in (3, (0, 0, 0, 0), [0, 1], (None,)):
+        with pytest.raises(IndexError):
+            stack[key]
+    with pytest.raises(ValueError):
+        stack.materialize(np.empty((2, 2, 3)))
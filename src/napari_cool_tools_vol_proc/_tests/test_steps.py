@@ -0,0 +1,88 @@
+"""
+Tests of the step generators behind the progress-reporting workers against the plain kernels.
+"""
+import numpy as np
+import pytest
+
+from napari_cool_tools_vol_proc._core.averaging import EdgeMode, block_mean, block_mean_steps, sliding_mean, sliding_mean_steps
+from napari_cool_tools_vol_proc._core.labels import label_statistics, label_statistics_steps
+from napari_cool_tools_vol_proc._core.stacking import stack_arrays_steps
+from napari_cool_tools_vol_proc._core.tiling import run_steps
+
+DATA = np.random.default_rng(0).integers(0, 5, (12, 6, 4)).astype(np.uint8)
+
+
+class CountingReader:
+    """Array-like counting the basic selections read from data."""
+
+    def __init__(self, data):
+        self.data = data
+        self.shape = data.shape
+        self.dtype = data.dtype
+        self.reads = 0
+
+    def __getitem__(self, key):
+        self.reads += 1
+        return self.data[key]
+
+
+def _progress(steps):
+    # (done, total) pairs of a step generator and its return value
+    progress = []
+    while True:
+        try:
+            progress.append(next(steps))
+        except StopIteration as stop:
+            return progress, stop.value
+
+
+STEPS = [
+    (lambda data, workers: block_mean_steps(data, 2, chunk_bytes=48, workers=workers), lambda data: block_mean(data, 2)),
+    (lambda data, workers: sliding_mean_steps(data, 3, axis=1, edge_mode=EdgeMode.SHRINK, workers=workers), lambda data: sliding_mean(data, 3, axis=1, edge_mode=EdgeMode.SHRINK)),
+    (lambda data, workers: label_statistics_steps(data, per_bscan=True, chunk_bytes=24, workers=workers), lambda data: label_statistics(data, per_bscan=True)),
+]
+
+
+def _assert_equal(result, expected):
+    if isinstance(expected, dict):
+        assert result.keys() == expected.keys()
+        for key in expected:
+            _assert_equal(result[key], expected[key])
+    else:
+        np.testing.assert_array_equal(result, expected)
+
+
+@pytest.mark.parametrize("steps, kernel", STEPS)
+@pytest.mark.parametrize("workers", [1, 3])
+def test_steps_report_progress_and_return_the_kernel_result(steps, kernel, workers):
+    progress, result = _progress(steps(DATA, workers))
+    total = progress[0][1]
+    assert progress == [(done, total) for done in range(1, total + 1)]
+    _assert_equal(result, kernel(DATA))
+    _assert_equal(run_steps(steps(DATA, workers)), result)
+
+
+def test_steps_of_non_contiguous_and_length_one_input():
+    data = np.asfortranarray(DATA)[:, ::2]
+    progress, result = _progress(block_mean_steps(data, 4, chunk_bytes=1))
+    assert progress[-1] == (3, 3)
+    np.testing.assert_array_equal(result, data.reshape(3, 4, 3, 4).mean(1))
+    progress, result = _progress(stack_arrays_steps([np.ones((1, 1))], axis=1))
+    assert progress == [(1, 1)]
+    np.testing.assert_array_equal(result, np.ones((1, 1, 1)))
+
+
+def test_closing_steps_stops_reading_tiles():
+    data = CountingReader(DATA)
+    steps = label_statistics_steps(data, chunk_bytes=24, workers=1)
+    assert next(steps) == (1, 12)
+    steps.close()
+    assert data.reads == 1
+    with pytest.raises(StopIteration):
+        next(steps)
+
+
+def test_invalid_arguments_are_raised_on_first_step():
+    steps = block_mean_steps(DATA, 0)
+    with pytest.raises(ValueError):
+        next(steps)
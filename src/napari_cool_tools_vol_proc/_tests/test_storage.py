@@ -0,0 +1,107 @@
+"""
+Tests of the on-disk storage against plain numpy references.
+"""
+import numpy as np
+import pytest
+
+from napari_cool_tools_vol_proc._core.averaging import sliding_mean
+from napari_cool_tools_vol_proc._core.cache import ResultCache
+from napari_cool_tools_vol_proc._core.storage import ChunkedArray, OutputStore, is_store, open_store, output_store, save_store
+
+KEYS = [
+    (slice(None),),
+    (1,),
+    (-1, slice(1, 4)),
+    (slice(1, 6, 2), Ellipsis, 2),
+    (Ellipsis, slice(None, None, 3)),
+    (slice(2, 5), 0, slice(None)),
+    (slice(4, 4),),
+    (2, 3, 1),
+]
+
+
+@pytest.mark.parametrize("chunk_axis", [0, 1, 2])
+@pytest.mark.parametrize("compression", [0, 1])
+def test_chunked_array_matches_numpy(tmp_path, chunk_axis, compression):
+    reference = np.random.default_rng(0).integers(0, 100, (7, 5, 6)).astype(np.int32)
+    array = ChunkedArray.create(tmp_path / "vol.chunks", reference.shape, reference.dtype, chunk_len=2, compression=compression, cache_chunks=1, chunk_axis=chunk_axis)
+    array[...] = reference
+    for key in KEYS:
+        np.testing.assert_array_equal(array[key], reference[key])
+    for key in KEYS[1:]:
+        reference[key] = -7
+        array[key] = -7
+    array.flush()
+    reopened = open_store(tmp_path / "vol.chunks")
+    assert reopened.chunk_axis == chunk_axis and reopened.chunks == -(-reference.shape[chunk_axis] // 2)
+    np.testing.assert_array_equal(np.asarray(reopened), reference)
+    np.testing.assert_array_equal(reopened[[0, 2]], reference[[0, 2]])
+    with pytest.raises(IndexError):
+        reopened[7]
+    with pytest.raises(ValueError):
+        reopened[0] = 1
+
+
+def test_unwritten_chunks_read_as_fill_value(tmp_path):
+    array = ChunkedArray.create(tmp_path / "vol.chunks", (4, 1, 3), np.float32, chunk_len=1, fill_value=2.5)
+    array[1, 0, :2] = 1
+    expected = np.full((4, 1, 3), 2.5, dtype=np.float32)
+    expected[1, 0, :2] = 1
+    np.testing.assert_array_equal(array[...], expected)
+
+
+@pytest.mark.parametrize("chunk_axis, expected_writes", [(2, 3), (0, 18)])
+def test_slice_writes_along_the_chunk_axis_write_each_chunk_once(tmp_path, monkeypatch, chunk_axis, expected_writes):
+    writes = []
+    original = ChunkedArray._write_chunk
+    monkeypatch.setattr(ChunkedArray, "_write_chunk", lambda self, index, chunk: writes.append(index) or original(self, index, chunk))
+    array = ChunkedArray.create(tmp_path / "vol.chunks", (6, 4, 6), np.uint8, chunk_len=2, cache_chunks=1, chunk_axis=chunk_axis)
+    for i in range(6):
+        array[:, :, i] = i
+    array.flush()
+    assert len(writes) == expected_writes
+    np.testing.assert_array_equal(array[...], np.broadcast_to(np.arange(6, dtype=np.uint8), (6, 4, 6)))
+
+
+def test_outputs_are_chunked_along_their_write_axis(tmp_path):
+    data = np.random.default_rng(1).random((4, 3, 7))
+    with output_store(tmp_path / "out", chunked=True, min_bytes=0):
+        result = sliding_mean(data, 3, axis=2)
+    assert isinstance(result, ChunkedArray) and result.chunk_axis == 2
+    np.testing.assert_allclose(result[...], sliding_mean(data, 3, axis=2))
+
+
+@pytest.mark.parametrize("suffix", [".npy", ".chunks"])
+def test_save_store_round_trip(tmp_path, suffix):
+    data = np.arange(60, dtype=np.int16).reshape(5, 3, 4)[:, ::-1]
+    save_store(data, tmp_path / f"vol{suffix}", chunk_bytes=8, workers=2)
+    assert is_store(tmp_path / f"vol{suffix}")
+    np.testing.assert_array_equal(np.asarray(open_store(tmp_path / f"vol{suffix}")), data)
+
+
+@pytest.mark.parametrize("chunked", [False, True])
+def test_release_deletes_whole_outputs_only(tmp_path, chunked):
+    store = OutputStore(tmp_path / "out", chunked=chunked, min_bytes=0)
+    out = store.allocate((4, 2, 2), np.float32, "result")
+    path = store.output_path(out)
+    assert path is not None and path.exists()
+    assert not store.release(out[1:]) and not store.release(np.zeros((4, 2, 2)))
+
+    cache = ResultCache(2**20)
+    source = np.zeros(3)
+    cache.put("result", (source,), {}, out)
+    cache.discard_stored(path)
+    assert cache.get("result", (source,), {}) is None
+
+    assert store.release(out) and not path.exists()
+    assert not store.release(out)
+
+
+def test_persist_moves_whole_outputs(tmp_path):
+    store = OutputStore(tmp_path / "out", min_bytes=0)
+    out = store.allocate((3, 2), np.int8)
+    out[...] = 4
+    assert not store.persist(out[:1], tmp_path / "kept.npy")
+    assert store.persist(out, tmp_path / "kept.npy")
+    np.testing.assert_array_equal(np.load(tmp_path / "kept.npy"), np.full((3, 2), 4))
+    assert store.output_path(out) is None
@@ -0,0 +1,98 @@
+"""
+Tests of the surface detection kernels against plain numpy references.
+"""
+import itertools
+
+import numpy as np
+import pytest
+
+from napari_cool_tools_vol_proc._core.surfaces import brightest_peaks, continuous_surface, detect_surface, smooth_depth
+
+
+def _layout(data, depth_axis):
+    # (B-scans, A-scans, depth) view of data
+    tile_axis = 1 if depth_axis % 3 == 0 else 0
+    width_axis = ({0, 1, 2} - {depth_axis % 3, tile_axis}).pop()
+    return np.moveaxis(np.asarray(data), (tile_axis, width_axis, depth_axis), (0, 1, 2))
+
+
+def _smooth_reference(a, window):
+    half = window // 2
+    depth = a.shape[-1]
+    return np.stack([a[..., max(0, i - half):i + half + 1].mean(-1, dtype=np.float64) for i in range(depth)], axis=-1)
+
+
+def _peaks_reference(scan, top_k):
+    # local maxima (last sample of a plateau) of one A-scan, brightest top_k in increasing depth
+    depth = len(scan)
+    peaks = [i for i in range(depth) if (i == 0 or scan[i] >= scan[i - 1]) and (i == depth - 1 or scan[i] > scan[i + 1])]
+    chosen = sorted(sorted(peaks, key=lambda i: -scan[i])[:top_k])
+    return chosen + [-1] * (top_k - len(chosen))
+
+
+def _path_reference(bscan, max_jump):
+    # brute force brightest path over every depth sequence of the B-scan
+    width, depth = bscan.shape
+    best, best_path = -np.inf, None
+    for path in itertools.product(range(depth), repeat=width):
+        if all(abs(a - b) <= max_jump for a, b in zip(path, path[1:])):
+            score = bscan[np.arange(width), path].sum()
+            if score > best:
+                best, best_path = score, path
+    return best_path
+
+
+@pytest.mark.parametrize("window", [1, 2, 3, 9, 30])
+def test_smooth_depth_matches_reference(window):
+    a = np.random.default_rng(0).random((3, 4, 11)).astype(np.float32)
+    np.testing.assert_allclose(smooth_depth(a, window), _smooth_reference(a, window), rtol=1e-6)
+
+
+@pytest.mark.parametrize("depth_axis", [0, 1, 2])
+@pytest.mark.parametrize("smooth", [1, 5])
+@pytest.mark.parametrize("chunk_bytes, workers", [(1, 1), (1, 3), (2**20, 0)])
+def test_argmax_surface_matches_reference(depth_axis, smooth, chunk_bytes, workers):
+    data = np.random.default_rng(1).integers(0, 255, (7, 8, 9)).astype(np.uint8)
+    result = detect_surface(data, depth_axis=depth_axis, smooth=smooth, chunk_bytes=chunk_bytes, workers=workers)
+    assert result.dtype == np.int32
+    np.testing.assert_array_equal(result, _smooth_reference(_layout(data, depth_axis), smooth).argmax(-1))
+
+
+@pytest.mark.parametrize("top_k", [2, 3, 20])
+def test_top_k_surfaces_match_reference(top_k):
+    data = np.random.default_rng(2).random((4, 12, 5))
+    result = detect_surface(data, smooth=3, top_k=top_k, chunk_bytes=1, workers=2)
+    smoothed = _smooth_reference(_layout(data, 1), 3)
+    expected = np.array([[_peaks_reference(scan, top_k) for scan in bscan] for bscan in smoothed])
+    np.testing.assert_array_equal(result, np.moveaxis(expected, -1, 0))
+
+
+def test_brightest_peaks_handle_plateaus_and_flat_scans():
+    scans = np.array([[0, 2, 2, 1, 3, 3], [1, 1, 1, 1, 1, 1], [5, 4, 3, 2, 1, 0]], dtype=float)
+    np.testing.assert_array_equal(brightest_peaks(scans, 2), [_peaks_reference(scan, 2) for scan in scans])
+
+
+@pytest.mark.parametrize("max_jump", [1, 2])
+def test_continuous_surface_matches_brute_force(max_jump):
+    smoothed = np.random.default_rng(3).random((3, 5, 4))
+    expected = [_path_reference(bscan, max_jump) for bscan in smoothed]
+    np.testing.assert_array_equal(continuous_surface(smoothed, max_jump), expected)
+    data = np.moveaxis(smoothed, 2, 1)
+    np.testing.assert_array_equal(detect_surface(data, smooth=1, max_jump=max_jump, chunk_bytes=1, workers=2), expected)
+
+
+def test_surfaces_of_non_contiguous_and_length_one_input():
+    data = np.random.default_rng(4).random((10, 6, 8)).transpose(1, 2, 0)[:, ::2]
+    np.testing.assert_array_equal(detect_surface(data, depth_axis=2, smooth=3), _smooth_reference(data, 3).argmax(-1))
+    single = np.random.default_rng(5).random((2, 1, 3))
+    np.testing.assert_array_equal(detect_surface(single, smooth=3), np.zeros((2, 3)))
+    np.testing.assert_array_equal(detect_surface(single, smooth=1, max_jump=1), np.zeros((2, 3)))
+    assert detect_surface(single, top_k=2).tolist() == [[[0] * 3] * 2, [[-1] * 3] * 2]
+
+
+def test_detect_surface_rejects_bad_arguments():
+    for kwargs in ({"top_k": 0}, {"top_k": 2, "max_jump": 1}):
+        with pytest.raises(ValueError):
+            detect_surface(np.zeros((2, 3, 4)), **kwargs)
+    with pytest.raises(ValueError):
+        detect_surface(np.zeros((3, 4)))
@@ -0,0 +1,79 @@
+"""
+Tests of the tiling helpers against plain numpy references.
+"""
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from napari_cool_tools_vol_proc._core.tiling import axis_index, map_tiles, resolve_workers, split_axis, split_ranges, tile_ranges
+
+
+@pytest.mark.parametrize("length, tile_len", [(0, 3), (1, 3), (7, 3), (9, 3), (5, 0), (4, 10)])
+def test_tile_ranges_cover_the_axis_in_order(length, tile_len):
+    ranges = tile_ranges(length, tile_len)
+    assert [i for start, stop in ranges for i in range(start, stop)] == list(range(length))
+    assert all(0 < stop - start <= max(1, tile_len) for start, stop in ranges)
+
+
+@pytest.mark.parametrize("length, tiles", [(0, 4), (1, 4), (10, 3), (10, 10), (3, 8)])
+def test_split_ranges_are_near_equal(length, tiles):
+    ranges = split_ranges(length, tiles)
+    assert [i for start, stop in ranges for i in range(start, stop)] == list(range(length))
+    sizes = [stop - start for start, stop in ranges]
+    assert len(ranges) <= max(1, tiles) and max(sizes) - min(sizes) <= 1
+
+
+def test_axis_index_and_split_axis():
+    data = np.arange(24).reshape(2, 3, 4)
+    np.testing.assert_array_equal(data[axis_index(3, 1, slice(1, 3))], data[:, 1:3])
+    np.testing.assert_array_equal(data[axis_index(3, 2, 0)], data[..., 0])
+    assert split_axis((2, 3, 4)) == 2 and split_axis((2, 3, 4), 2) == 1
+    assert split_axis((1, 5, 1), 1) is None
+    assert resolve_workers(3) == 3 and resolve_workers(0) >= 1 and resolve_workers(None) >= 1
+
+
+@pytest.mark.parametrize("workers", [1, 2, 8])
+def test_map_tiles_yields_results_in_range_order(workers):
+    data = np.random.default_rng(0).random((37, 5))
+    out = np.empty(37)
+
+    def run(start, stop):
+        # later tiles finish first
+        time.sleep(0.001 * (37 - start) / 37)
+        out[start:stop] = data[start:stop].sum(1)
+        return start
+
+    ranges = tile_ranges(37, 4)
+    assert list(map_tiles(run, ranges, workers)) == [start for start, _ in ranges]
+    np.testing.assert_allclose(out, data.sum(1))
+
+
+def test_map_tiles_bounds_tiles_in_flight():
+    workers = 2
+    lock = threading.Lock()
+    started = []
+
+    def run(start, stop):
+        with lock:
+            started.append(start)
+        return start
+
+    tiles = map_tiles(run, tile_ranges(100, 1), workers)
+    next(tiles)
+    time.sleep(0.05)
+    assert len(started) <= 2 * workers + 1
+    tiles.close()
+    time.sleep(0.05)
+    assert len(started) < 100
+
+
+def test_map_tiles_propagates_tile_errors():
+    def run(start, stop):
+        if start == 3:
+            raise RuntimeError("tile 3")
+        return start
+
+    with pytest.raises(RuntimeError, match="tile 3"):
+        list(map_tiles(run, tile_ranges(8, 1), 2))